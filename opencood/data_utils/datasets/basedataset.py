@@ -8,6 +8,7 @@ Basedataset class for all kinds of fusion.
 
 import os
 import math
+import sys
 from collections import OrderedDict
 
 import torch
@@ -16,9 +17,15 @@ from torch.utils.data import Dataset
 
 import opencood.utils.pcd_utils as pcd_utils
 from opencood.data_utils.augmentor.data_augmentor import DataAugmentor
-from opencood.hypes_yaml.yaml_utils import load_yaml
+from opencood.data_utils.datasets.cav_descriptor import CavDescriptor
+from opencood.data_utils.datasets.frame_prefetcher import FramePrefetcher
+from opencood.data_utils.datasets.dataset_index import DatasetIndex, \
+    DATASET_INDEX_FILE, scan_dataset_tree
+from opencood.hypes_yaml.yaml_utils import load_frame_yaml, FRAME_YAML_CACHE
 from opencood.utils.pcd_utils import downsample_lidar_minimum
-from opencood.utils.transformation_utils import x1_to_x2
+from opencood.utils.lidar_store import LidarStore
+from opencood.utils.transformation_utils import x_to_world_batch, \
+    rigid_inverse
 import random
 
 class BaseDataset(Dataset):
@@ -92,6 +99,11 @@ class BaseDataset(Dataset):
             self.backbone_delay = \
                 params['wild_setting']['backbone_delay'] \
                     if 'backbone_delay' in params['wild_setting'] else 0
+            # whether the delays are drawn per epoch for the whole dataset
+            # instead of per sample in __getitem__
+            self.delay_schedule_flag = \
+                params['wild_setting']['delay_schedule'] \
+                    if 'delay_schedule' in params['wild_setting'] else False
 
         else:
             self.async_flag = False
@@ -103,6 +115,38 @@ class BaseDataset(Dataset):
             self.data_size = 0  # Mb (Megabits)
             self.transmission_speed = 27  # Mbps
             self.backbone_delay = 0  # ms
+            self.delay_schedule_flag = False
+
+        # during sequential inference the historical ego frames can be
+        # restored from the temporal feature cache of the model, in which case
+        # their lidar is not loaded. Enabled by tools/inference.py.
+        self.history_from_cache = False
+
+        # point clouds loaded for the current sample, set by the delay sweep
+        # so that the frames shared by all the evaluated delays are only
+        # read once
+        self.lidar_memo = None
+
+        # lookahead reader of the next frames for sequential playback,
+        # enabled by enable_prefetch
+        self.prefetcher = None
+
+        # capacity of the process-wide parsed frame yaml cache
+        if 'yaml_cache_size' in params:
+            FRAME_YAML_CACHE.resize(params['yaml_cache_size'])
+
+        # optional cache of the decoded pcd files shared by all the
+        # dataloader workers, its byte budget is given in MB
+        self.frame_cache = None
+        if 'frame_cache_mb' in params and params['frame_cache_mb'] > 0:
+            # imported here, multiprocessing.shared_memory only exists on
+            # python >= 3.8
+            assert sys.version_info >= (3, 8), \
+                'frame_cache_mb requires python >= 3.8'
+            from opencood.utils.shared_frame_cache import \
+                get_shared_frame_cache
+            self.frame_cache = get_shared_frame_cache(
+                params['frame_cache_mb'])
 
         if self.train:
             root_dir = params['root_dir']
@@ -115,36 +159,32 @@ class BaseDataset(Dataset):
         else:
             self.max_cav = params['train_params']['max_cav']
 
-        # first load all paths of different scenarios
-        scenario_folders = sorted([os.path.join(root_dir, x)
-                                   for x in os.listdir(root_dir) if
-                                   os.path.isdir(os.path.join(root_dir, x))])
+        # first load all paths of different scenarios. If an offline index
+        # has been built for this split, the scenario tree and the frame
+        # metadata are read from it instead of the file system.
+        self.dataset_index = None
+        index_file = os.path.join(root_dir, DATASET_INDEX_FILE)
+        if os.path.exists(index_file):
+            self.dataset_index = DatasetIndex(index_file)
+            scenario_tree = self.dataset_index.scenario_tree()
+        else:
+            scenario_tree = scan_dataset_tree(root_dir)
+        # if the pcd files have been packed by tools/build_lidar_store.py,
+        # the point clouds are read from the memory-mapped store
+        self.lidar_store = LidarStore(root_dir) \
+            if LidarStore.exists(root_dir) else None
         # Structure: {scenario_id : {cav_1 : {timestamp1 : {yaml: path,
-        # lidar: path, cameras:list of path}}}}
+        # lidar: path, cameras:list of path, frame: index row}}}}
         self.scenario_database = OrderedDict()
         self.len_record = []
-        # print('len scenario_folders:', len(scenario_folders),scenario_folders)
-        # scenario_folders = scenario_folders[3:5]
-        # print('len scenario_folders:', len(scenario_folders), scenario_folders)
-        # print('len scenario_folders 2:',len(scenario_folders))
         # loop over all scenarios
-        for (i, scenario_folder) in enumerate(scenario_folders):
+        for (i, (scenario_name, cav_dict)) in \
+                enumerate(scenario_tree.items()):
             self.scenario_database.update({i: OrderedDict()})
-
-            # at least 1 cav should show up
-            cav_list = sorted([x for x in os.listdir(scenario_folder)
-                               if os.path.isdir(
-                    os.path.join(scenario_folder, x))])
-            assert len(cav_list) > 0
-
-            # roadside unit data's id is always negative, so here we want to
-            # make sure they will be in the end of the list as they shouldn't
-            # be ego vehicle.
-            if int(cav_list[0]) < 0:
-                cav_list = cav_list[1:] + [cav_list[0]]
+            scenario_folder = os.path.join(root_dir, scenario_name)
 
             # loop over all CAV data
-            for (j, cav_id) in enumerate(cav_list):
+            for (j, (cav_id, timestamp_dict)) in enumerate(cav_dict.items()):
                 if j > self.max_cav - 2 - 1:
                     print('too many cavs')
                     break
@@ -154,13 +194,9 @@ class BaseDataset(Dataset):
                 cav_path = os.path.join(scenario_folder, cav_id)
 
                 # use the frame number as key, the full path as the values
-                yaml_files = \
-                    sorted([os.path.join(cav_path, x)
-                            for x in os.listdir(cav_path) if
-                            x.endswith('.yaml') and 'additional' not in x])
-                timestamps = self.extract_timestamps(yaml_files)
+                timestamps = list(timestamp_dict.keys())
 
-                for timestamp in timestamps:
+                for timestamp, frame_row in timestamp_dict.items():
                     self.scenario_database[i][cav_id][timestamp] = \
                         OrderedDict()
 
@@ -176,6 +212,8 @@ class BaseDataset(Dataset):
                         lidar_file
                     self.scenario_database[i][cav_id][timestamp]['camera0'] = \
                         camera_files
+                    self.scenario_database[i][cav_id][timestamp]['frame'] = \
+                        frame_row
                 # Assume all cavs will have the same timestamps length. Thus
                 # we only need to calculate for the first vehicle in the
                 # scene.
@@ -190,6 +228,12 @@ class BaseDataset(Dataset):
                 else:
                     self.scenario_database[i][cav_id]['ego'] = False
 
+        # (num_samples, num_cav) delay of each cav of each sample
+        self.delay_schedule = None
+        self._distance_table = None
+        if self.delay_schedule_flag:
+            self.set_epoch(0)
+
     def __len__(self):
         return self.len_record[-1]
 
@@ -217,20 +261,15 @@ class BaseDataset(Dataset):
         Returns
         -------
         data : dict
-            The dictionary contains loaded yaml params and lidar data for
-            each cav.
+            The dictionary contains a CavDescriptor for each cav. Its yaml
+            params and lidar data are loaded on first access.
         """
-        # we loop the accumulated length list to see get the scenario index
-        scenario_index = 0
-        for i, ele in enumerate(self.len_record):
-            if idx < ele:
-                scenario_index = i
-                break
+        if self.prefetcher is not None:
+            self.prefetcher.prefetch(self, idx, uni_time_delay)
+
+        scenario_index, timestamp_index = self.locate_sample(idx)
         scenario_database = self.scenario_database[scenario_index]
 
-        # check the timestamp index
-        timestamp_index = idx if scenario_index == 0 else \
-            idx - self.len_record[scenario_index - 1]
         # retrieve the corresponding timestamp key
         timestamp_key = self.return_timestamp_key(scenario_database,
                                                   timestamp_index)
@@ -247,21 +286,16 @@ class BaseDataset(Dataset):
         # load files for all CAVs
         cavs_num = len(scenario_database.items())
         append_col = 0
-        for cav_id, cav_content in scenario_database.items():
+        for j, (cav_id, cav_content) in enumerate(scenario_database.items()):
             ## perpare parameters for timestamp_delay
-            cur_params = load_yaml(cav_content[timestamp_key]['yaml'])
-            cur_ego_params = load_yaml(ego_cav_content[timestamp_key]['yaml'])
-
-            cur_ego_lidar_pose = cur_ego_params['lidar_pose']
-            cur_cav_lidar_pose = cur_params['lidar_pose']
-            distance = \
-                math.sqrt((cur_cav_lidar_pose[0] -
-                           cur_ego_lidar_pose[0]) ** 2 + (
-                                  cur_cav_lidar_pose[1] - cur_ego_lidar_pose[
-                              1]) ** 2)
+            # the distance has been computed by calc_dist_to_ego
+            distance = cav_content['distance_to_ego']
             # calculate delay for this vehicle
-            timestamp_delay = \
-                self.time_delay_calculation(cav_content['ego'], cavs_num, distance, uni_time_delay)
+            if self.delay_schedule is not None and uni_time_delay < 0:
+                timestamp_delay = int(self.delay_schedule[idx, j])
+            else:
+                timestamp_delay = \
+                    self.time_delay_calculation(cav_content['ego'], cavs_num, distance, uni_time_delay)
             # print('timestamp_delay 1:',cav_content['ego'],cav_id,timestamp_delay,append_col,uni_time_delay)
             # if not self.train and timestamp_delay>=3:
             #     # print('timestamp_delay 2:', cav_content['ego'], timestamp_delay, uni_time_delay)
@@ -272,21 +306,26 @@ class BaseDataset(Dataset):
             timestamp_key_delay = self.return_timestamp_key(scenario_database,
                                                             timestamp_index_delay)
 
-            data[cav_id] = OrderedDict()
+            data[cav_id] = CavDescriptor()
             data[cav_id]['ego'] = cav_content['ego']
             # add time delay to vehicle parameters
             data[cav_id]['time_delay'] = timestamp_delay
-            # load the corresponding data into the dictionary
-            data[cav_id]['params'] = self.reform_param(cav_content,
-                                                       ego_cav_content,
-                                                       timestamp_key, ## time current
-                                                       timestamp_key_delay, ## time delay
-                                                       cur_ego_pose_flag)
-            data[cav_id]['lidar_np'] = \
-                pcd_utils.pcd_to_np(cav_content[timestamp_key_delay]['lidar'])
+            data[cav_id]['lidar_file'] = \
+                cav_content[timestamp_key_delay]['lidar']
+            # the parameters and the lidar are only loaded when they are used
+            data[cav_id].set_lazy('params', self.reform_param,
+                                  cav_content,
+                                  ego_cav_content,
+                                  timestamp_key, ## time current
+                                  timestamp_key_delay, ## time delay
+                                  cur_ego_pose_flag)
+            data[cav_id].set_lazy('lidar_np', self.load_lidar,
+                                  cav_content, timestamp_key_delay)
+            data[cav_id]['frame_key'] = '%d/%s/%s' % (scenario_index, cav_id,
+                                                      timestamp_key_delay)
             if data[cav_id]['ego'] == True:
                 for idxadd in [10000,10001]:
-                    data[str(int(cav_id)+idxadd)] = OrderedDict()
+                    data[str(int(cav_id)+idxadd)] = CavDescriptor()
                     data[str(int(cav_id)+idxadd)]['ego'] = False
                     timestamp_delay = idxadd - 10000 + 1
                     # print("timestamp_delay:",cav_content['ego'],timestamp_delay,timestamp_index)
@@ -300,16 +339,179 @@ class BaseDataset(Dataset):
                     data[str(int(cav_id)+idxadd)]['time_delay'] = timestamp_delay
                     # load the corresponding data into the dictionary
 
-                    data[str(int(cav_id)+idxadd)]['params'] = self.reform_param(cav_content,
-                                                               ego_cav_content,
-                                                               timestamp_key,  ## time current
-                                                               timestamp_key_delay,  ## time delay
-                                                               cur_ego_pose_flag)
-                    data[str(int(cav_id)+idxadd)]['lidar_np'] = \
-                        pcd_utils.pcd_to_np(cav_content[timestamp_key_delay]['lidar'])
+                    data[str(int(cav_id)+idxadd)]['lidar_file'] = \
+                        cav_content[timestamp_key_delay]['lidar']
+                    data[str(int(cav_id)+idxadd)].set_lazy(
+                        'params', self.reform_param,
+                        cav_content,
+                        ego_cav_content,
+                        timestamp_key,  ## time current
+                        timestamp_key_delay,  ## time delay
+                        cur_ego_pose_flag)
+                    # the historical ego frame was the current ego frame of
+                    # an earlier sample, so it shares the cache key
+                    if self.history_from_cache:
+                        data[str(int(cav_id)+idxadd)]['lidar_np'] = None
+                    else:
+                        data[str(int(cav_id)+idxadd)].set_lazy(
+                            'lidar_np', self.load_lidar,
+                            cav_content, timestamp_key_delay)
+                    data[str(int(cav_id)+idxadd)]['frame_key'] = \
+                        '%d/%s/%s' % (scenario_index, cav_id,
+                                      timestamp_key_delay)
 
         return data
 
+    def enable_prefetch(self, lookahead, num_threads=4, report_interval=0):
+        """
+        Prefetch the frames of the next lookahead samples of the scenario on
+        a thread pool. Only useful when the samples are loaded in order.
+
+        Parameters
+        ----------
+        lookahead : int
+            Number of next samples to prefetch.
+
+        num_threads : int
+            Number of reading threads per dataloader worker.
+
+        report_interval : int
+            Each worker prints its statistics every report_interval lookups,
+            0 to disable.
+        """
+        self.prefetcher = FramePrefetcher(lookahead, num_threads,
+                                          report_interval=report_interval)
+
+    def locate_sample(self, idx):
+        """
+        Return the scenario index and the timestamp index of a sample.
+        """
+        # we loop the accumulated length list to see get the scenario index
+        scenario_index = 0
+        for i, ele in enumerate(self.len_record):
+            if idx < ele:
+                scenario_index = i
+                break
+
+        # check the timestamp index
+        timestamp_index = idx if scenario_index == 0 else \
+            idx - self.len_record[scenario_index - 1]
+        return scenario_index, timestamp_index
+
+    def get_distance_table(self):
+        """
+        Return the distance of every cav to the ego at every sample. The
+        lidar poses do not change between epochs, so it is computed once.
+
+        Returns
+        -------
+        distance_table : np.ndarray
+            Shape (num_samples, num_cav), nan for the missing cavs.
+        """
+        if self._distance_table is not None:
+            return self._distance_table
+
+        num_cav = max(len(scenario_database) for scenario_database in
+                      self.scenario_database.values())
+        distance_table = np.full((len(self), num_cav), np.nan)
+        idx = 0
+        for scenario_database in self.scenario_database.values():
+            cav_contents = list(scenario_database.values())
+            timestamp_keys = [key for key in cav_contents[0]
+                              if key not in ['ego', 'distance_to_ego']]
+            for timestamp_key in timestamp_keys:
+                # (num_cav, 2) x, y of the lidar poses, the ego is first
+                poses = np.array([self.load_frame_params(
+                    cav_content, timestamp_key)['lidar_pose'][:2]
+                                  for cav_content in cav_contents])
+                distance_table[idx, :len(cav_contents)] = \
+                    np.linalg.norm(poses - poses[0], axis=1)
+                idx += 1
+
+        self._distance_table = distance_table
+        return distance_table
+
+    def set_epoch(self, epoch):
+        """
+        Draw the time delays of all the samples of an epoch at once. The
+        draws only depend on the seed and the epoch, so runs are
+        reproducible and the frames needed by each sample are known before
+        it is loaded.
+
+        Parameters
+        ----------
+        epoch : int
+            The current epoch.
+        """
+        if not self.delay_schedule_flag:
+            return
+        distance = self.get_distance_table()
+        rng = np.random.RandomState(self.seed + epoch)
+        shape = distance.shape
+
+        if self.async_mode == 'iosi':
+            # the same model as time_delay_calculation
+            noise = -rng.randint(95, 111, shape)
+            T_trans_time = self.trans_time_batch(10, 5, distance, noise)
+            T_sensor_time = rng.randint(0, 101, shape)
+            T_compute_time = rng.randint(10, 41, shape)
+            T_other_time = rng.randint(0, 201, shape)
+            T_time_delay = T_trans_time + T_sensor_time + T_compute_time + \
+                T_other_time
+            time_delay = np.nan_to_num(T_time_delay).astype(np.int64) // 100
+        else:
+            time_delay = np.zeros(shape, dtype=np.int64)
+
+        if not self.async_flag:
+            time_delay[:] = 0
+        # there is not time delay for ego vehicle
+        time_delay[:, 0] = 0
+
+        # the delayed frame can not be earlier than the first frame
+        timestamp_index = np.array([self.locate_sample(idx)[1]
+                                    for idx in range(len(self))])
+        self.delay_schedule = np.minimum(time_delay,
+                                         timestamp_index[:, np.newaxis])
+
+    def get_sample_frames(self, idx, uni_time_delay=-1):
+        """
+        Return the frames loaded by retrieve_base_data for a sample. The
+        frames of the other cavs are only known with the delay schedule or
+        a uniform delay, otherwise only the ego frames are returned.
+
+        Parameters
+        ----------
+        idx : int
+            Index given by dataloader.
+
+        uni_time_delay : int
+            The uniform time delay, -1 for the scheduled delay.
+
+        Returns
+        -------
+        frames : list
+            The (cav_content, timestamp_key) of every loaded frame.
+        """
+        scenario_index, timestamp_index = self.locate_sample(idx)
+        scenario_database = self.scenario_database[scenario_index]
+
+        frames = []
+        for j, cav_content in enumerate(scenario_database.values()):
+            if cav_content['ego']:
+                delays = [0] + ([] if self.history_from_cache else [1, 2])
+            elif uni_time_delay >= 0:
+                delays = [uni_time_delay]
+            elif self.delay_schedule is not None:
+                delays = [int(self.delay_schedule[idx, j])]
+            else:
+                delays = []
+            for timestamp_delay in delays:
+                timestamp_index_delay = max(0, timestamp_index -
+                                            timestamp_delay)
+                frames.append((cav_content, self.return_timestamp_key(
+                    scenario_database, timestamp_index_delay)))
+        return frames
+
     @staticmethod
     def extract_timestamps(yaml_files):
         """
@@ -361,6 +563,83 @@ class BaseDataset(Dataset):
 
         return timestamp_key
 
+    def load_frame_params(self, cav_content, timestamp):
+        """
+        Load the metadata (lidar pose, speed, annotations) of a frame.
+
+        Parameters
+        ----------
+        cav_content : dict
+            Dictionary that contains all file paths in the current cav/rsu.
+
+        timestamp : str
+            The timestamp key of the frame.
+
+        Returns
+        -------
+        params : dict
+            The frame metadata. A new top-level dict is returned on each call.
+        """
+        frame_row = cav_content[timestamp]['frame']
+        if frame_row is not None:
+            return self.dataset_index.frame_params(frame_row)
+        return load_frame_yaml(cav_content[timestamp]['yaml'])
+
+    def load_lidar(self, cav_content, timestamp):
+        """
+        Load the point cloud of a frame.
+
+        Parameters
+        ----------
+        cav_content : dict
+            Dictionary that contains all file paths in the current cav/rsu.
+
+        timestamp : str
+            The timestamp key of the frame.
+
+        Returns
+        -------
+        lidar_np : np.ndarray
+            The lidar data, shape:(n, 4).
+        """
+        lidar_file = cav_content[timestamp]['lidar']
+        if self.lidar_memo is not None and lidar_file in self.lidar_memo:
+            return self.lidar_memo[lidar_file]
+        lidar_np = self.prefetcher.get(lidar_file) \
+            if self.prefetcher is not None else None
+        if lidar_np is None:
+            lidar_np = self.read_lidar(lidar_file)
+        if self.lidar_memo is not None:
+            self.lidar_memo[lidar_file] = lidar_np
+        return lidar_np
+
+    def read_lidar(self, lidar_file):
+        """
+        Read a point cloud from the lidar store, the shared frame cache or
+        the pcd file.
+
+        Parameters
+        ----------
+        lidar_file : str
+            The pcd file path.
+
+        Returns
+        -------
+        lidar_np : np.ndarray
+            The lidar data, shape:(n, 4).
+        """
+        if self.lidar_store is not None and lidar_file in self.lidar_store:
+            return self.lidar_store.load(lidar_file)
+        if self.frame_cache is not None:
+            # the memory-mapped store is already shared through the page
+            # cache, only the decoded pcd files go through the frame cache
+            lidar_np = self.frame_cache.get(lidar_file)
+            if lidar_np is None:
+                lidar_np = pcd_utils.pcd_to_np(lidar_file)
+                self.frame_cache.put(lidar_file, lidar_np)
+            return lidar_np
+        return pcd_utils.pcd_to_np(lidar_file)
+
     def calc_dist_to_ego(self, scenario_database, timestamp_key):
         """
         Calculate the distance to ego for each cav.
@@ -372,7 +651,8 @@ class BaseDataset(Dataset):
             if cav_content['ego']:
                 ego_cav_content = cav_content
                 ego_lidar_pose = \
-                    load_yaml(cav_content[timestamp_key]['yaml'])['lidar_pose']
+                    self.load_frame_params(cav_content,
+                                           timestamp_key)['lidar_pose']
                 break
 
         assert ego_lidar_pose is not None
@@ -380,7 +660,8 @@ class BaseDataset(Dataset):
         # calculate the distance
         for cav_id, cav_content in scenario_database.items():
             cur_lidar_pose = \
-                load_yaml(cav_content[timestamp_key]['yaml'])['lidar_pose']
+                self.load_frame_params(cav_content,
+                                       timestamp_key)['lidar_pose']
             distance = \
                 math.sqrt((cur_lidar_pose[0] -
                            ego_lidar_pose[0]) ** 2 +
@@ -401,6 +682,20 @@ class BaseDataset(Dataset):
         PPN = P - PL - N
         T = F / (B * math.log2(1 + math.pow(10, 0.1 * PPN))) * 1000
         return T
+    @staticmethod
+    def trans_time_batch(bandwidth, cavs_num, distance2ego, noise):
+        """
+        Vectorized trans_time for arrays of distances and noise powers.
+        """
+        F = 1.06
+        B = bandwidth / cavs_num
+        P = 23
+        distance2ego = np.maximum(distance2ego, 1)
+        PL = 28 + 22 * np.log10(distance2ego) + 20 * math.log10(5.9)
+        PPN = P - PL - noise
+        T = F / (B * np.log2(1 + np.power(10, 0.1 * PPN))) * 1000
+        return T
+
     def time_delay_calculation(self, ego_flag, cavs_num, distance2ego, uni_time_delay):
         """
         Calculate the time delay for a certain vehicle.
@@ -488,11 +783,14 @@ class BaseDataset(Dataset):
         ------
         The merged parameters.
         """
-        cur_params = load_yaml(cav_content[timestamp_cur]['yaml'])
-        delay_params = load_yaml(cav_content[timestamp_delay]['yaml'])
+        # the frame metadata comes from the index or the frame yaml cache,
+        # delay_params is always a fresh dict so it can be modified safely
+        cur_params = self.load_frame_params(cav_content, timestamp_cur)
+        delay_params = self.load_frame_params(cav_content, timestamp_delay)
 
-        cur_ego_params = load_yaml(ego_content[timestamp_cur]['yaml'])
-        delay_ego_params = load_yaml(ego_content[timestamp_delay]['yaml'])
+        cur_ego_params = self.load_frame_params(ego_content, timestamp_cur)
+        delay_ego_params = self.load_frame_params(ego_content,
+                                                  timestamp_delay)
 
         # we need to calculate the transformation matrix from cav to ego
         # at the delayed timestamp
@@ -510,20 +808,27 @@ class BaseDataset(Dataset):
                                                     self.xyz_noise_std,
                                                     self.ryp_noise_std)
 
+        # all the poses are converted at once
+        delay_cav_to_world, cur_cav_to_world, delay_ego_to_world, \
+            cur_ego_to_world = x_to_world_batch([delay_cav_lidar_pose,
+                                                 cur_cav_lidar_pose,
+                                                 delay_ego_lidar_pose,
+                                                 cur_ego_lidar_pose])
+        world_to_cur_ego = rigid_inverse(cur_ego_to_world)
+
         if cur_ego_pose_flag:
-            transformation_matrix = x1_to_x2(delay_cav_lidar_pose,
-                                             cur_ego_lidar_pose)
+            transformation_matrix = np.dot(world_to_cur_ego,
+                                           delay_cav_to_world)
             spatial_correction_matrix = np.eye(4)
         else:
-            transformation_matrix = x1_to_x2(delay_cav_lidar_pose,
-                                             delay_ego_lidar_pose)
-            spatial_correction_matrix = x1_to_x2(delay_ego_lidar_pose,
-                                                 cur_ego_lidar_pose)
+            transformation_matrix = np.dot(rigid_inverse(delay_ego_to_world),
+                                           delay_cav_to_world)
+            spatial_correction_matrix = np.dot(world_to_cur_ego,
+                                               delay_ego_to_world)
         # This is only used for late fusion, as it did the transformation
         # in the postprocess, so we want the gt object transformation use
         # the correct one
-        gt_transformation_matrix = x1_to_x2(cur_cav_lidar_pose,
-                                            cur_ego_lidar_pose)
+        gt_transformation_matrix = np.dot(world_to_cur_ego, cur_cav_to_world)
 
         # we always use current timestamp's gt bbx to gain a fair evaluation
         delay_params['vehicles'] = cur_params['vehicles']
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Lazily loaded base data of a single cav
+"""
+from collections import OrderedDict
+
+
+class CavDescriptor(OrderedDict):
+    """
+    The base data of a cav in a sample. It behaves like the dictionary
+    returned by retrieve_base_data before, but the entries registered with
+    set_lazy, e.g. the point cloud and the yaml parameters, are only loaded
+    when a consumer accesses them for the first time. A cav that is never
+    used, e.g. the cavs not selected by the late fusion training or those
+    out of the communication range, is never read from the disk.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._loaders = {}
+        super(CavDescriptor, self).__init__(*args, **kwargs)
+
+    def set_lazy(self, key, loader, *args):
+        """
+        Register an entry that is loaded by loader(*args) on first access.
+
+        Parameters
+        ----------
+        key : str
+            The entry name, e.g. 'lidar_np'.
+
+        loader : callable
+            The function loading the entry.
+        """
+        OrderedDict.__setitem__(self, key, None)
+        self._loaders[key] = (loader, args)
+
+    def is_loaded(self, key):
+        """
+        Return whether the entry is loaded, without loading it.
+        """
+        return key in self and key not in self._loaders
+
+    def __getitem__(self, key):
+        if key in self._loaders:
+            loader, args = self._loaders.pop(key)
+            OrderedDict.__setitem__(self, key, loader(*args))
+        return OrderedDict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        self._loaders.pop(key, None)
+        OrderedDict.__setitem__(self, key, value)
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Offline columnar index of the dataset tree and the per-frame metadata
+(lidar pose, ego speed and vehicle annotations). The index is built once by
+`opencood/tools/build_dataset_index.py` and loaded by BaseDataset instead of
+walking the directory tree and parsing the frame yaml files.
+"""
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from opencood.hypes_yaml.yaml_utils import load_yaml
+from opencood.utils.box_utils import FrameObjects
+
+# default file name of the index, saved in the root of each split
+DATASET_INDEX_FILE = 'dataset_index.npz'
+
+
+def scan_dataset_tree(root_dir):
+    """
+    Walk the dataset folder and collect all scenarios, cavs and timestamps.
+
+    Parameters
+    ----------
+    root_dir : str
+        The split folder, e.g. V2XSet/train.
+
+    Returns
+    -------
+    scenario_tree : OrderedDict
+        {scenario_name : {cav_id : {timestamp : None}}}. The cavs are sorted
+        with roadside units (negative id) moved to the end.
+    """
+    scenario_tree = OrderedDict()
+    scenario_names = sorted([x for x in os.listdir(root_dir) if
+                             os.path.isdir(os.path.join(root_dir, x))])
+
+    for scenario_name in scenario_names:
+        scenario_folder = os.path.join(root_dir, scenario_name)
+        scenario_tree[scenario_name] = OrderedDict()
+
+        # at least 1 cav should show up
+        cav_list = sorted([x for x in os.listdir(scenario_folder)
+                           if os.path.isdir(
+                os.path.join(scenario_folder, x))])
+        assert len(cav_list) > 0
+
+        # roadside unit data's id is always negative, so here we want to
+        # make sure they will be in the end of the list as they shouldn't
+        # be ego vehicle.
+        if int(cav_list[0]) < 0:
+            cav_list = cav_list[1:] + [cav_list[0]]
+
+        for cav_id in cav_list:
+            cav_path = os.path.join(scenario_folder, cav_id)
+            yaml_files = sorted([x for x in os.listdir(cav_path) if
+                                 x.endswith('.yaml') and
+                                 'additional' not in x])
+            scenario_tree[scenario_name][cav_id] = OrderedDict(
+                (x.replace('.yaml', ''), None) for x in yaml_files)
+
+    return scenario_tree
+
+
+def build_dataset_index(root_dir):
+    """
+    Scan the split folder, parse every frame yaml and pack the metadata
+    into flat numpy arrays.
+
+    Parameters
+    ----------
+    root_dir : str
+        The split folder, e.g. V2XSet/train.
+
+    Returns
+    -------
+    index : dict
+        Columnar arrays. Cav rows point to their scenario, frame rows point
+        to their cav and to a contiguous slice of the object arrays.
+    """
+    scenario_tree = scan_dataset_tree(root_dir)
+
+    scenario_names = []
+    cav_ids, cav_scenario = [], []
+    frame_cav, timestamps, lidar_pose, ego_speed = [], [], [], []
+    object_start, object_count = [], []
+    object_ids, object_location, object_center, object_extent, \
+        object_angle = [], [], [], [], []
+
+    for scenario_name, cav_dict in scenario_tree.items():
+        scenario_names.append(scenario_name)
+        for cav_id, timestamp_dict in cav_dict.items():
+            cav_ids.append(cav_id)
+            cav_scenario.append(len(scenario_names) - 1)
+            cav_path = os.path.join(root_dir, scenario_name, cav_id)
+
+            for timestamp in timestamp_dict:
+                params = load_yaml(os.path.join(cav_path,
+                                                timestamp + '.yaml'))
+                frame_cav.append(len(cav_ids) - 1)
+                timestamps.append(timestamp)
+                lidar_pose.append(params['lidar_pose'])
+                ego_speed.append(params['ego_speed'])
+
+                vehicles = params['vehicles'] if params['vehicles'] else {}
+                object_start.append(len(object_ids))
+                object_count.append(len(vehicles))
+                for object_id, object_content in vehicles.items():
+                    object_ids.append(object_id)
+                    object_location.append(object_content['location'])
+                    object_center.append(object_content['center'])
+                    object_extent.append(object_content['extent'])
+                    object_angle.append(object_content['angle'])
+
+    index = {
+        'scenario_names': np.array(scenario_names, dtype=str),
+        'cav_ids': np.array(cav_ids, dtype=str),
+        'cav_scenario': np.array(cav_scenario, dtype=np.int32),
+        'frame_cav': np.array(frame_cav, dtype=np.int32),
+        'timestamps': np.array(timestamps, dtype=str),
+        'lidar_pose': np.array(lidar_pose, dtype=np.float64).reshape(-1, 6),
+        'ego_speed': np.array(ego_speed, dtype=np.float64),
+        'object_start': np.array(object_start, dtype=np.int64),
+        'object_count': np.array(object_count, dtype=np.int64),
+        'object_ids': np.array(object_ids, dtype=np.int64),
+        'object_location':
+            np.array(object_location, dtype=np.float64).reshape(-1, 3),
+        'object_center':
+            np.array(object_center, dtype=np.float64).reshape(-1, 3),
+        'object_extent':
+            np.array(object_extent, dtype=np.float64).reshape(-1, 3),
+        'object_angle':
+            np.array(object_angle, dtype=np.float64).reshape(-1, 3)}
+
+    return index
+
+
+def save_dataset_index(index, save_path):
+    """
+    Save the index arrays into a single npz file.
+
+    Parameters
+    ----------
+    index : dict
+        The output of build_dataset_index.
+
+    save_path : str
+        Output npz path.
+    """
+    np.savez(save_path, **index)
+
+
+class DatasetIndex(object):
+    """
+    Read-only view of a dataset index saved by save_dataset_index.
+
+    Parameters
+    ----------
+    index_file : str
+        Path to the npz index.
+    """
+
+    def __init__(self, index_file):
+        with np.load(index_file, allow_pickle=False) as data:
+            self.arrays = {k: data[k] for k in data.files}
+
+        self.lidar_pose = self.arrays['lidar_pose']
+        self.ego_speed = self.arrays['ego_speed']
+        self.object_start = self.arrays['object_start']
+        self.object_count = self.arrays['object_count']
+        self.object_ids = self.arrays['object_ids']
+        self.object_extent = self.arrays['object_extent']
+        # [x, y, z, roll, yaw, pitch] of the bbx centers, so a frame only
+        # reads a slice of each array
+        self.object_poses = np.concatenate(
+            [self.arrays['object_location'] + self.arrays['object_center'],
+             self.arrays['object_angle']], axis=1)
+
+    def __len__(self):
+        return self.lidar_pose.shape[0]
+
+    def scenario_tree(self):
+        """
+        Rebuild the scenario tree from the index without touching the file
+        system.
+
+        Returns
+        -------
+        scenario_tree : OrderedDict
+            {scenario_name : {cav_id : {timestamp : frame row}}}.
+        """
+        scenario_names = self.arrays['scenario_names'].tolist()
+        cav_ids = self.arrays['cav_ids'].tolist()
+        cav_scenario = self.arrays['cav_scenario'].tolist()
+        frame_cav = self.arrays['frame_cav'].tolist()
+        timestamps = self.arrays['timestamps'].tolist()
+
+        scenario_tree = OrderedDict(
+            (scenario_name, OrderedDict()) for scenario_name in
+            scenario_names)
+        cav_dicts = []
+        for cav_id, scenario in zip(cav_ids, cav_scenario):
+            cav_dict = OrderedDict()
+            scenario_tree[scenario_names[scenario]][cav_id] = cav_dict
+            cav_dicts.append(cav_dict)
+
+        for row, (cav, timestamp) in enumerate(zip(frame_cav, timestamps)):
+            cav_dicts[cav][timestamp] = row
+
+        return scenario_tree
+
+    def frame_params(self, row):
+        """
+        Return the metadata of one frame. The objects are slices of the
+        index arrays instead of the vehicles dict of the frame yaml.
+
+        Parameters
+        ----------
+        row : int
+            Frame row in the index.
+
+        Returns
+        -------
+        params : dict
+            Contains lidar_pose, ego_speed and vehicles as FrameObjects.
+        """
+        start = self.object_start[row]
+        end = start + self.object_count[row]
+
+        return {'lidar_pose': self.lidar_pose[row].tolist(),
+                'ego_speed': float(self.ego_speed[row]),
+                'vehicles': FrameObjects(self.object_ids[start:end],
+                                         self.object_poses[start:end],
+                                         self.object_extent[start:end])}
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Dataset wrapper evaluating every frame under several time delays at once
+"""
+from torch.utils.data import Dataset
+
+
+class DelaySweepDataset(Dataset):
+    """
+    Wrap an intermediate fusion dataset so that each item contains the same
+    frame under all the evaluated uniform time delays. A single pass over
+    the validation set then replaces one pass per delay. Each item holds the
+    processed samples of all the delays, so a dataloader worker needs about
+    len(uni_time_delay_list) times the memory of a single sample.
+
+    Parameters
+    ----------
+    dataset : opencood.data_utils.datasets.IntermediateFusionDataset
+        The wrapped dataset.
+
+    uni_time_delay_list : list
+        The evaluated uniform time delays, -1 for the simulated delay.
+    """
+
+    def __init__(self, dataset, uni_time_delay_list):
+        assert hasattr(dataset, 'get_delay_sweep'), \
+            'The delay sweep requires an intermediate fusion dataset'
+        self.dataset = dataset
+        self.uni_time_delay_list = uni_time_delay_list
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, idx):
+        return self.dataset.get_delay_sweep(idx, self.uni_time_delay_list)
+
+    def collate_batch_test(self, batch):
+        """
+        Collate the sample of each delay separately.
+
+        Returns
+        -------
+        batch_list : list
+            The test batch of each delay, in the order of
+            uni_time_delay_list.
+        """
+        assert len(batch) <= 1, "Batch size 1 is required during testing!"
+        return [self.dataset.collate_batch_test([sample])
+                for sample in batch[0]]
@@ -33,6 +33,11 @@ class EarlyFusionDataset(basedataset.BaseDataset):
         self.pre_processor = build_preprocessor(params['preprocess'],
                                                 train)
         self.post_processor = build_postprocessor(params['postprocess'], train)
+        # the labels are only generated on the training device by the
+        # intermediate fusion dataset
+        assert not ('label_on_device' in params['postprocess'] and
+                    params['postprocess']['label_on_device']), \
+            'label_on_device is only supported by IntermediateFusionDataset'
 
     def __getitem__(self, idx):
         base_data_dict = self.retrieve_base_data(idx)
@@ -56,6 +61,8 @@ class EarlyFusionDataset(basedataset.BaseDataset):
         projected_lidar_stack = []
         object_stack = []
         object_id_stack = []
+        # objects seen by several cavs are projected to the ego only once
+        object_cache = {}
 
         # loop over all CAVs to process information
         for cav_id, selected_cav_base in base_data_dict.items():
@@ -71,7 +78,8 @@ class EarlyFusionDataset(basedataset.BaseDataset):
 
             selected_cav_processed = self.get_item_single_car(
                 selected_cav_base,
-                ego_lidar_pose)
+                ego_lidar_pose,
+                object_cache)
             # all these lidar and object coordinates are projected to ego
             # already.
             projected_lidar_stack.append(
@@ -146,7 +154,8 @@ class EarlyFusionDataset(basedataset.BaseDataset):
 
         return processed_data_dict
 
-    def get_item_single_car(self, selected_cav_base, ego_pose):
+    def get_item_single_car(self, selected_cav_base, ego_pose,
+                            object_cache=None):
         """
         Project the lidar and bbx to ego space first, and then do clipping.
 
@@ -156,6 +165,8 @@ class EarlyFusionDataset(basedataset.BaseDataset):
             The dictionary contains a single CAV's raw information.
         ego_pose : list
             The ego vehicle lidar pose under world coordinate.
+        object_cache : dict
+            The objects already projected to the ego pose by the other cavs.
 
         Returns
         -------
@@ -172,7 +183,8 @@ class EarlyFusionDataset(basedataset.BaseDataset):
         # retrieve objects under ego coordinates
         object_bbx_center, object_bbx_mask, object_ids = \
             self.post_processor.generate_object_center([selected_cav_base],
-                                                       ego_pose)
+                                                       ego_pose,
+                                                       object_cache)
 
         # filter lidar
         lidar_np = selected_cav_base['lidar_np']
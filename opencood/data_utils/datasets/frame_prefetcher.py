@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Lookahead prefetcher of the frames of the next samples of a scenario
+"""
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from torch.utils.data import get_worker_info
+
+
+class FramePrefetcher(object):
+    """
+    Read the LiDAR and the metadata of the next samples of the current
+    scenario on a thread pool while the current sample is processed. File
+    reading and decoding release the GIL, so the reads overlap with the
+    processing of the dataloader worker.
+
+    Each dataloader worker owns its prefetcher. A worker processes every
+    num_workers-th sample, so the lookahead follows that stride. The decoded
+    point clouds are kept in a bounded LRU, which also serves the frames
+    that are loaded again by later samples, e.g. the historical ego frames.
+
+    Parameters
+    ----------
+    lookahead : int
+        Number of next samples of the worker to prefetch.
+
+    num_threads : int
+        Size of the thread pool.
+
+    max_frames : int
+        Maximum number of prefetched frames kept, 8 per lookahead sample by
+        default.
+
+    report_interval : int
+        Print the statistics every report_interval lookups, 0 to disable.
+        The workers print to the same stdout, so it is disabled by default.
+    """
+
+    def __init__(self, lookahead, num_threads=4, max_frames=None,
+                 report_interval=0):
+        self.lookahead = lookahead
+        self.num_threads = num_threads
+        self.max_frames = max_frames if max_frames is not None \
+            else 8 * max(lookahead, 1)
+        self.report_interval = report_interval
+
+        self.hits = 0
+        self.misses = 0
+        self._frames = OrderedDict()
+        self._executor = None
+        self._pid = None
+
+    def _get_executor(self):
+        # the threads do not survive the fork of the dataloader workers, so
+        # the pool is created in the process that uses it
+        if self._pid != os.getpid():
+            self._executor = ThreadPoolExecutor(self.num_threads)
+            self._frames = OrderedDict()
+            self._pid = os.getpid()
+        return self._executor
+
+    def prefetch(self, dataset, idx, uni_time_delay=-1):
+        """
+        Submit the reads of the frames of the next samples of the scenario.
+
+        Parameters
+        ----------
+        dataset : opencood.data_utils.datasets.BaseDataset
+            The dataset the frames belong to.
+
+        idx : int
+            The sample that is being loaded.
+
+        uni_time_delay : int
+            The uniform time delay of the dataset.
+        """
+        executor = self._get_executor()
+        worker_info = get_worker_info()
+        stride = worker_info.num_workers if worker_info is not None else 1
+        scenario_index, _ = dataset.locate_sample(idx)
+        scenario_end = dataset.len_record[scenario_index]
+
+        for next_idx in range(idx, min(idx + stride * self.lookahead + 1,
+                                       scenario_end), stride):
+            for cav_content, timestamp_key in \
+                    dataset.get_sample_frames(next_idx, uni_time_delay):
+                lidar_file = cav_content[timestamp_key]['lidar']
+                if lidar_file in self._frames:
+                    continue
+                self._frames[lidar_file] = executor.submit(
+                    self._read_frame, dataset, cav_content, timestamp_key)
+
+        while len(self._frames) > self.max_frames:
+            _, future = self._frames.popitem(last=False)
+            future.cancel()
+
+    @staticmethod
+    def _read_frame(dataset, cav_content, timestamp_key):
+        # the metadata goes to the process-wide yaml cache
+        dataset.load_frame_params(cav_content, timestamp_key)
+        return dataset.read_lidar(cav_content[timestamp_key]['lidar'])
+
+    def get(self, lidar_file):
+        """
+        Return the prefetched point cloud, waiting for a pending read, or
+        None if the frame was not prefetched.
+        """
+        future = self._frames.get(lidar_file)
+        if future is None or future.cancelled():
+            self.misses += 1
+            lidar_np = None
+        else:
+            self.hits += 1
+            self._frames.move_to_end(lidar_file)
+            lidar_np = future.result()
+
+        if self.report_interval > 0 and \
+                (self.hits + self.misses) % self.report_interval == 0:
+            print('Prefetcher %d:' % os.getpid(), self.stats())
+        return lidar_np
+
+    def stats(self):
+        """
+        Return the hit rate and the number of reads still in flight.
+        """
+        total = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total > 0 else 0.0,
+                'queue_depth': sum(not future.done() for future in
+                                   self._frames.values()),
+                'size': len(self._frames)}
@@ -15,13 +15,12 @@ import torch
 
 import opencood.data_utils.datasets
 import opencood.data_utils.post_processor as post_processor
-from opencood.utils import box_utils
 from opencood.data_utils.datasets import basedataset
 from opencood.data_utils.pre_processor import build_preprocessor
 from opencood.utils.pcd_utils import \
-    mask_points_by_range, mask_ego_points, shuffle_points, \
-    downsample_lidar_minimum
-from opencood.utils.transformation_utils import x1_to_x2
+    transform_and_filter_points, downsample_lidar_minimum
+from opencood.utils.transformation_utils import x1_to_x2, \
+    pairwise_transformation
 
 
 class IntermediateFusionDataset(basedataset.BaseDataset):
@@ -54,9 +53,53 @@ class IntermediateFusionDataset(basedataset.BaseDataset):
             params['postprocess'],
             train)
         self.uni_time_delay = uni_time_delay
+
+        # processed ego and historical ego frames of the current sample, set
+        # by the delay sweep, since their delays do not depend on the
+        # evaluated delay
+        self.cav_memo = None
+
     def __getitem__(self, idx):
+        return self.get_item_with_delay(idx, self.uni_time_delay)
+
+    def get_delay_sweep(self, idx, uni_time_delay_list):
+        """
+        Return the sample under each of the given uniform time delays. The
+        ego and the historical ego frames have the same delays under all the
+        evaluated delays, so they are loaded, projected and voxelized once
+        and shared by the samples. The collaborator frames are loaded once
+        per distinct frame, but they are processed again for every delay.
+
+        All the samples are built in the worker and returned together, so an
+        item holds len(uni_time_delay_list) processed samples, e.g. 12 times
+        the memory of a single sample with the default delays.
+
+        Parameters
+        ----------
+        idx : int
+            Index given by dataloader.
+
+        uni_time_delay_list : list
+            The evaluated uniform time delays, -1 for the simulated delay.
+
+        Returns
+        -------
+        sample_list : list
+            The processed sample of each delay.
+        """
+        self.lidar_memo = {}
+        self.cav_memo = {}
+        try:
+            sample_list = [self.get_item_with_delay(idx, uni_time_delay)
+                           for uni_time_delay in uni_time_delay_list]
+        finally:
+            self.lidar_memo = None
+            self.cav_memo = None
+        return sample_list
+
+    def get_item_with_delay(self, idx, uni_time_delay):
         base_data_dict = self.retrieve_base_data(idx,
-                                                 cur_ego_pose_flag=self.cur_ego_pose_flag, uni_time_delay=self.uni_time_delay)
+                                                 cur_ego_pose_flag=self.cur_ego_pose_flag, uni_time_delay=uni_time_delay)
 
         processed_data_dict = OrderedDict()
         processed_data_dict['ego'] = {}
@@ -82,6 +125,8 @@ class IntermediateFusionDataset(basedataset.BaseDataset):
         processed_features = []
         object_stack = []
         object_id_stack = []
+        # objects seen by several cavs are projected to the ego only once
+        object_cache = {}
 
         # prior knowledge for time delay correction and indicating data type
         # (V2V vs V2i)
@@ -90,6 +135,11 @@ class IntermediateFusionDataset(basedataset.BaseDataset):
         infra = []
         spatial_correction_matrix = []
 
+        # historical ego frames restored from the temporal feature cache of
+        # the model, only used when history_from_cache is enabled
+        history_keys = []
+        history_t_matrix = []
+
         if self.visualize:
             projected_lidar_stack = []
 
@@ -108,9 +158,36 @@ class IntermediateFusionDataset(basedataset.BaseDataset):
             if distance > opencood.data_utils.datasets.COM_RANGE:
                 continue
 
-            selected_cav_processed = self.get_item_single_car(
-                selected_cav_base,
-                ego_lidar_pose)
+            if selected_cav_base['lidar_np'] is None:
+                # the objects are the same as the ego's, only the priors and
+                # the transformation to the current ego pose are needed
+                history_keys.append(selected_cav_base['frame_key'])
+                history_t_matrix.append(np.dot(
+                    selected_cav_base['params']['spatial_correction_matrix'],
+                    selected_cav_base['params']['transformation_matrix']))
+                velocity.append(
+                    selected_cav_base['params']['ego_speed'] / 30)
+                time_delay.append(float(selected_cav_base['time_delay']))
+                spatial_correction_matrix.append(
+                    selected_cav_base['params']['spatial_correction_matrix'])
+                infra.append(0)
+                continue
+
+            # the ego and its historical frames are shared by all the
+            # delays of a delay sweep
+            memo_key = selected_cav_base['frame_key'] \
+                if self.cav_memo is not None and \
+                (selected_cav_base['ego'] or
+                 int(cav_id) - int(ego_id) in [10000, 10001]) else None
+            if memo_key is not None and memo_key in self.cav_memo:
+                selected_cav_processed = self.cav_memo[memo_key]
+            else:
+                selected_cav_processed = self.get_item_single_car(
+                    selected_cav_base,
+                    ego_lidar_pose,
+                    object_cache)
+                if memo_key is not None:
+                    self.cav_memo[memo_key] = selected_cav_processed
             # print(float(selected_cav_base['time_delay']),float(selected_cav_base['time_delay'])<3)
             #if (int(cav_id) - 10000 == int(ego_id) or int(cav_id) - 10001 == int(ego_id)) == False:
             #if float(selected_cav_base['time_delay']) < 3 :
@@ -154,14 +231,17 @@ class IntermediateFusionDataset(basedataset.BaseDataset):
         mask[:object_stack.shape[0]] = 1
 
         # merge preprocessed features from different cavs into the same dict
-        cav_num = len(processed_features)
+        cav_num = len(processed_features) + len(history_keys)
         merged_feature_dict = self.merge_features_to_dict(processed_features)
         # print("merged_feature_dict:",merged_feature_dict)
         # generate the anchor boxes
         anchor_box = self.post_processor.generate_anchor_box()
 
-        # generate targets label
-        label_dict = \
+        # generate targets label, unless it is done batched on the training
+        # device
+        label_dict = None \
+            if 'label_on_device' in self.params['postprocess'] and \
+            self.params['postprocess']['label_on_device'] else \
             self.post_processor.generate_label(
                 gt_box_center=object_bbx_center,
                 anchors=anchor_box,
@@ -192,6 +272,11 @@ class IntermediateFusionDataset(basedataset.BaseDataset):
              'infra': infra,
              'spatial_correction_matrix': spatial_correction_matrix,
              'pairwise_t_matrix': pairwise_t_matrix})
+        if history_keys:
+            processed_data_dict['ego'].update(
+                {'frame_key': base_data_dict[ego_id]['frame_key'],
+                 'history_keys': history_keys,
+                 'history_t_matrix': np.stack(history_t_matrix)})
         # print("time_delay:",time_delay)
         if self.visualize:
             processed_data_dict['ego'].update({'origin_lidar':
@@ -200,7 +285,8 @@ class IntermediateFusionDataset(basedataset.BaseDataset):
         # print("processed_data_dict:",processed_data_dict)
         return processed_data_dict
 
-    def get_item_single_car(self, selected_cav_base, ego_pose):
+    def get_item_single_car(self, selected_cav_base, ego_pose,
+                            object_cache=None):
         """
         Project the lidar and bbx to ego space first, and then do clipping.
 
@@ -210,6 +296,8 @@ class IntermediateFusionDataset(basedataset.BaseDataset):
             The dictionary contains a single CAV's raw information.
         ego_pose : list
             The ego vehicle lidar pose under world coordinate.
+        object_cache : dict
+            The objects already projected to the ego pose by the other cavs.
 
         Returns
         -------
@@ -225,21 +313,17 @@ class IntermediateFusionDataset(basedataset.BaseDataset):
         # retrieve objects under ego coordinates
         object_bbx_center, object_bbx_mask, object_ids = \
             self.post_processor.generate_object_center([selected_cav_base],
-                                                       ego_pose)
+                                                       ego_pose,
+                                                       object_cache)
         # print("object_ids:",object_ids)
         # filter lidar
-        lidar_np = selected_cav_base['lidar_np']
-        lidar_np = shuffle_points(lidar_np)
-        # remove points that hit itself
-        lidar_np = mask_ego_points(lidar_np)
-        # project the lidar to ego space
-        if self.proj_first:
-            lidar_np[:, :3] = \
-                box_utils.project_points_by_matrix_torch(lidar_np[:, :3],
-                                                         transformation_matrix)
-        lidar_np = mask_points_by_range(lidar_np,
-                                        self.params['preprocess'][
-                                            'cav_lidar_range'])
+        # remove points that hit itself, project the lidar to ego space
+        # and crop it in one pass
+        lidar_np = transform_and_filter_points(
+            selected_cav_base['lidar_np'],
+            self.params['preprocess']['cav_lidar_range'],
+            transformation_matrix if self.proj_first else None,
+            shuffle_above=self.pre_processor.shuffle_above)
         processed_lidar = self.pre_processor.preprocess(lidar_np)
 
         # velocity
@@ -344,7 +428,7 @@ class IntermediateFusionDataset(basedataset.BaseDataset):
             self.pre_processor.collate_batch(merged_feature_dict)
         # [2, 3, 4, ..., M], M <= max_cav
         record_len = torch.from_numpy(np.array(record_len, dtype=int))
-        label_torch_dict = \
+        label_torch_dict = None if label_dict_list[0] is None else \
             self.post_processor.collate_batch(label_dict_list)
 
         # (B, max_cav)
@@ -373,6 +457,14 @@ class IntermediateFusionDataset(basedataset.BaseDataset):
                                    'time_delay': time_delay})
 
 
+        # keys of the cached ego features, see history_from_cache
+        if 'history_keys' in batch[0]['ego']:
+            output_dict['ego'].update({
+                'frame_keys': [x['ego']['frame_key'] for x in batch],
+                'history_keys': [x['ego']['history_keys'] for x in batch],
+                'history_t_matrix': torch.from_numpy(np.array(
+                    [x['ego']['history_t_matrix'] for x in batch]))})
+
         if self.visualize:
             origin_lidar = \
                 np.array(downsample_lidar_minimum(pcd_np_list=origin_lidar))
@@ -453,19 +545,13 @@ class IntermediateFusionDataset(basedataset.BaseDataset):
             warnings.warn("Projection later is not supported in "
                           "the current version. Using it will throw"
                           "an error.")
-            t_list = []
-
-            # save all transformation matrix in a list in order first.
-            for cav_id, cav_content in base_data_dict.items():
-                t_list.append(cav_content['params']['transformation_matrix'])
-
-            for i in range(len(t_list)):
-                for j in range(len(t_list)):
-                    # identity matrix to self
-                    if i == j:
-                        continue
-                    # i->j: TiPi=TjPj, Tj^(-1)TiPi = Pj
-                    t_matrix = np.dot(np.linalg.inv(t_list[j]), t_list[i])
-                    pairwise_t_matrix[i, j] = t_matrix
+            # save all transformation matrix in order first.
+            t_matrix = np.stack([cav_content['params']['transformation_matrix']
+                                 for cav_content in base_data_dict.values()])
+            cav_num = t_matrix.shape[0]
+
+            # i->j: TiPi=TjPj, Tj^(-1)TiPi = Pj
+            pairwise_t_matrix[:cav_num, :cav_num] = \
+                pairwise_transformation(t_matrix)
 
         return pairwise_t_matrix
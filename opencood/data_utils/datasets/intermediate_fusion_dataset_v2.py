@@ -14,11 +14,9 @@ import torch
 
 import opencood.data_utils.datasets
 import opencood.data_utils.post_processor as post_processor
-from opencood.utils import box_utils
 from opencood.data_utils.datasets import basedataset
 from opencood.data_utils.pre_processor import build_preprocessor
-from opencood.utils.pcd_utils import \
-    mask_points_by_range, mask_ego_points, shuffle_points
+from opencood.utils.pcd_utils import transform_and_filter_points
 from opencood.utils.transformation_utils import x1_to_x2
 
 
@@ -35,6 +33,11 @@ class IntermediateFusionDatasetV2(basedataset.BaseDataset):
             build_preprocessor(params['preprocess'], train)
         self.post_processor = \
             post_processor.build_postprocessor(params['postprocess'], train)
+        # the labels are only generated on the training device by the
+        # intermediate fusion dataset
+        assert not ('label_on_device' in params['postprocess'] and
+                    params['postprocess']['label_on_device']), \
+            'label_on_device is only supported by IntermediateFusionDataset'
 
     def __getitem__(self, idx):
         # put here to avoid initialization error
@@ -193,17 +196,13 @@ class IntermediateFusionDatasetV2(basedataset.BaseDataset):
                                                        ego_pose)
 
         # filter lidar
-        lidar_np = selected_cav_base['lidar_np']
-        lidar_np = shuffle_points(lidar_np)
-        # remove points that hit itself
-        lidar_np = mask_ego_points(lidar_np)
-        # project the lidar to ego space
-        lidar_np[:, :3] = \
-            box_utils.project_points_by_matrix_torch(lidar_np[:, :3],
-                                                     transformation_matrix)
-        lidar_np = mask_points_by_range(lidar_np,
-                                        self.params['preprocess'][
-                                            'cav_lidar_range'])
+        # remove points that hit itself, project the lidar to ego space
+        # and crop it in one pass
+        lidar_np = transform_and_filter_points(
+            selected_cav_base['lidar_np'],
+            self.params['preprocess']['cav_lidar_range'],
+            transformation_matrix,
+            shuffle_above=self.pre_processor.shuffle_above)
         processed_lidar = self.pre_processor.preprocess(lidar_np)
 
         selected_cav_processed.update(
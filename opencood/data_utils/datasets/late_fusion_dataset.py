@@ -20,8 +20,7 @@ from opencood.data_utils.pre_processor import build_preprocessor
 from opencood.hypes_yaml.yaml_utils import load_yaml
 from opencood.utils import box_utils
 from opencood.utils.pcd_utils import \
-    mask_points_by_range, mask_ego_points, shuffle_points, \
-    downsample_lidar_minimum
+    transform_and_filter_points, downsample_lidar_minimum
 from opencood.utils.transformation_utils import x1_to_x2
 
 
@@ -30,14 +29,23 @@ class LateFusionDataset(basedataset.BaseDataset):
     This class is for intermediate fusion where each vehicle transmit the
     detection outputs to ego.
     """
-    def __init__(self, params, visualize, train=True):
+    def __init__(self, params, visualize, train=True, uni_time_delay=-1):
         super(LateFusionDataset, self).__init__(params, visualize, train)
         self.pre_processor = build_preprocessor(params['preprocess'],
                                                 train)
         self.post_processor = build_postprocessor(params['postprocess'], train)
+        # the labels are only generated on the training device by the
+        # intermediate fusion dataset
+        assert not ('label_on_device' in params['postprocess'] and
+                    params['postprocess']['label_on_device']), \
+            'label_on_device is only supported by IntermediateFusionDataset'
+        self.uni_time_delay = uni_time_delay
 
     def __getitem__(self, idx):
-        base_data_dict = self.retrieve_base_data(idx)
+        # the lidar and the parameters of a cav are only loaded when it is
+        # processed, so training only reads the selected cav
+        base_data_dict = self.retrieve_base_data(
+            idx, uni_time_delay=self.uni_time_delay)
         if self.train:
             reformat_data_dict = self.get_item_train(base_data_dict)
         else:
@@ -62,13 +70,11 @@ class LateFusionDataset(basedataset.BaseDataset):
         selected_cav_processed = {}
 
         # filter lidar
-        lidar_np = selected_cav_base['lidar_np']
-        lidar_np = shuffle_points(lidar_np)
-        lidar_np = mask_points_by_range(lidar_np,
-                                        self.params['preprocess'][
-                                            'cav_lidar_range'])
-        # remove points that hit ego vehicle
-        lidar_np = mask_ego_points(lidar_np)
+        # remove points that hit ego vehicle and crop the lidar in one pass
+        lidar_np = transform_and_filter_points(
+            selected_cav_base['lidar_np'],
+            self.params['preprocess']['cav_lidar_range'],
+            shuffle_above=self.pre_processor.shuffle_above)
 
         # generate the bounding box(n, 7) under the cav's space
         object_bbx_center, object_bbx_mask, object_ids = \
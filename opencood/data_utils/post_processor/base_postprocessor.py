@@ -97,7 +97,8 @@ class BasePostprocessor(object):
 
     def generate_object_center(self,
                                cav_contents,
-                               reference_lidar_pose):
+                               reference_lidar_pose,
+                               object_cache=None):
         """
         Retrieve all objects in a format of (n, 7), where 7 represents
         x, y, z, l, w, h, yaw or x, y, z, h, w, l, yaw.
@@ -110,6 +111,11 @@ class BasePostprocessor(object):
         reference_lidar_pose : list
             The final target lidar pose with length 6.
 
+        object_cache : dict
+            Optional, the objects already projected to the same
+            reference_lidar_pose, shared by the cavs of a sample so that
+            each object is projected only once.
+
         Returns
         -------
         object_np : np.ndarray
@@ -121,9 +127,11 @@ class BasePostprocessor(object):
         """
         from opencood.data_utils.datasets import GT_RANGE
 
-        tmp_object_dict = {}
-        for cav_content in cav_contents:
-            tmp_object_dict.update(cav_content['params']['vehicles'])
+        # the vehicles are a dict from the frame yaml or FrameObjects from
+        # the dataset index
+        tmp_object_dict = box_utils.merge_frame_objects(
+            [cav_content['params']['vehicles']
+             for cav_content in cav_contents])
 
         output_dict = {}
         filter_range = self.params['anchor_args']['cav_lidar_range'] \
@@ -133,7 +141,8 @@ class BasePostprocessor(object):
                                         output_dict,
                                         reference_lidar_pose,
                                         filter_range,
-                                        self.params['order'])
+                                        self.params['order'],
+                                        cache=object_cache)
 
         object_np = np.zeros((self.params['max_num'], 7))
         mask = np.zeros(self.params['max_num'])
@@ -14,7 +14,6 @@ from opencood.utils.transformation_utils import dist_to_continuous
 from opencood.data_utils.post_processor.base_postprocessor \
     import BasePostprocessor
 from opencood.utils import box_utils
-from opencood.visualization import vis_utils
 
 
 class BevPostprocessor(BasePostprocessor):
@@ -441,6 +440,8 @@ class BevPostprocessor(BasePostprocessor):
             opencood dataset object.
         """
         assert dataset is not None, "dataset argument can't be None"
+        # open3d based, keep it out of the dataloader import path
+        from opencood.visualization import vis_utils
         vis_utils.visualize_single_sample_output_bev(pred_box_tensor,
                                                      gt_tensor,
                                                      pcd,
@@ -144,21 +144,25 @@ class FpvrcnnPostprocessor(VoxelPostprocessor):
         pred_box3d_tensor = torch.vstack(pred_box3d_list)
         pred_box3d_original = torch.vstack(pred_box3d_original_list)
 
-        cur_idx = 0
-        batch_pred_boxes3d = []
-        batch_scores = []
-        for n in batch_num_box_count:
-            cur_boxes = pred_box3d_tensor[cur_idx:cur_idx+n]
-            cur_scores = scores[cur_idx:cur_idx+n]
-            # nms
-            keep_index = box_utils.nms_rotated(cur_boxes,
-                                               cur_scores,
-                                               self.params['nms_thresh']
-                                               )
-            cur_boxes = pred_box3d_original[cur_idx:cur_idx+n][:, [0, 1, 2, 5, 4, 3, 6]] # hwl -> lwh
-            batch_pred_boxes3d.append(cur_boxes[keep_index])
-            batch_scores.append(cur_scores[keep_index])
-            cur_idx += n
+        # nms of all the samples at once, the boxes of different samples do
+        # not suppress each other
+        batch_index = torch.repeat_interleave(
+            torch.arange(len(batch_num_box_count), device=scores.device),
+            torch.tensor(batch_num_box_count, device=scores.device))
+        keep_index = box_utils.nms_rotated(pred_box3d_tensor,
+                                           scores,
+                                           self.params['nms_thresh'],
+                                           batch_index)
+        # group the kept boxes by sample, in score order within each
+        keep_index = keep_index[torch.sort(batch_index[keep_index],
+                                           stable=True)[1]]
+        keep_count = torch.bincount(
+            batch_index[keep_index],
+            minlength=len(batch_num_box_count)).tolist()
+        batch_pred_boxes3d = list(torch.split(
+            pred_box3d_original[keep_index][:, [0, 1, 2, 5, 4, 3, 6]],
+            keep_count)) # hwl -> lwh
+        batch_scores = list(torch.split(scores[keep_index], keep_count))
 
         return batch_pred_boxes3d, batch_scores
 
@@ -16,16 +16,101 @@ import torch.nn.functional as F
 from opencood.data_utils.post_processor.base_postprocessor \
     import BasePostprocessor
 from opencood.utils import box_utils
-from opencood.utils.box_overlaps import bbox_overlaps
-from opencood.visualization import vis_utils
 
 
 class VoxelPostprocessor(BasePostprocessor):
     def __init__(self, anchor_params, train):
         super(VoxelPostprocessor, self).__init__(anchor_params, train)
         self.anchor_num = self.params['anchor_args']['num']
+        # the anchors only depend on the config, so they are generated once
+        # here and shared read-only by all the samples and the forked
+        # dataloader workers
+        self.anchor_box = self._generate_anchor_box()
+        self.anchor_box.setflags(write=False)
+        self._anchor_targets = None
+        self._anchor_targets_torch = {}
+        if self.params['order'] == 'hwl':
+            self.get_anchor_targets()
+        # whether the labels are generated batched on the training device
+        # by generate_label_torch instead of in the dataloader workers
+        self.label_on_device = self.params['label_on_device'] \
+            if 'label_on_device' in self.params else False
 
     def generate_anchor_box(self):
+        """
+        Return the cached anchors of the postprocessor.
+
+        Returns
+        -------
+        anchor_box : np.ndarray
+            Read-only anchors, shape (H, W, anchor_num, 7).
+        """
+        return self.anchor_box
+
+    def get_anchor_targets(self):
+        """
+        Return the GT independent anchor values used by the label generation.
+
+        Returns
+        -------
+        anchor_targets : dict
+            The flattened anchors (H*W*anchor_num, 7), their bev diagonals
+            (H*W*anchor_num,), corners (H*W*anchor_num, 8, 3) and
+            standup boxes (H*W*anchor_num, 4) as float32, together with the
+            anchor grid used to prune the anchor/GT pairs.
+        """
+        if self._anchor_targets is None:
+            self._anchor_targets = \
+                self.compute_anchor_targets(self.anchor_box)
+            for value in self._anchor_targets.values():
+                if isinstance(value, np.ndarray):
+                    value.setflags(write=False)
+
+        return self._anchor_targets
+
+    def compute_anchor_targets(self, anchor_box):
+        """
+        Compute the GT independent anchor values of get_anchor_targets for
+        the given anchors.
+
+        Parameters
+        ----------
+        anchor_box : np.ndarray
+            Anchors on a regular grid, shape (H, W, anchor_num, 7).
+
+        Returns
+        -------
+        anchor_targets : dict
+        """
+        assert self.params['order'] == 'hwl', \
+            'Currently Voxel only support hwl bbx order.'
+        # writable copy, torch.from_numpy warns on read-only arrays
+        anchors = np.array(anchor_box.reshape(-1, 7), dtype=np.float32)
+        anchors_d = np.sqrt(anchors[:, 4] ** 2 + anchors[:, 5] ** 2)
+        anchors_corner = \
+            box_utils.boxes_to_corners_3d(anchors,
+                                          order=self.params['order'])
+        anchors_standup_2d = np.ascontiguousarray(
+            box_utils.corner2d_to_standup_box(anchors_corner)).astype(
+            np.float32)
+
+        return {'anchors': anchors,
+                'anchors_d': anchors_d,
+                'anchors_corner': anchors_corner,
+                'anchors_standup_2d': anchors_standup_2d,
+                # (H, W, anchor_num)
+                'shape': anchor_box.shape[:3],
+                # the anchor centers along x (W,) and y (H,)
+                'anchor_x': np.array(anchor_box[0, :, 0, 0],
+                                     dtype=np.float32),
+                'anchor_y': np.array(anchor_box[:, 0, 0, 1],
+                                     dtype=np.float32),
+                # the largest half size of the standup boxes along x and y
+                'standup_half': np.max(
+                    anchors_standup_2d[:, 2:] - anchors_standup_2d[:, :2],
+                    axis=0) / 2}
+
+    def _generate_anchor_box(self):
         W = self.params['anchor_args']['W']
         H = self.params['anchor_args']['H']
 
@@ -75,6 +160,75 @@ class VoxelPostprocessor(BasePostprocessor):
 
         return anchors
 
+    @staticmethod
+    def candidate_pairs(anchor_targets, gt_standup_2d):
+        """
+        Find the anchor/GT pairs whose standup boxes overlap. The anchors
+        are on a regular grid, so only the grid window around each GT box
+        is checked instead of all the anchors.
+
+        Parameters
+        ----------
+        anchor_targets : dict
+            The output of get_anchor_targets.
+
+        gt_standup_2d : np.ndarray
+            The standup boxes of the GT, shape (n, 4).
+
+        Returns
+        -------
+        anchor_index : np.ndarray
+            Flat index of the anchor of each pair, shape (P,). The pairs are
+            sorted by GT and then by anchor.
+
+        gt_index : np.ndarray
+            Index of the GT of each pair, shape (P,).
+
+        iou : np.ndarray
+            Standup IoU of each pair with the bbox_overlaps convention,
+            float32, shape (P,).
+        """
+        H, W, anchor_num = anchor_targets['shape']
+        half_x, half_y = anchor_targets['standup_half']
+        # bbox_overlaps counts boxes 1m apart as overlapping
+        ix0 = np.searchsorted(anchor_targets['anchor_x'],
+                              gt_standup_2d[:, 0] - half_x - 1, 'left')
+        ix1 = np.searchsorted(anchor_targets['anchor_x'],
+                              gt_standup_2d[:, 2] + half_x + 1, 'right')
+        iy0 = np.searchsorted(anchor_targets['anchor_y'],
+                              gt_standup_2d[:, 1] - half_y - 1, 'left')
+        iy1 = np.searchsorted(anchor_targets['anchor_y'],
+                              gt_standup_2d[:, 3] + half_y + 1, 'right')
+        nx = ix1 - ix0
+        count = nx * (iy1 - iy0) * anchor_num
+
+        # enumerate the window of each GT, y then x then anchor
+        gt_index = np.repeat(np.arange(len(count)), count)
+        local = np.arange(count.sum()) - \
+            np.repeat(np.cumsum(count) - count, count)
+        cell = local // anchor_num
+        cell_x = ix0[gt_index] + cell % nx[gt_index]
+        cell_y = iy0[gt_index] + cell // nx[gt_index]
+        anchor_index = (cell_y * W + cell_x) * anchor_num + \
+            local % anchor_num
+
+        anchor_box = anchor_targets['anchors_standup_2d'][anchor_index]
+        gt_box = gt_standup_2d[gt_index]
+        iw = np.minimum(anchor_box[:, 2], gt_box[:, 2]) - \
+            np.maximum(anchor_box[:, 0], gt_box[:, 0]) + 1
+        ih = np.minimum(anchor_box[:, 3], gt_box[:, 3]) - \
+            np.maximum(anchor_box[:, 1], gt_box[:, 1]) + 1
+        overlap = (iw > 0) & (ih > 0)
+        anchor_index, gt_index = anchor_index[overlap], gt_index[overlap]
+        anchor_box, gt_box = anchor_box[overlap], gt_box[overlap]
+        inter = iw[overlap] * ih[overlap]
+        ua = (anchor_box[:, 2] - anchor_box[:, 0] + 1) * \
+            (anchor_box[:, 3] - anchor_box[:, 1] + 1) + \
+            (gt_box[:, 2] - gt_box[:, 0] + 1) * \
+            (gt_box[:, 3] - gt_box[:, 1] + 1) - inter
+
+        return anchor_index, gt_index, (inter / ua).astype(np.float32)
+
     def generate_label(self, **kwargs):
         """
         Generate targets for training.
@@ -92,25 +246,20 @@ class VoxelPostprocessor(BasePostprocessor):
         assert self.params['order'] == 'hwl', 'Currently Voxel only support' \
                                               'hwl bbx order.'
         # (max_num, 7)
-        gt_box_center = kwargs['gt_box_center']
+        gt_box_center = kwargs['gt_box_center'].astype(np.float32)
         # (H, W, anchor_num, 7)
         anchors = kwargs['anchors']
         # (max_num)
         masks = kwargs['mask']
 
-        # (H, W)
-        feature_map_shape = anchors.shape[:2]
-
+        anchor_targets = self.get_anchor_targets() \
+            if anchors is self.anchor_box else \
+            self.compute_anchor_targets(anchors)
         # (H*W*anchor_num, 7)
-        anchors = anchors.reshape(-1, 7)
+        anchors = anchor_targets['anchors']
         # normalization factor, (H * W * anchor_num)
-        anchors_d = np.sqrt(anchors[:, 4] ** 2 + anchors[:, 5] ** 2)
-
-        # (H, W, 2)
-        pos_equal_one = np.zeros((*feature_map_shape, self.anchor_num))
-        neg_equal_one = np.zeros((*feature_map_shape, self.anchor_num))
-        # (H, W, self.anchor_num * 7)
-        targets = np.zeros((*feature_map_shape, self.anchor_num * 7))
+        anchors_d = anchor_targets['anchors_d']
+        anchor_total = anchors.shape[0]
 
         # (n, 7)
         gt_box_center_valid = gt_box_center[masks == 1]
@@ -118,85 +267,199 @@ class VoxelPostprocessor(BasePostprocessor):
         gt_box_corner_valid = \
             box_utils.boxes_to_corners_3d(gt_box_center_valid,
                                           self.params['order'])
-        # (H*W*anchor_num, 8, 3)
-        anchors_corner = \
-            box_utils.boxes_to_corners_3d(anchors,
-                                          order=self.params['order'])
-        # (H*W*anchor_num, 4)
-        anchors_standup_2d = \
-            box_utils.corner2d_to_standup_box(anchors_corner)
         # (n, 4)
         gt_standup_2d = \
-            box_utils.corner2d_to_standup_box(gt_box_corner_valid)
-
-        # (H*W*anchor_n)
-        iou = bbox_overlaps(
-            np.ascontiguousarray(anchors_standup_2d).astype(np.float32),
-            np.ascontiguousarray(gt_standup_2d).astype(np.float32),
-        )
-
-        # the anchor boxes has the largest iou across
-        # shape: (n)
-        id_highest = np.argmax(iou.T, axis=1)
-        # [0, 1, 2, ..., n-1]
-        id_highest_gt = np.arange(iou.T.shape[0])
-        # make sure all highest iou is larger than 0
-        mask = iou.T[id_highest_gt, id_highest] > 0
-        id_highest, id_highest_gt = id_highest[mask], id_highest_gt[mask]
+            box_utils.corner2d_to_standup_box(gt_box_corner_valid).astype(
+                np.float32)
+
+        # only the overlapping pairs, the iou of the others is 0
+        anchor_index, gt_index, iou = \
+            self.candidate_pairs(anchor_targets, gt_standup_2d)
+
+        # the anchor box has the largest iou with each gt, the first anchor
+        # wins a tie
+        order = np.lexsort((anchor_index, -iou, gt_index))
+        gt_sorted = gt_index[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = gt_sorted[1:] != gt_sorted[:-1]
+        id_highest = anchor_index[order][first]
+        id_highest_gt = gt_sorted[first]
 
         # find anchors iou > params['pos_iou']
-        id_pos, id_pos_gt = \
-            np.where(iou >
-                     self.params['target_args']['pos_threshold'])
-        #  find anchors iou < params['neg_iou']
-        id_neg = np.where(np.sum(iou <
-                                 self.params['target_args']['neg_threshold'],
-                                 axis=1) == iou.shape[1])[0]
+        pos = iou > self.params['target_args']['pos_threshold']
+        order = np.lexsort((gt_index[pos], anchor_index[pos]))
+        id_pos = anchor_index[pos][order]
+        id_pos_gt = gt_index[pos][order]
+        #  find anchors iou < params['neg_iou'] for all gt
+        neg_mask = np.ones(anchor_total, dtype=bool)
+        neg_mask[anchor_index[iou >=
+                              self.params['target_args']['neg_threshold']]] \
+            = False
+
         id_pos = np.concatenate([id_pos, id_highest])
         id_pos_gt = np.concatenate([id_pos_gt, id_highest_gt])
         id_pos, index = np.unique(id_pos, return_index=True)
         id_pos_gt = id_pos_gt[index]
-        id_neg.sort()
 
-        # cal the target and set the equal one
-        index_x, index_y, index_z = np.unravel_index(
-            id_pos, (*feature_map_shape, self.anchor_num))
-        pos_equal_one[index_x, index_y, index_z] = 1
-
-        # calculate the targets
-        targets[index_x, index_y, np.array(index_z) * 7] = \
-            (gt_box_center[id_pos_gt, 0] - anchors[id_pos, 0]) / anchors_d[
-                id_pos]
-        targets[index_x, index_y, np.array(index_z) * 7 + 1] = \
-            (gt_box_center[id_pos_gt, 1] - anchors[id_pos, 1]) / anchors_d[
-                id_pos]
-        targets[index_x, index_y, np.array(index_z) * 7 + 2] = \
-            (gt_box_center[id_pos_gt, 2] - anchors[id_pos, 2]) / anchors[
-                id_pos, 3]
-        targets[index_x, index_y, np.array(index_z) * 7 + 3] = np.log(
-            gt_box_center[id_pos_gt, 3] / anchors[id_pos, 3])
-        targets[index_x, index_y, np.array(index_z) * 7 + 4] = np.log(
-            gt_box_center[id_pos_gt, 4] / anchors[id_pos, 4])
-        targets[index_x, index_y, np.array(index_z) * 7 + 5] = np.log(
-            gt_box_center[id_pos_gt, 5] / anchors[id_pos, 5])
-        targets[index_x, index_y, np.array(index_z) * 7 + 6] = (
-                gt_box_center[id_pos_gt, 6] - anchors[id_pos, 6])
-
-        index_x, index_y, index_z = np.unravel_index(
-            id_neg, (*feature_map_shape, self.anchor_num))
-        neg_equal_one[index_x, index_y, index_z] = 1
+        # (H*W*anchor_num)
+        pos_equal_one = np.zeros(anchor_total, dtype=np.float32)
+        neg_equal_one = neg_mask.astype(np.float32)
+        # (H*W*anchor_num, 7)
+        targets = np.zeros((anchor_total, 7), dtype=np.float32)
 
+        pos_equal_one[id_pos] = 1
         # to avoid a box be pos/neg in the same time
-        index_x, index_y, index_z = np.unravel_index(
-            id_highest, (*feature_map_shape, self.anchor_num))
-        neg_equal_one[index_x, index_y, index_z] = 0
+        neg_equal_one[id_highest] = 0
 
-        label_dict = {'pos_equal_one': pos_equal_one,
-                      'neg_equal_one': neg_equal_one,
-                      'targets': targets}
+        # calculate the targets
+        gt_pos = gt_box_center[id_pos_gt]
+        anchors_pos = anchors[id_pos]
+        targets[id_pos, :2] = \
+            (gt_pos[:, :2] - anchors_pos[:, :2]) / anchors_d[id_pos, None]
+        targets[id_pos, 2] = \
+            (gt_pos[:, 2] - anchors_pos[:, 2]) / anchors_pos[:, 3]
+        targets[id_pos, 3:6] = np.log(gt_pos[:, 3:6] / anchors_pos[:, 3:6])
+        targets[id_pos, 6] = gt_pos[:, 6] - anchors_pos[:, 6]
+
+        H, W, anchor_num = anchor_targets['shape']
+        label_dict = {'pos_equal_one':
+                          pos_equal_one.reshape(H, W, anchor_num),
+                      'neg_equal_one':
+                          neg_equal_one.reshape(H, W, anchor_num),
+                      'targets': targets.reshape(H, W, anchor_num * 7)}
 
         return label_dict
 
+    def generate_label_torch(self, gt_box_center, mask):
+        """
+        Generate the targets of a whole batch on the device of the GT, with
+        the same assignment as generate_label.
+
+        Parameters
+        ----------
+        gt_box_center : torch.Tensor
+            The GT boxes, shape (B, max_num, 7).
+
+        mask : torch.Tensor
+            The valid GT boxes, shape (B, max_num).
+
+        Returns
+        -------
+        label_dict : dict
+            The batched targets as in collate_batch.
+        """
+        assert self.params['order'] == 'hwl', 'Currently Voxel only support' \
+                                              'hwl bbx order.'
+        device = gt_box_center.device
+        if device not in self._anchor_targets_torch:
+            self._anchor_targets_torch[device] = \
+                {key: torch.from_numpy(np.array(value)).to(device)
+                 for key, value in self.get_anchor_targets().items()
+                 if key != 'shape'}
+        anchor_targets = self._anchor_targets_torch[device]
+        H, W, anchor_num = self.get_anchor_targets()['shape']
+        anchor_total = H * W * anchor_num
+        B = gt_box_center.shape[0]
+
+        # (G,), the valid gt sorted by sample
+        batch_index, box_index = torch.nonzero(mask == 1, as_tuple=True)
+        gt_boxes = gt_box_center[batch_index, box_index].float()
+        gt_corner = box_utils.boxes_to_corners_3d(gt_boxes,
+                                                  self.params['order'])
+        gt_standup_2d = box_utils.corner_to_standup_box_torch(gt_corner)
+
+        # the same grid windows as candidate_pairs
+        half_x, half_y = anchor_targets['standup_half']
+        ix0 = torch.searchsorted(anchor_targets['anchor_x'],
+                                 gt_standup_2d[:, 0] - half_x - 1)
+        ix1 = torch.searchsorted(anchor_targets['anchor_x'],
+                                 gt_standup_2d[:, 2] + half_x + 1,
+                                 right=True)
+        iy0 = torch.searchsorted(anchor_targets['anchor_y'],
+                                 gt_standup_2d[:, 1] - half_y - 1)
+        iy1 = torch.searchsorted(anchor_targets['anchor_y'],
+                                 gt_standup_2d[:, 3] + half_y + 1,
+                                 right=True)
+        nx = ix1 - ix0
+        count = nx * (iy1 - iy0) * anchor_num
+
+        gt_index = torch.repeat_interleave(
+            torch.arange(len(count), device=device), count)
+        local = torch.arange(gt_index.shape[0], device=device) - \
+            torch.repeat_interleave(torch.cumsum(count, 0) - count, count)
+        cell = local // anchor_num
+        cell_x = ix0[gt_index] + cell % nx[gt_index]
+        cell_y = iy0[gt_index] + cell // nx[gt_index]
+        anchor_index = (cell_y * W + cell_x) * anchor_num + \
+            local % anchor_num
+
+        anchor_box = anchor_targets['anchors_standup_2d'][anchor_index]
+        gt_box = gt_standup_2d[gt_index]
+        iw = torch.min(anchor_box[:, 2], gt_box[:, 2]) - \
+            torch.max(anchor_box[:, 0], gt_box[:, 0]) + 1
+        ih = torch.min(anchor_box[:, 3], gt_box[:, 3]) - \
+            torch.max(anchor_box[:, 1], gt_box[:, 1]) + 1
+        overlap = (iw > 0) & (ih > 0)
+        anchor_index, gt_index = anchor_index[overlap], gt_index[overlap]
+        anchor_box, gt_box = anchor_box[overlap], gt_box[overlap]
+        inter = iw[overlap] * ih[overlap]
+        ua = (anchor_box[:, 2] - anchor_box[:, 0] + 1) * \
+            (anchor_box[:, 3] - anchor_box[:, 1] + 1) + \
+            (gt_box[:, 2] - gt_box[:, 0] + 1) * \
+            (gt_box[:, 3] - gt_box[:, 1] + 1) - inter
+        iou = inter / ua
+        # the flat anchor index over the batch
+        batch_anchor = batch_index[gt_index] * anchor_total + anchor_index
+
+        # the anchor with the largest iou of each gt, the pairs are sorted
+        # by gt and anchor so the stable sort keeps the first anchor of a tie
+        key = gt_index.double() * 2 - iou.double()
+        order = torch.sort(key, stable=True)[1]
+        gt_sorted = gt_index[order]
+        first = torch.ones_like(gt_sorted, dtype=torch.bool)
+        first[1:] = gt_sorted[1:] != gt_sorted[:-1]
+        id_highest = batch_anchor[order][first]
+        id_highest_gt = gt_sorted[first]
+
+        # an anchor above the positive threshold takes its first gt, the
+        # other positive anchors the first gt they are the best anchor of
+        pos = iou > self.params['target_args']['pos_threshold']
+        G = max(gt_boxes.shape[0], 1)
+        id_pos = torch.cat([batch_anchor[pos], id_highest])
+        id_pos_gt = torch.cat([gt_index[pos], id_highest_gt])
+        priority = torch.cat([torch.zeros_like(gt_index[pos]),
+                              torch.ones_like(id_highest_gt)])
+        order = torch.sort(id_pos * 2 * G + priority * G + id_pos_gt)[1]
+        id_pos, id_pos_gt = id_pos[order], id_pos_gt[order]
+        first = torch.ones_like(id_pos, dtype=torch.bool)
+        first[1:] = id_pos[1:] != id_pos[:-1]
+        id_pos, id_pos_gt = id_pos[first], id_pos_gt[first]
+
+        pos_equal_one = torch.zeros(B * anchor_total, device=device)
+        neg_equal_one = torch.ones(B * anchor_total, device=device)
+        targets = torch.zeros((B * anchor_total, 7), device=device)
+
+        neg_equal_one[batch_anchor[
+            iou >= self.params['target_args']['neg_threshold']]] = 0
+        pos_equal_one[id_pos] = 1
+        neg_equal_one[id_highest] = 0
+
+        anchors = anchor_targets['anchors']
+        anchors_d = anchor_targets['anchors_d']
+        gt_pos = gt_boxes[id_pos_gt]
+        anchors_pos = anchors[id_pos % anchor_total]
+        anchors_d_pos = anchors_d[id_pos % anchor_total]
+        targets[id_pos, :2] = \
+            (gt_pos[:, :2] - anchors_pos[:, :2]) / anchors_d_pos[:, None]
+        targets[id_pos, 2] = \
+            (gt_pos[:, 2] - anchors_pos[:, 2]) / anchors_pos[:, 3]
+        targets[id_pos, 3:6] = torch.log(gt_pos[:, 3:6] / anchors_pos[:, 3:6])
+        targets[id_pos, 6] = gt_pos[:, 6] - anchors_pos[:, 6]
+
+        return {'targets': targets.view(B, H, W, anchor_num * 7),
+                'pos_equal_one': pos_equal_one.view(B, H, W, anchor_num),
+                'neg_equal_one': neg_equal_one.view(B, H, W, anchor_num)}
+
     @staticmethod
     def collate_batch(label_batch_list):
         """
@@ -427,6 +690,8 @@ class VoxelPostprocessor(BasePostprocessor):
 
         """
         return 0
+        # open3d based, keep it out of the dataloader import path
+        from opencood.visualization import vis_utils
         vis_utils.visualize_single_sample_output_gt(pred_box_tensor,
                                                     gt_tensor,
                                                     pcd,
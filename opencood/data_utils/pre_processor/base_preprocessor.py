@@ -23,6 +23,10 @@ class BasePreprocessor(object):
     def __init__(self, preprocess_params, train):
         self.params = preprocess_params
         self.train = train
+        # the largest point cloud that is processed without dropping points
+        # in point order, larger clouds have to be shuffled first. None if
+        # the points are never dropped in point order
+        self.shuffle_above = None
 
     def preprocess(self, pcd_np):
         """
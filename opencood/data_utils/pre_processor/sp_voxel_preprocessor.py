@@ -34,6 +34,10 @@ class SpVoxelPreprocessor(BasePreprocessor):
             self.max_voxels = self.params['args']['max_voxel_train']
         else:
             self.max_voxels = self.params['args']['max_voxel_test']
+        # the voxels and the points of a voxel beyond the maximum are
+        # dropped in point order, which can only happen with more points
+        # than either maximum
+        self.shuffle_above = min(self.max_points_per_voxel, self.max_voxels)
 
         grid_size = (np.array(self.lidar_range[3:6]) -
                      np.array(self.lidar_range[0:3])) / np.array(self.voxel_size)
@@ -134,9 +138,12 @@ class SpVoxelPreprocessor(BasePreprocessor):
         voxel_features = torch.from_numpy(np.concatenate(voxel_features))
         voxel_coords = torch.from_numpy(np.concatenate(voxel_coords))
 
+        # the frame number is kept on the host, so the scatter does not read
+        # it back from the device
         return {'voxel_features': voxel_features,
                 'voxel_coords': voxel_coords,
-                'voxel_num_points': voxel_num_points}
+                'voxel_num_points': voxel_num_points,
+                'batch_size': len(batch)}
 
     @staticmethod
     def collate_batch_dict(batch: dict):
@@ -168,4 +175,5 @@ class SpVoxelPreprocessor(BasePreprocessor):
 
         return {'voxel_features': voxel_features,
                 'voxel_coords': voxel_coords,
-                'voxel_num_points': voxel_num_points}
+                'voxel_num_points': voxel_num_points,
+                'batch_size': len(coords)}
@@ -26,6 +26,8 @@ class VoxelPreprocessor(BasePreprocessor):
         self.vh = self.params['args']['vh']
         self.vd = self.params['args']['vd']
         self.T = self.params['args']['T']
+        # only the first T points of a voxel are kept
+        self.shuffle_above = self.T
 
     def preprocess(self, pcd_np):
         """
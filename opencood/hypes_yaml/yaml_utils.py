@@ -7,10 +7,39 @@ import re
 import yaml
 import os
 import math
+import threading
+from collections import OrderedDict
 
 import numpy as np
 
 
+_FLOAT_RESOLVER_ADDED = False
+
+
+def _get_loader():
+    """
+    Return the yaml loader with the float resolver registered. The resolver
+    is appended to the class-level resolver table, so it is only added once
+    per process to keep the table from growing on every load.
+    """
+    global _FLOAT_RESOLVER_ADDED
+
+    loader = yaml.Loader
+    if not _FLOAT_RESOLVER_ADDED:
+        loader.add_implicit_resolver(
+            u'tag:yaml.org,2002:float',
+            re.compile(u'''^(?:
+             [-+]?(?:[0-9][0-9_]*)\\.[0-9_]*(?:[eE][-+]?[0-9]+)?
+            |[-+]?(?:[0-9][0-9_]*)(?:[eE][-+]?[0-9]+)
+            |\\.[0-9_]+(?:[eE][-+][0-9]+)?
+            |[-+]?[0-9][0-9_]*(?::[0-5]?[0-9])+\\.[0-9_]*
+            |[-+]?\\.(?:inf|Inf|INF)
+            |\\.(?:nan|NaN|NAN))$''', re.X),
+            list(u'-+0123456789.'))
+        _FLOAT_RESOLVER_ADDED = True
+    return loader
+
+
 def load_yaml(file, opt=None):
     """
     Load yaml file and return a dictionary.
@@ -30,25 +59,122 @@ def load_yaml(file, opt=None):
     # if opt and opt.model_dir:
     #     file = os.path.join(opt.model_dir, 'config.yaml')
 
-    stream = open(file, 'r')
-    loader = yaml.Loader
-    loader.add_implicit_resolver(
-        u'tag:yaml.org,2002:float',
-        re.compile(u'''^(?:
-         [-+]?(?:[0-9][0-9_]*)\\.[0-9_]*(?:[eE][-+]?[0-9]+)?
-        |[-+]?(?:[0-9][0-9_]*)(?:[eE][-+]?[0-9]+)
-        |\\.[0-9_]+(?:[eE][-+][0-9]+)?
-        |[-+]?[0-9][0-9_]*(?::[0-5]?[0-9])+\\.[0-9_]*
-        |[-+]?\\.(?:inf|Inf|INF)
-        |\\.(?:nan|NaN|NAN))$''', re.X),
-        list(u'-+0123456789.'))
-    param = yaml.load(stream, Loader=loader)
+    with open(file, 'r') as stream:
+        param = yaml.load(stream, Loader=_get_loader())
     if "yaml_parser" in param:
         param = eval(param["yaml_parser"])(param)
 
     return param
 
 
+class YamlCache(object):
+    """
+    Bounded LRU cache of parsed yaml files keyed by file path. It is used by
+    the datasets to avoid parsing the same frame yaml several times when a
+    sample is assembled.
+
+    Parameters
+    ----------
+    max_size : int
+        Maximum number of parsed files kept in memory.
+
+    Attributes
+    ----------
+    hits : int
+        Number of lookups served from the cache.
+
+    misses : int
+        Number of lookups that required parsing the file.
+    """
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        # the frame prefetcher loads yaml files from several threads
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def load(self, file):
+        """
+        Return the parsed content of the yaml file. A shallow copy is
+        returned so callers can add or replace top-level keys without
+        touching the cached entry.
+
+        Parameters
+        ----------
+        file : str
+            yaml file path.
+
+        Returns
+        -------
+        param : dict
+            The parsed yaml content.
+        """
+        with self._lock:
+            if file in self._cache:
+                self.hits += 1
+                self._cache.move_to_end(file)
+                return dict(self._cache[file])
+            self.misses += 1
+
+        param = load_yaml(file)
+        with self._lock:
+            if self.max_size > 0:
+                self._cache[file] = param
+                while len(self._cache) > self.max_size:
+                    self._cache.popitem(last=False)
+        return dict(param)
+
+    def resize(self, max_size):
+        """
+        Change the capacity of the cache, evicting the least recently used
+        entries if needed.
+        """
+        self.max_size = max_size
+        while len(self._cache) > max(self.max_size, 0):
+            self._cache.popitem(last=False)
+
+    def clear(self):
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """
+        Return the hit/miss counters of the cache.
+        """
+        total = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._cache),
+                'hit_rate': self.hits / total if total > 0 else 0.0}
+
+
+# process-wide cache shared by all datasets of the current (worker) process
+FRAME_YAML_CACHE = YamlCache()
+
+
+def load_frame_yaml(file):
+    """
+    Load a per-frame yaml file through the process-wide cache.
+
+    Parameters
+    ----------
+    file : str
+        yaml file path.
+
+    Returns
+    -------
+    param : dict
+        A shallow copy of the parsed yaml content.
+    """
+    return FRAME_YAML_CACHE.load(file)
+
+
 def load_voxel_params(param):
     """
     Based on the lidar range and resolution of voxel, calcuate the anchor box
@@ -64,3 +64,109 @@ def regroup(dense_feature, record_len, max_len):
     mask = torch.from_numpy(np.array(mask)).to(regroup_features.device)
 
     return regroup_features, mask
+
+
+def get_padding_index(record_len, max_len: int, num_features: int):
+    """
+    Locate each cav feature in the flattened padded batch (B * max_len) with
+    tensor ops only, so no host synchronization is needed. The function can
+    be compiled by TorchScript, like to_padded_batch and split_history.
+
+    Parameters
+    ----------
+    record_len : torch.Tensor
+        Cav number of each sample, (B,).
+    max_len : int
+        Padded cav number, not smaller than any record_len.
+    num_features : int
+        Total cav number, sum(record_len).
+
+    Returns
+    -------
+    index : torch.Tensor
+        Position of each feature in the flattened padded batch, (N,).
+    cav_mask : torch.Tensor
+        1 for the valid cavs, 0 for the padding, (B, max_len).
+    """
+    device = record_len.device
+    cum_sum_len = torch.cumsum(record_len, dim=0)
+    feature_index = torch.arange(num_features, device=device)
+    # the sample each feature belongs to
+    batch_index = torch.searchsorted(cum_sum_len, feature_index, right=True)
+    cav_index = feature_index - (cum_sum_len - record_len)[batch_index]
+    index = batch_index * max_len + cav_index
+
+    cav_mask = torch.arange(max_len, device=device).unsqueeze(0) < \
+        record_len.unsqueeze(1)
+
+    return index, cav_mask.int()
+
+
+def to_padded_batch(x, index, batch_size: int, max_len: int):
+    """
+    Stack the flat cav features into a zero padded batch.
+
+    Parameters
+    ----------
+    x : torch.Tensor
+        N, C, H, W
+    index : torch.Tensor
+        The output of get_padding_index, (N,).
+    batch_size : int
+        B
+    max_len : int
+        Padded cav number.
+
+    Returns
+    -------
+    padded_x : torch.Tensor
+        B, L, C, H, W
+    """
+    feature_shape = list(x.shape[1:])
+    padded_x = x.new_zeros([batch_size * max_len] + feature_shape)
+    padded_x = padded_x.index_copy(0, index, x)
+    return padded_x.view([batch_size, max_len] + feature_shape)
+
+
+def from_padded_batch(padded_x, index):
+    """
+    Inverse of to_padded_batch, (B, L, ...) -> (N, ...).
+    """
+    return padded_x.flatten(0, 1)[index]
+
+
+def split_history(x, record_len, num_history: int = 2):
+    """
+    Split the stacked features of IoSI-CP, where the historical ego frames of
+    each sample follow its ego frame, into the current frames and the
+    historical frames while keeping the sample order.
+
+    Parameters
+    ----------
+    x : torch.Tensor
+        N, C, H, W
+    record_len : torch.Tensor
+        Frame number of each sample including the historical ones, (B,).
+    num_history : int
+        Number of historical ego frames of each sample.
+
+    Returns
+    -------
+    current_x : torch.Tensor
+        (N - B * num_history), C, H, W
+    historical_x : torch.Tensor
+        (B * num_history), C, H, W
+    """
+    num_features = x.shape[0]
+    num_current = num_features - record_len.shape[0] * num_history
+    cum_sum_len = torch.cumsum(record_len, dim=0)
+    feature_index = torch.arange(num_features, device=x.device)
+    batch_index = torch.searchsorted(cum_sum_len, feature_index, right=True)
+    cav_index = feature_index - (cum_sum_len - record_len)[batch_index]
+
+    is_history = (cav_index >= 1) & (cav_index <= num_history)
+    # a stable sort moves the historical frames to the end without
+    # changing the order within each group
+    _, order = torch.sort(is_history.int(), stable=True)
+
+    return x[order[:num_current]], x[order[num_current:]]
@@ -8,6 +8,9 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from opencood.models.fuse_modules.fuse_utils import get_padding_index, \
+    to_padded_batch
+
 
 class ScaledDotProductAttention(nn.Module):
     """
@@ -36,31 +39,131 @@ class ScaledDotProductAttention(nn.Module):
         super(ScaledDotProductAttention, self).__init__()
         self.sqrt_dim = np.sqrt(dim)
 
-    def forward(self, query, key, value):
+    def forward(self, query, key, value, mask=None):
         score = torch.bmm(query, key.transpose(1, 2)) / self.sqrt_dim
+        if mask is not None:
+            score = score.masked_fill(mask, -float('inf'))
         attn = F.softmax(score, -1)
         context = torch.bmm(attn, value)
         return context
 
 
+def padded_attention_fusion(x, cav_mask, att, ego_query=False):
+    """
+    Per-pixel self attention across the cavs of a padded batch, only the ego
+    output is kept.
+
+    Parameters
+    ----------
+    x : torch.Tensor
+        Padded features, (B, L, C, H, W), ego first.
+
+    cav_mask : torch.Tensor
+        1 for the valid cavs, 0 for the padding, (B, L).
+
+    att : ScaledDotProductAttention
+        The attention module.
+
+    ego_query : bool
+        Only compute the ego query against all cav keys and values, which
+        gives the same ego output without the (B*H*W, L, L) scores.
+
+    Returns
+    -------
+    out : torch.Tensor
+        Fused ego feature, (B, C, H, W).
+    """
+    B, L, C, H, W = x.shape
+    # (B*H*W, L, C), perform self attention on each pixel
+    x = x.view(B, L, C, H * W).permute(0, 3, 1, 2).reshape(B * H * W, L, C)
+    query = x[:, :1] if ego_query else x
+    # the padded cavs are never attended to
+    mask = (cav_mask == 0)[:, None, None, :].expand(B, H * W, 1, L)
+    out = att(query, x, x, mask.reshape(B * H * W, 1, L))
+    return out[:, 0].reshape(B, H * W, C).permute(0, 2, 1). \
+        reshape(B, C, H, W)
+
+
+def sparse_ego_attention(x, cav_mask, communication_mask, sqrt_dim):
+    """
+    Ego output of the per-pixel self attention, computed densely only on the
+    pixels shared by at least one collaborator.
+
+    Where no collaborator shares its feature, all non-ego features are zero,
+    so the ego attends to itself with score |x_ego|^2 / sqrt(dim) and to the
+    L-1 zero features with score 0. The output there has the closed form
+    x_ego / (1 + (L-1) * exp(-score)), which equals the dense result.
+
+    Parameters
+    ----------
+    x : torch.Tensor
+        Masked and padded features, (B, L, C, H, W), ego first.
+
+    cav_mask : torch.Tensor
+        1 for the valid cavs, 0 for the padding, (B, L).
+
+    communication_mask : torch.Tensor
+        The communication mask the features were multiplied with, zero for
+        the padding, (B, L, 1, H, W).
+
+    sqrt_dim : float
+        The attention scale.
+
+    Returns
+    -------
+    out : torch.Tensor
+        Fused ego feature, (B, C, H, W).
+    """
+    B, L, C, H, W = x.shape
+    x = x.view(B, L, C, H * W)
+    ego = x[:, 0]
+
+    # (B, H*W)
+    score = (ego * ego).sum(dim=1) / sqrt_dim
+    collaborator_num = (cav_mask.sum(dim=1, keepdim=True) - 1).type_as(x)
+    out = ego / (1 + collaborator_num * torch.exp(-score)).unsqueeze(1)
+
+    if L > 1:
+        # union of the communicated pixels of all collaborators of each
+        # sample
+        active = (communication_mask[:, 1:].reshape(B, L - 1, H * W) > 0). \
+            any(dim=1)
+        batch_index, pixel_index = torch.nonzero(active, as_tuple=True)
+        # (P, L, C)
+        active_x = x.permute(0, 3, 1, 2)[batch_index, pixel_index]
+        mask = (cav_mask[batch_index] == 0).unsqueeze(1)
+        score = torch.bmm(active_x[:, :1],
+                          active_x.transpose(1, 2)) / sqrt_dim
+        score = score.masked_fill(mask, -float('inf'))
+        context = torch.bmm(F.softmax(score, -1), active_x)
+
+        out = out.permute(0, 2, 1).index_put((batch_index, pixel_index),
+                                             context[:, 0]).permute(0, 2, 1)
+
+    return out.reshape(B, C, H, W)
+
+
 class AttFusion(nn.Module):
-    def __init__(self, feature_dim):
+    """
+    Per-pixel self attention across cavs, only the ego output is kept.
+
+    Parameters
+    ----------
+    feature_dim : int
+        Channel number of the features.
+
+    ego_query : bool
+        Only compute the ego query against all cav keys and values, which
+        gives the same ego output without the (H*W, L, L) scores.
+    """
+    def __init__(self, feature_dim, ego_query=False):
         super(AttFusion, self).__init__()
         self.att = ScaledDotProductAttention(feature_dim)
+        self.ego_query = ego_query
 
     def forward(self, x, record_len):
-        split_x = self.regroup(x, record_len)
-        C, W, H = split_x[0].shape[1:]
-        out = []
-        for xx in split_x:
-            cav_num = xx.shape[0]
-            xx = xx.view(cav_num, C, -1).permute(2, 0, 1)
-            h = self.att(xx, xx, xx)
-            h = h.permute(1, 2, 0).view(cav_num, C, W, H)[0, ...]
-            out.append(h)
-        return torch.stack(out)
-
-    def regroup(self, x, record_len):
-        cum_sum_len = torch.cumsum(record_len, dim=0)
-        split_x = torch.tensor_split(x, cum_sum_len[:-1].cpu())
-        return split_x
+        # pad all samples to the largest cav number and fuse them at once
+        max_len = int(record_len.max())
+        index, cav_mask = get_padding_index(record_len, max_len, x.shape[0])
+        x = to_padded_batch(x, index, record_len.shape[0], max_len)
+        return padded_attention_fusion(x, cav_mask, self.att, self.ego_query)
@@ -8,7 +8,10 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import cv2
-from opencood.models.fuse_modules.self_attn import ScaledDotProductAttention
+from opencood.models.fuse_modules.self_attn import \
+    ScaledDotProductAttention, padded_attention_fusion, sparse_ego_attention
+from opencood.models.fuse_modules.fuse_utils import get_padding_index, \
+    to_padded_batch, from_padded_batch
 import os
 import shutil
 
@@ -37,66 +40,74 @@ class Communication(nn.Module):
             self.gaussian_filter.weight.device).unsqueeze(0).unsqueeze(0)
         self.gaussian_filter.bias.data.zero_()
 
-    def forward(self, batch_confidence_maps, B):
+    def forward(self, batch_confidence_maps, cav_mask):
         """
         Args:
-            batch_confidence_maps: [(L1, H, W), (L2, H, W), ...]
+            batch_confidence_maps: padded confidence maps, (B, L, A, H, W).
+            cav_mask: 1 for the valid cavs, 0 for the padding, (B, L).
+
+        Returns:
+            communication_masks: (B, L, 1, H, W), zero for the padding.
+            communication_rates: mean ratio of the shared pixels.
         """
 
-        _, _, H, W = batch_confidence_maps[0].shape
-        communication_masks = []
-        communication_rates = []
-        for b in range(B):
-            ori_communication_maps, _ = batch_confidence_maps[b].sigmoid().max(dim=1, keepdim=True)
-            if self.smooth:
-                communication_maps = self.gaussian_filter(ori_communication_maps)
-            else:
-                communication_maps = ori_communication_maps
-
-            L = communication_maps.shape[0]
-            if self.training:
-                # Official training proxy objective
-                K = int(H * W * random.uniform(0, 1))
-                communication_maps = communication_maps.reshape(L, H * W)
-                _, indices = torch.topk(communication_maps, k=K, sorted=False)
-                communication_mask = torch.zeros_like(communication_maps).to(communication_maps.device)
-                ones_fill = torch.ones(L, K, dtype=communication_maps.dtype, device=communication_maps.device)
-                communication_mask = torch.scatter(communication_mask, -1, indices, ones_fill).reshape(L, 1, H, W)
-                # print('communication_mask.sum(),K,communication_mask.shape,communication_maps.shape:',communication_mask.sum(),K,communication_mask.shape,communication_maps.shape)
-                # communication_mask.sum(),K,communication_mask.shape,communication_maps.shape: tensor(14878., device='cuda:0') 7439 torch.Size([2, 1, 48, 176]) torch.Size([2, 8448])
-                # communication_mask.sum(),K,communication_mask.shape,communication_maps.shape: tensor(32964., device='cuda:0') 8241 torch.Size([4, 1, 48, 176]) torch.Size([4, 8448])
-                # communication_mask.sum(),K,communication_mask.shape,communication_maps.shape: tensor(12260., device='cuda:0') 6130 torch.Size([2, 1, 48, 176]) torch.Size([2, 8448])
-            elif self.threshold:
-                ones_mask = torch.ones_like(communication_maps).to(communication_maps.device)
-                zeros_mask = torch.zeros_like(communication_maps).to(communication_maps.device)
-                communication_mask = torch.where(communication_maps > self.threshold, ones_mask, zeros_mask)
-                # print('self.threshold,communication_maps.sum(),communication_mask.sum(),L * H * W:',self.threshold,communication_maps.sum(),communication_mask.sum(),L * H * W,L,W,H)
-            else:
-                communication_mask = torch.ones_like(communication_maps).to(communication_maps.device)
+        B, L, _, H, W = batch_confidence_maps.shape
+        ori_communication_maps, _ = batch_confidence_maps.sigmoid().max(dim=2, keepdim=True)
+        if self.smooth:
+            communication_maps = self.gaussian_filter(
+                ori_communication_maps.view(B * L, 1, H, W)).view(B, L, 1, H, W)
+        else:
+            communication_maps = ori_communication_maps
+
+        if self.training:
+            # Official training proxy objective, keep the top K pixels of
+            # each map with a random K per sample
+            K = torch.tensor([int(H * W * random.uniform(0, 1)) for _ in range(B)])
+            K = K.to(communication_maps.device).view(B, 1, 1)
+            communication_maps = communication_maps.reshape(B, L, H * W)
+            _, indices = torch.sort(communication_maps, dim=-1, descending=True)
+            ones_fill = (torch.arange(H * W, device=communication_maps.device) < K). \
+                type_as(communication_maps).expand(B, L, H * W)
+            communication_mask = torch.zeros_like(communication_maps).scatter(
+                -1, indices, ones_fill).reshape(B, L, 1, H, W)
+        elif self.threshold:
+            communication_mask = (communication_maps > self.threshold).type_as(communication_maps)
+        else:
+            communication_mask = torch.ones_like(communication_maps)
+        communication_mask = communication_mask * cav_mask.view(B, L, 1, 1, 1).type_as(communication_mask)
 
-            communication_rate = communication_mask.sum() / (L * H * W)
-            # Ego
-            communication_mask[0] = 1
+        # ratio over the valid cavs of each sample
+        communication_rates = (communication_mask.sum(dim=(1, 2, 3, 4)) /
+                               (cav_mask.sum(dim=1) * H * W)).mean()
+        # Ego
+        communication_mask[:, 0] = 1
 
-            communication_masks.append(communication_mask)
-            communication_rates.append(communication_rate)
-        communication_rates = sum(communication_rates) / B
-        # print('self.training,communication_rates:',self.training,communication_rates)
-        communication_masks = torch.cat(communication_masks, dim=0)
-        return communication_masks, communication_rates
+        return communication_mask, communication_rates
 
 
 class AttentionFusion(nn.Module):
-    def __init__(self, feature_dim):
+    def __init__(self, feature_dim, ego_query=False):
         super(AttentionFusion, self).__init__()
         self.att = ScaledDotProductAttention(feature_dim)
+        # only compute the ego query, the other rows are discarded anyway
+        self.ego_query = ego_query
+
+    def forward(self, x, cav_mask, communication_mask=None):
+        """
+        Args:
+            x: padded features, (B, L, C, H, W), ego first.
+            cav_mask: 1 for the valid cavs, 0 for the padding, (B, L).
+            communication_mask: (B, L, 1, H, W), only fuse the communicated
+                pixels if given.
 
-    def forward(self, x):
-        cav_num, C, H, W = x.shape  ##x.shape [4, 64, 96, 352]
-        x = x.view(cav_num, C, -1).permute(2, 0, 1)  # (H*W, cav_num, C), perform self attention on each pixel # x.shape [33792, 4, 64]
-        x = self.att(x, x, x)
-        x = x.permute(1, 2, 0).view(cav_num, C, H, W)[0]  # C, W, H before ## [ 4, 64, 33792] -> [ 4, 64, 96, 352] -> [ 1, 64, 96, 352]
-        return x
+        Returns:
+            Fused ego features, (B, C, H, W).
+        """
+        if communication_mask is not None:
+            # sparse fusion over the communicated pixels only
+            return sparse_ego_attention(x, cav_mask, communication_mask,
+                                        self.att.sqrt_dim)
+        return padded_attention_fusion(x, cav_mask, self.att, self.ego_query)
 
 
 class Where2comm(nn.Module):
@@ -111,6 +122,11 @@ class Where2comm(nn.Module):
         else:
             print('constructing a partially connected communication graph')
 
+        ego_query = args['ego_query'] if 'ego_query' in args else False
+        # only attend over the pixels selected by the communication module
+        self.sparse_fusion = args['sparse_fusion'] \
+            if 'sparse_fusion' in args else False
+
         self.multi_scale = args['multi_scale']
         if self.multi_scale:
             layer_nums = args['layer_nums']
@@ -120,19 +136,14 @@ class Where2comm(nn.Module):
             # print('layer_nums,self.num_levels,num_filters:',layer_nums,self.num_levels,num_filters)
             # layer_nums,self.num_levels,num_filters: [3, 5, 8] 3 [64, 128, 256]
             for idx in range(self.num_levels):
-                fuse_network = AttentionFusion(num_filters[idx])
+                fuse_network = AttentionFusion(num_filters[idx], ego_query)
                 self.fuse_modules.append(fuse_network)
         else:
-            self.fuse_modules = AttentionFusion(args['in_channels'])
+            self.fuse_modules = AttentionFusion(args['in_channels'],
+                                                ego_query)
 
         self.naive_communication = Communication(args['communication'])
 
-    def regroup(self, x, record_len):
-        cum_sum_len = torch.cumsum(record_len, dim=0)
-        split_x = torch.tensor_split(x, cum_sum_len[:-1].cpu())
-        # print('cum_sum_len,split_x.shape:',cum_sum_len,len(split_x),split_x[0].shape)
-        return split_x
-
     def forward(self, x, psm_single, record_len, pairwise_t_matrix, time_delay, backbone=None):
     # def forward(self, x, psm_single, record_len, pairwise_t_matrix, time_delay, backbone=None):
         """
@@ -149,6 +160,10 @@ class Where2comm(nn.Module):
 
         _, C, H, W = x.shape  ## x.shape -> [4, 64, 192, 704]
         B = pairwise_t_matrix.shape[0] ## shape -> [1, 5, 5, 4, 4]
+
+        # pad all samples to the same cav number once
+        max_len = pairwise_t_matrix.shape[1]
+        index, cav_mask = get_padding_index(record_len, max_len, x.shape[0])
         # print('time_delay.shape:',time_delay)
         if self.multi_scale:
             ups = []
@@ -163,17 +178,17 @@ class Where2comm(nn.Module):
                         communication_rates = torch.tensor(1).to(x.device)
                     else:
                         # Prune
-                        batch_confidence_maps = self.regroup(psm_single, record_len)  ## batch_confidence_maps.shape -> [1, 4, 2, 48, 176],B=1
-                        communication_masks, communication_rates = self.naive_communication(batch_confidence_maps, B)
+                        batch_confidence_maps = to_padded_batch(psm_single, index, B, max_len)  ## batch_confidence_maps.shape -> [1, 5, 2, 48, 176],B=1
+                        communication_masks, communication_rates = self.naive_communication(batch_confidence_maps, cav_mask)
                         # print('communication_rates:',communication_rates)
-                        ## communication_masks.shape -> [4, 1, 48, 176]
+                        ## communication_masks.shape -> [1, 5, 1, 48, 176]
                         ## communication_rates value ~ [0,1]
                         if x.shape[-1] != communication_masks.shape[-1]:  ##
-                            communication_masks = F.interpolate(communication_masks, size=(x.shape[-2], x.shape[-1]),
-                                                                mode='bilinear', align_corners=False)
+                            communication_masks = F.interpolate(communication_masks.flatten(0, 1), size=(x.shape[-2], x.shape[-1]),
+                                                                mode='bilinear', align_corners=False).view(B, max_len, 1, x.shape[-2], x.shape[-1])
                         ### Original
-                        # communication_masks.shape -> [4, 1, 96, 352]
-                        x = x * communication_masks  ## x.shape -> [4, 64, 96, 352]
+                        # communication_masks.shape -> [1, 5, 1, 96, 352]
+                        x = x * from_padded_batch(communication_masks, index)  ## x.shape -> [4, 64, 96, 352]
                         # print(x[0].element_size() * x[0].nelement())
                         # print('x.shape, communication_masks.shape,time_delay.shape:',x.shape, communication_masks.shape,time_delay.shape)
                         ### add aoi
@@ -203,17 +218,14 @@ class Where2comm(nn.Module):
                         #     # cv2.imwrite('opencood/logs/commasks/' + str(k) + '_aoiweight.png',
                         #     #             (communication_masks[k].permute(2, 1, 0).cpu().numpy() * 255))
                         # x = x * communication_masks  ## x.shape -> [4, 64, 96, 352]
-                # 2. Split the features
-                # split_x: [(L1, C, H, W), (L2, C, H, W), ...]
-                # For example [[2, 256, 48, 176], [1, 256, 48, 176], ...]
-                batch_node_features = self.regroup(x, record_len)
-
-                # 3. Fusion
-                x_fuse = []
-                for b in range(B):
-                    neighbor_feature = batch_node_features[b]  ## neighbor_feature.shape -> [4, 64, 96, 352]
-                    x_fuse.append(self.fuse_modules[i](neighbor_feature))
-                x_fuse = torch.stack(x_fuse) # x_fuse three time : [4, 64, 96, 352] [4, 128, 48, 176] [4, 256, 24, 88]
+                # 2. Pad the features, (B, L, C, H, W)
+                batch_node_features = to_padded_batch(x, index, B, max_len)
+
+                # 3. Fusion, the features are only sparse at the masked level
+                x_fuse = self.fuse_modules[i](
+                    batch_node_features, cav_mask,
+                    communication_masks if self.sparse_fusion and i == 0 and
+                    not self.fully else None) # x_fuse three time : [1, 64, 96, 352] [1, 128, 48, 176] [1, 256, 24, 88]
                 # print('i,x_fuse:',i,x_fuse.shape)
                 # 4. Deconv
                 if len(backbone.deblocks) > 0:
@@ -235,19 +247,18 @@ class Where2comm(nn.Module):
                 communication_rates = torch.tensor(1).to(x.device)
             else:
                 # Prune
-                batch_confidence_maps = self.regroup(psm_single, record_len)
-                communication_masks, communication_rates = self.naive_communication(batch_confidence_maps, B)
-                x = x * communication_masks
+                batch_confidence_maps = to_padded_batch(psm_single, index,
+                                                        B, max_len)
+                communication_masks, communication_rates = \
+                    self.naive_communication(batch_confidence_maps, cav_mask)
+                x = x * from_padded_batch(communication_masks, index)
 
-            # 2. Split the features
-            # split_x: [(L1, C, H, W), (L2, C, H, W), ...]
-            # For example [[2, 256, 48, 176], [1, 256, 48, 176], ...]
-            batch_node_features = self.regroup(x, record_len)
+            # 2. Pad the features, (B, L, C, H, W)
+            batch_node_features = to_padded_batch(x, index, B, max_len)
 
             # 3. Fusion
-            x_fuse = []
-            for b in range(B):
-                neighbor_feature = batch_node_features[b]
-                x_fuse.append(self.fuse_modules(neighbor_feature))
-            x_fuse = torch.stack(x_fuse)
+            x_fuse = self.fuse_modules(
+                batch_node_features, cav_mask,
+                communication_masks if self.sparse_fusion and not self.fully
+                else None)
         return x_fuse, communication_rates
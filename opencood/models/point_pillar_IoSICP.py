@@ -4,16 +4,23 @@ import torch.nn as nn
 
 from opencood.models.sub_modules.base_bev_backbone import BaseBEVBackbone
 from opencood.models.fuse_modules.HPHA_fuse import HPHA
+from opencood.models.fuse_modules.fuse_utils import split_history
 from opencood.models.sub_modules.downsample_conv import DownsampleConv
 from opencood.models.sub_modules.naive_compress import NaiveCompressor
 from opencood.models.sub_modules.pillar_vfe import PillarVFE
 from opencood.models.sub_modules.point_pillar_scatter import PointPillarScatter
+from opencood.models.sub_modules.temporal_feature_cache import \
+    TemporalFeatureCache
 import torch
 
 class PointPillarIoSICP(nn.Module):
     def __init__(self, args):
         super(PointPillarIoSICP, self).__init__()
         self.max_cav = args['max_cav']
+        self.voxel_size = args['voxel_size']
+        # temporal cache of the ego features, only used in sequential
+        # inference, see enable_temporal_cache
+        self.temporal_cache = None
         # Pillar VFE
         self.pillar_vfe = PillarVFE(args['pillar_vfe'],
                                     num_point_features=4,
@@ -70,6 +77,20 @@ class PointPillarIoSICP(nn.Module):
         for p in self.reg_head.parameters():
             p.requires_grad = False
 
+    def enable_temporal_cache(self, max_size=4):
+        """
+        Reuse the ego features of the previous frames as the historical ego
+        features during sequential inference. The dataset needs to have
+        history_from_cache enabled, so the historical frames are not loaded.
+
+        Parameters
+        ----------
+        max_size : int
+            Maximum number of cached ego frames.
+        """
+        self.temporal_cache = TemporalFeatureCache(self.voxel_size[0],
+                                                   max_size)
+
     def forward(self, data_dict):
         voxel_features = data_dict['processed_lidar']['voxel_features']
         voxel_coords = data_dict['processed_lidar']['voxel_coords']
@@ -81,40 +102,39 @@ class PointPillarIoSICP(nn.Module):
                       'voxel_coords': voxel_coords,
                       'voxel_num_points': voxel_num_points,
                       'record_len': record_len}
+        if 'batch_size' in data_dict['processed_lidar']:
+            batch_dict['batch_size'] = \
+                data_dict['processed_lidar']['batch_size']
         # n, 4 -> n, c
         batch_dict = self.pillar_vfe(batch_dict)
         # n, c -> N, C, H, W
         batch_dict = self.scatter(batch_dict)
-        batch_dict = self.backbone(batch_dict)
 
-        # N, C, H', W': [N, 256, 48, 176]
-        # print('batch_dict spatial_features_2d shape:',batch_dict['spatial_features_2d'].shape,len(batch_dict['spatial_features_2d'].shape),len(batch_dict['spatial_features_2d'][3:].shape))
-        if len(batch_dict['spatial_features_2d'][3:].shape) >= 4:
-            spatial_features_2d = torch.cat([batch_dict['spatial_features_2d'][0].unsqueeze(0),batch_dict['spatial_features_2d'][3:]], dim=0)
-        else:
-            spatial_features_2d = torch.cat([batch_dict['spatial_features_2d'][0].unsqueeze(0),batch_dict['spatial_features_2d'][3:]].unsqueeze(0), dim=0)
-        # print('spatial_features_2d.shape:',spatial_features_2d.shape)
-        # Down-sample feature to reduce memory
-        if self.shrink_flag: ## self.shrink_flag->True
-            spatial_features_2d = self.shrink_conv(spatial_features_2d)  ## [4, 384, 96, 352]->[4, 256, 48, 176]
-        psm_single = self.cls_head(spatial_features_2d) ## [4, 2, 48, 176]
-
-        # Compressor
-        if self.compression:  ## self.compression False
-            # The ego feature is also compressed
-            spatial_features_2d = self.naive_compressor(spatial_features_2d)
-        # print('t2:',time.time())
+        if 'history_keys' in data_dict:
+            assert self.temporal_cache is not None, \
+                'The historical frames are not loaded, ' \
+                'call enable_temporal_cache first'
+            # only the current frames are loaded, the historical ego
+            # features are restored from the cache
+            batch_dict['spatial_features'] = \
+                self.temporal_cache.restore_history(
+                    batch_dict['spatial_features'],
+                    record_len,
+                    data_dict['frame_keys'],
+                    data_dict['history_keys'],
+                    data_dict['history_t_matrix'])
+
         if self.multi_scale:
+            # The multi-scale fusion runs each backbone level once on the
+            # time-delay enhanced features. The confidence-based pruning is
+            # disabled in this mode, so the single-agent head (and the full
+            # backbone pass it needs) is not computed.
             # add historical semantic information of ego
-            if len(batch_dict['spatial_features'][3:].shape) >= 4:
-                batch_semantic_informantion_dict = torch.cat(
-                    [batch_dict['spatial_features'][0].unsqueeze(0), batch_dict['spatial_features'][3:]], dim=0)
-            else:
-                batch_semantic_informantion_dict = torch.cat([batch_dict['spatial_features'][0].unsqueeze(0),
-                                                 batch_dict['spatial_features'][3:]].unsqueeze(0), dim=0)
+            batch_semantic_informantion_dict, historical_features = \
+                split_history(batch_dict['spatial_features'], record_len)
             fused_feature, communication_rates = self.fusion_net(batch_semantic_informantion_dict, ## semantic information ## batch_dict['spatial_features']-> [4, 64, 192, 704])
-                                                                 batch_dict['spatial_features'][1:3], ## historical semantic information
-                                                                 psm_single,
+                                                                 historical_features, ## historical semantic information
+                                                                 None,
                                                                  record_len,
                                                                  pairwise_t_matrix,
                                                                  time_delay,
@@ -122,10 +142,26 @@ class PointPillarIoSICP(nn.Module):
             if self.shrink_flag:
                 fused_feature = self.shrink_conv(fused_feature) ## [1, 384, 96, 352] -> [1, 256, 48, 176]
         else:   ## 采用downsample后的低分辨率feature融合,
+            batch_dict = self.backbone(batch_dict)
+
+            # N, C, H', W': [N, 256, 48, 176]
+            spatial_features_2d, historical_features_2d = \
+                split_history(batch_dict['spatial_features_2d'], record_len)
+            # Down-sample feature to reduce memory
+            if self.shrink_flag: ## self.shrink_flag->True
+                spatial_features_2d = self.shrink_conv(spatial_features_2d)  ## [4, 384, 96, 352]->[4, 256, 48, 176]
+            psm_single = self.cls_head(spatial_features_2d) ## [4, 2, 48, 176]
+
+            # Compressor
+            if self.compression:  ## self.compression False
+                # The ego feature is also compressed
+                spatial_features_2d = self.naive_compressor(spatial_features_2d)
             fused_feature, communication_rates = self.fusion_net(spatial_features_2d,
+                                                                 historical_features_2d,
                                                                  psm_single,
                                                                  record_len,
-                                                                 pairwise_t_matrix,time_delay,)
+                                                                 pairwise_t_matrix,
+                                                                 time_delay)
         psm = self.cls_head(fused_feature) ## [1, 256, 48, 176] -> [1, 256, 48, 176]
         rm = self.reg_head(fused_feature)  ## [1, 256, 48, 176] -> [1, 256, 48, 176]
         output_dict = {'psm': psm, 'rm': rm, 'com': communication_rates}
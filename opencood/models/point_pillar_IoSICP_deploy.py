@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Tensor-only deployment variant of PointPillarIoSICP
+"""
+from typing import Tuple
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from opencood.models.fuse_modules.fuse_utils import get_padding_index, \
+    to_padded_batch, split_history
+
+
+class DeployPFNLayer(nn.Module):
+    """
+    PFNLayer without the cudnn switch around the batch norm, which cannot be
+    compiled. It shares the linear and norm layers of the given PFNLayer.
+    """
+
+    def __init__(self, pfn_layer):
+        super(DeployPFNLayer, self).__init__()
+        self.linear = pfn_layer.linear
+        self.norm = pfn_layer.norm if pfn_layer.use_norm else nn.Identity()
+        self.last_vfe = pfn_layer.last_vfe
+        self.part = pfn_layer.part
+
+    def forward(self, inputs):
+        if inputs.shape[0] > self.part:
+            # nn.Linear performs randomly when batch size is too large
+            num_parts = inputs.shape[0] // self.part
+            part_linear_out = [self.linear(
+                inputs[num_part * self.part:(num_part + 1) * self.part])
+                for num_part in range(num_parts + 1)]
+            x = torch.cat(part_linear_out, dim=0)
+        else:
+            x = self.linear(inputs)
+        x = self.norm(x.permute(0, 2, 1)).permute(0, 2, 1)
+        x = F.relu(x)
+        x_max = torch.max(x, dim=1, keepdim=True)[0]
+
+        if self.last_vfe:
+            return x_max
+        x_repeat = x_max.repeat(1, inputs.shape[1], 1)
+        return torch.cat([x, x_repeat], dim=2)
+
+
+class DeployLevel(nn.Module):
+    """
+    A backbone block, its deconvolution and the attention scale of the
+    fusion at the same level.
+    """
+
+    def __init__(self, block, deblock, sqrt_dim):
+        super(DeployLevel, self).__init__()
+        self.block = block
+        self.deblock = deblock
+        self.sqrt_dim = float(sqrt_dim)
+
+
+class PointPillarIoSICPDeploy(nn.Module):
+    """
+    The multi-scale PointPillarIoSICP inference with tensor inputs and
+    outputs, which can be compiled by torch.jit.script or torch.compile.
+    The modules and the weights are shared with the eager model, so a
+    trained checkpoint is loaded into the eager model first:
+
+        model = train_utils.create_model(hypes)
+        train_utils.load_saved_model(model_dir, model)
+        deploy_model = torch.jit.script(
+            PointPillarIoSICPDeploy(model.eval()))
+        psm, rm = deploy_model(*PointPillarIoSICPDeploy.get_inputs(
+            batch_data['ego']))
+
+    The dictionaries, the backbone passed to the fusion and the branches on
+    the configuration are resolved when the variant is built. The temporal
+    feature cache, the compression and the single-scale fusion are not
+    supported.
+
+    Parameters
+    ----------
+    model : opencood.models.point_pillar_IoSICP.PointPillarIoSICP
+        The eager model, in eval mode.
+    """
+
+    def __init__(self, model):
+        super(PointPillarIoSICPDeploy, self).__init__()
+        fusion_net = model.fusion_net
+        backbone = model.backbone
+        assert model.multi_scale and not model.compression, \
+            'Only the multi-scale fusion without compression is supported'
+        assert len(backbone.deblocks) > fusion_net.num_levels, \
+            'The backbone needs the upsampling layers'
+
+        # pillar vfe
+        pillar_vfe = model.pillar_vfe
+        self.pfn_layers = nn.ModuleList(
+            [DeployPFNLayer(pfn) for pfn in pillar_vfe.pfn_layers])
+        self.use_absolute_xyz = pillar_vfe.use_absolute_xyz
+        self.with_distance = pillar_vfe.with_distance
+        self.voxel_x = float(pillar_vfe.voxel_x)
+        self.voxel_y = float(pillar_vfe.voxel_y)
+        self.voxel_z = float(pillar_vfe.voxel_z)
+        self.x_offset = float(pillar_vfe.x_offset)
+        self.y_offset = float(pillar_vfe.y_offset)
+        self.z_offset = float(pillar_vfe.z_offset)
+
+        # scatter
+        self.num_bev_features = model.scatter.num_bev_features
+        self.nx = int(model.scatter.nx)
+        self.ny = int(model.scatter.ny)
+
+        # backbone and HPHA fusion
+        self.levels = nn.ModuleList(
+            [DeployLevel(backbone.blocks[i], backbone.deblocks[i],
+                         fusion_net.fuse_modules[i].att.sqrt_dim)
+             for i in range(fusion_net.num_levels)])
+        self.ego_query = fusion_net.fuse_modules[0].ego_query
+        self.enhanceweight = fusion_net.enhanceweight
+        self.sta = fusion_net.sta
+        self.final_deblock = backbone.deblocks[-1]
+
+        self.shrink_layers = model.shrink_conv.layers if model.shrink_flag \
+            else nn.ModuleList()
+        self.cls_head = model.cls_head
+        self.reg_head = model.reg_head
+
+    @staticmethod
+    def get_inputs(data_dict):
+        """
+        The input tensors of the deployment variant from the ego batch of the
+        intermediate fusion dataset.
+
+        Returns
+        -------
+        inputs : tuple
+            voxel_features, voxel_coords, voxel_num_points, record_len,
+            pairwise_t_matrix and time_delay.
+        """
+        return (data_dict['processed_lidar']['voxel_features'],
+                data_dict['processed_lidar']['voxel_coords'],
+                data_dict['processed_lidar']['voxel_num_points'],
+                data_dict['record_len'],
+                data_dict['pairwise_t_matrix'],
+                data_dict['time_delay'])
+
+    def pillar_features(self, voxel_features, voxel_coords,
+                        voxel_num_points):
+        """
+        PillarVFE, (M, P, 4) -> (M, C).
+        """
+        points_mean = \
+            voxel_features[:, :, :3].sum(dim=1, keepdim=True) / \
+            voxel_num_points.type_as(voxel_features).view(-1, 1, 1)
+        f_cluster = voxel_features[:, :, :3] - points_mean
+
+        f_center = torch.zeros_like(voxel_features[:, :, :3])
+        f_center[:, :, 0] = voxel_features[:, :, 0] - (
+                voxel_coords[:, 3].to(voxel_features.dtype).unsqueeze(
+                    1) * self.voxel_x + self.x_offset)
+        f_center[:, :, 1] = voxel_features[:, :, 1] - (
+                voxel_coords[:, 2].to(voxel_features.dtype).unsqueeze(
+                    1) * self.voxel_y + self.y_offset)
+        f_center[:, :, 2] = voxel_features[:, :, 2] - (
+                voxel_coords[:, 1].to(voxel_features.dtype).unsqueeze(
+                    1) * self.voxel_z + self.z_offset)
+
+        if self.use_absolute_xyz:
+            feature_list = [voxel_features, f_cluster, f_center]
+        else:
+            feature_list = [voxel_features[..., 3:], f_cluster, f_center]
+        if self.with_distance:
+            feature_list.append(voxel_features[:, :, :3].norm(
+                p=2, dim=2, keepdim=True))
+        features = torch.cat(feature_list, dim=-1)
+
+        mask = voxel_num_points.int().unsqueeze(1) > \
+            torch.arange(features.shape[1], dtype=torch.int,
+                         device=voxel_num_points.device).view(1, -1)
+        features = features * mask.unsqueeze(-1).type_as(voxel_features)
+        for pfn in self.pfn_layers:
+            features = pfn(features)
+        return features.squeeze(1)
+
+    def scatter(self, pillar_features, voxel_coords, num_frames: int):
+        """
+        PointPillarScatter, (M, C) -> (N, C, ny, nx), with a single scatter
+        over all the frames.
+        """
+        spatial_features = pillar_features.new_zeros(
+            [num_frames, self.num_bev_features, self.ny * self.nx])
+        spatial_index = voxel_coords[:, 1] + \
+            voxel_coords[:, 2] * self.nx + voxel_coords[:, 3]
+        spatial_features[voxel_coords[:, 0].long(), :,
+                         spatial_index.long()] = pillar_features
+        return spatial_features.view(num_frames, self.num_bev_features,
+                                     self.ny, self.nx)
+
+    def fusion(self, spatial_features, record_len, max_cav: int,
+               time_delay):
+        """
+        The multi-scale HPHA fusion, (N, C, H, W) -> (B, C', H', W').
+        """
+        batch_size = record_len.shape[0]
+        num_frames = spatial_features.shape[0]
+        x, historical_x = split_history(spatial_features, record_len)
+
+        num_history = historical_x.shape[0] // batch_size
+        max_len = max_cav - num_history
+        index, cav_mask = get_padding_index(record_len - num_history,
+                                            max_len, x.shape[0])
+
+        # time delay enhance weight of every frame
+        enhance_weight = self.enhanceweight(
+            torch.reciprocal(time_delay + 0.1).to(x.dtype).unsqueeze(-1))
+        frame_index, _ = get_padding_index(record_len, max_cav, num_frames)
+        x_enw, historical_x_enw = split_history(
+            enhance_weight.view(-1)[frame_index], record_len, num_history)
+        x = x * x_enw.view(-1, 1, 1, 1)
+        historical_x = historical_x * historical_x_enw.view(-1, 1, 1, 1)
+
+        historical_x = self.levels[0].block(historical_x)
+        # the padded cavs are never attended to
+        padding_mask = (cav_mask == 0)[:, None, None, :]
+        ups = []
+        for level in self.levels:
+            x = level.block(x)
+            # per-pixel attention across the cavs, (B*H*W, L, C)
+            padded_x = to_padded_batch(x, index, batch_size, max_len)
+            _, _, C, H, W = padded_x.shape
+            padded_x = padded_x.reshape(batch_size, max_len, C, H * W). \
+                permute(0, 3, 1, 2).reshape(batch_size * H * W, max_len, C)
+            query = padded_x[:, :1] if self.ego_query else padded_x
+            score = torch.bmm(query, padded_x.transpose(1, 2)) / \
+                level.sqrt_dim
+            score = score.masked_fill(
+                padding_mask.expand(batch_size, H * W, 1, max_len).reshape(
+                    batch_size * H * W, 1, max_len), -float('inf'))
+            context = torch.bmm(F.softmax(score, -1), padded_x)
+            x_fuse = context[:, 0].reshape(batch_size, H * W, C). \
+                permute(0, 2, 1).reshape(batch_size, C, H, W)
+            ups.append(level.deblock(x_fuse))
+
+        # the historical frames of each sample along the channels
+        ups.append(historical_x.reshape(batch_size, -1, historical_x.shape[2],
+                                        historical_x.shape[3]))
+        x_fuse = torch.cat(ups, dim=1)
+        x_fuse = self.sta(x_fuse) * x_fuse
+        return self.final_deblock(x_fuse)
+
+    def forward(self, voxel_features, voxel_coords, voxel_num_points,
+                record_len, pairwise_t_matrix, time_delay) \
+            -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Parameters
+        ----------
+        voxel_features : torch.Tensor
+            (M, P, 4), the points of the pillars of all the frames.
+
+        voxel_coords : torch.Tensor
+            (M, 4), frame index, z, y and x of each pillar.
+
+        voxel_num_points : torch.Tensor
+            (M,), number of points of each pillar.
+
+        record_len : torch.Tensor
+            (B,), frame number of each sample, including the historical ego
+            frames.
+
+        pairwise_t_matrix : torch.Tensor
+            (B, L, L, 4, 4), only its shape is used.
+
+        time_delay : torch.Tensor
+            (B, L), the time delay of each frame.
+
+        Returns
+        -------
+        psm : torch.Tensor
+            (B, A, H, W), the classification map.
+
+        rm : torch.Tensor
+            (B, 7A, H, W), the regression map.
+        """
+        pillar_features = self.pillar_features(voxel_features, voxel_coords,
+                                               voxel_num_points)
+        spatial_features = self.scatter(pillar_features, voxel_coords,
+                                        int(record_len.sum()))
+        fused_feature = self.fusion(spatial_features, record_len,
+                                    pairwise_t_matrix.shape[1], time_delay)
+        for layer in self.shrink_layers:
+            fused_feature = layer(fused_feature)
+
+        return self.cls_head(fused_feature), self.reg_head(fused_feature)
@@ -40,6 +40,8 @@ class AttBEVBackbone(nn.Module):
 
         num_levels = len(layer_nums)
         c_in_list = [input_channels, *num_filters[:-1]]
+        ego_query = self.model_cfg['ego_query'] \
+            if 'ego_query' in self.model_cfg else False
 
         self.blocks = nn.ModuleList()
         self.fuse_modules = nn.ModuleList()
@@ -59,7 +61,7 @@ class AttBEVBackbone(nn.Module):
                 nn.ReLU()
             ]
 
-            fuse_network = AttFusion(num_filters[idx])
+            fuse_network = AttFusion(num_filters[idx], ego_query)
             self.fuse_modules.append(fuse_network)
             if self.compress and self.compress_layer - idx > 0:
                 self.compression_modules.append(AutoEncoder(num_filters[idx],
@@ -1,4 +1,3 @@
-import torch
 import torch.nn as nn
 
 
@@ -14,35 +13,25 @@ class PointPillarScatter(nn.Module):
     def forward(self, batch_dict):
         pillar_features, coords = batch_dict['pillar_features'], batch_dict[
             'voxel_coords']
-        batch_spatial_features = []
-        batch_size = coords[:, 0].max().int().item() + 1
+        # the frame number collated on the host, the device is only read
+        # when it is not given
+        if 'batch_size' in batch_dict:
+            batch_size = batch_dict['batch_size']
+        else:
+            batch_size = coords[:, 0].max().int().item() + 1
+
+        # scatter the pillars of all frames at once, each pillar is located
+        # by its frame and its flattened y * nx + x position
+        batch_spatial_features = pillar_features.new_zeros(
+            (batch_size, self.num_bev_features,
+             self.nz * self.nx * self.ny))
+        indices = coords[:, 1] + coords[:, 2] * self.nx + coords[:, 3]
+        batch_spatial_features[coords[:, 0].long(), :,
+                               indices.long()] = pillar_features
 
-        for batch_idx in range(batch_size):
-            spatial_feature = torch.zeros(
-                self.num_bev_features,
-                self.nz * self.nx * self.ny,
-                dtype=pillar_features.dtype,
-                device=pillar_features.device)
-
-            batch_mask = coords[:, 0] == batch_idx
-            this_coords = coords[batch_mask, :]
-
-            indices = this_coords[:, 1] + \
-                      this_coords[:, 2] * self.nx + \
-                      this_coords[:, 3]
-            indices = indices.type(torch.long)
-
-            pillars = pillar_features[batch_mask, :]
-            pillars = pillars.t()
-            spatial_feature[:, indices] = pillars
-            batch_spatial_features.append(spatial_feature)
-
-        batch_spatial_features = \
-            torch.stack(batch_spatial_features, 0)
         batch_spatial_features = \
             batch_spatial_features.view(batch_size, self.num_bev_features *
                                         self.nz, self.ny, self.nx)
         batch_dict['spatial_features'] = batch_spatial_features
 
         return batch_dict
-
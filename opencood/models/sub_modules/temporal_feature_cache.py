@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Temporal cache of the ego BEV features for sequential inference.
+"""
+from collections import OrderedDict
+
+import torch
+
+from opencood.models.sub_modules.torch_transformation_utils import \
+    get_discretized_transformation_matrix, get_transformation_matrix, \
+    warp_affine
+
+
+class TemporalFeatureCache(object):
+    """
+    Bounded LRU cache of the scattered pillar features of the ego frames.
+
+    During sequential playback the two historical ego frames of a sample
+    were already processed as the current ego frame one and two steps
+    earlier, so their features are restored from the cache and warped from
+    the historical ego pose into the current ego pose instead of being
+    loaded, voxelized and encoded again.
+
+    Parameters
+    ----------
+    discrete_ratio : float
+        Voxel size along x and y of the scattered feature map.
+
+    max_size : int
+        Maximum number of cached frames, at least the current frame and the
+        two historical frames need to fit.
+    """
+
+    def __init__(self, discrete_ratio, max_size=4):
+        assert max_size >= 3, 'The cache must hold at least 3 frames'
+        self.discrete_ratio = discrete_ratio
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def get(self, key):
+        if key not in self._cache:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._cache.move_to_end(key)
+        return self._cache[key]
+
+    def put(self, key, feature):
+        self._cache[key] = feature.detach()
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def clear(self):
+        self._cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._cache),
+                'hit_rate': self.hits / total if total > 0 else 0.}
+
+    def restore_history(self, spatial_features, record_len, frame_keys,
+                        history_keys, history_t_matrix):
+        """
+        Cache the current ego features and insert the historical ego
+        features right after them, so the output has the same layout as when
+        the historical frames are encoded by the network.
+
+        Parameters
+        ----------
+        spatial_features : torch.Tensor
+            Scattered features of the loaded frames, (N_loaded, C, H, W). Each
+            sample contributes the ego frame followed by the other cavs.
+
+        record_len : torch.Tensor
+            Number of frames of each sample including the historical ones,
+            shape (B,).
+
+        frame_keys : list
+            The cache key of the current ego frame of each sample.
+
+        history_keys : list
+            The cache keys of the historical ego frames of each sample.
+
+        history_t_matrix : torch.Tensor
+            Transformation from each historical ego pose to the current ego
+            pose, shape (B, 2, 4, 4).
+
+        Returns
+        -------
+        spatial_features : torch.Tensor
+            Features of all frames, (N, C, H, W).
+        """
+        _, C, H, W = spatial_features.shape
+        num_history = history_t_matrix.shape[1]
+
+        output = []
+        start = 0
+        for b, cav_num in enumerate(record_len.tolist()):
+            loaded_num = cav_num - num_history
+            cur_features = spatial_features[start:start + loaded_num]
+            start += loaded_num
+
+            # the history of the first frames in a scenario is the current
+            # frame itself, so the current frame is cached first
+            self.put(frame_keys[b], cur_features[0])
+
+            history_features = []
+            for key in history_keys[b]:
+                feature = self.get(key)
+                # the first frames of a scenario are their own history, so
+                # a missing frame means the samples are not played in order
+                assert feature is not None, \
+                    'The historical frame %s is not cached, the temporal ' \
+                    'cache needs the samples of each scenario in order ' \
+                    'without shuffling' % key
+                history_features.append(feature)
+            history_features = torch.stack(history_features)
+
+            # (1, num_history, 2, 3)
+            t_matrix = get_discretized_transformation_matrix(
+                history_t_matrix[b:b + 1].float(), self.discrete_ratio, 1)
+            T = get_transformation_matrix(t_matrix.reshape(-1, 2, 3), (H, W))
+            history_features = warp_affine(history_features, T, (H, W))
+
+            output += [cur_features[:1], history_features, cur_features[1:]]
+
+        return torch.cat(output, dim=0)
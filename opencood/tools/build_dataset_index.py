@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+
+import argparse
+import os
+import time
+
+import opencood.hypes_yaml.yaml_utils as yaml_utils
+from opencood.data_utils.datasets.dataset_index import \
+    build_dataset_index, save_dataset_index, DATASET_INDEX_FILE
+
+
+def index_parser():
+    parser = argparse.ArgumentParser(description="dataset index building")
+    parser.add_argument("--hypes_yaml", type=str, default='',
+                        help='index the root_dir and validate_dir of this '
+                             'config')
+    parser.add_argument('--data_dir', type=str, nargs='+', default=[],
+                        help='additional split folders to index')
+    opt = parser.parse_args()
+    return opt
+
+
+def main():
+    opt = index_parser()
+
+    data_dirs = list(opt.data_dir)
+    if opt.hypes_yaml:
+        hypes = yaml_utils.load_yaml(opt.hypes_yaml, opt)
+        data_dirs += [hypes['root_dir'], hypes['validate_dir']]
+    assert len(data_dirs) > 0, 'Please provide --hypes_yaml or --data_dir'
+
+    for data_dir in data_dirs:
+        start_time = time.time()
+        index = build_dataset_index(data_dir)
+        save_path = os.path.join(data_dir, DATASET_INDEX_FILE)
+        save_dataset_index(index, save_path)
+        print('%s: %d scenarios, %d frames, %d objects indexed in %.1fs, '
+              'saved to %s' % (data_dir,
+                               len(index['scenario_names']),
+                               len(index['timestamps']),
+                               len(index['object_ids']),
+                               time.time() - start_time,
+                               save_path))
+
+
+if __name__ == '__main__':
+    main()
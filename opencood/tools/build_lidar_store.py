@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+
+import argparse
+import time
+
+import opencood.hypes_yaml.yaml_utils as yaml_utils
+from opencood.utils.lidar_store import build_lidar_store, \
+    get_lidar_store_dir
+
+
+def store_parser():
+    parser = argparse.ArgumentParser(description="lidar store building")
+    parser.add_argument("--hypes_yaml", type=str, default='',
+                        help='convert the root_dir and validate_dir of this '
+                             'config')
+    parser.add_argument('--data_dir', type=str, nargs='+', default=[],
+                        help='additional split folders to convert')
+    opt = parser.parse_args()
+    return opt
+
+
+def main():
+    opt = store_parser()
+
+    data_dirs = list(opt.data_dir)
+    if opt.hypes_yaml:
+        hypes = yaml_utils.load_yaml(opt.hypes_yaml, opt)
+        data_dirs += [hypes['root_dir'], hypes['validate_dir']]
+    assert len(data_dirs) > 0, 'Please provide --hypes_yaml or --data_dir'
+
+    for data_dir in data_dirs:
+        start_time = time.time()
+        num_files = build_lidar_store(data_dir)
+        print('%s: %d pcd files converted in %.1fs, saved to %s'
+              % (data_dir, num_files, time.time() - start_time,
+                 get_lidar_store_dir(data_dir)))
+
+
+if __name__ == '__main__':
+    main()
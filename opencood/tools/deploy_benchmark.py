@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Check the compiled PointPillarIoSICPDeploy against the eager
+PointPillarIoSICP on real samples and compare their per-frame latency on cpu.
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+import opencood.hypes_yaml.yaml_utils as yaml_utils
+from opencood.tools import train_utils
+from opencood.data_utils.datasets import build_dataset
+from opencood.models.point_pillar_IoSICP_deploy import \
+    PointPillarIoSICPDeploy
+
+
+def benchmark_parser():
+    parser = argparse.ArgumentParser(description="deployment benchmark")
+    parser.add_argument('--hypes_yaml', type=str, required=True,
+                        help='model and dataset configuration')
+    parser.add_argument('--model_dir', type=str, default='',
+                        help='checkpoint folder, random weights if empty')
+    parser.add_argument('--num_samples', type=int, default=20,
+                        help='number of compared samples')
+    parser.add_argument('--warmup', type=int, default=3,
+                        help='number of samples excluded from the timing')
+    parser.add_argument('--compiler', type=str, default='script',
+                        choices=['script', 'compile'],
+                        help='torch.jit.script or torch.compile')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='number of cpu threads, 0 for the default')
+    parser.add_argument('--atol', type=float, default=1e-5,
+                        help='absolute tolerance')
+    parser.add_argument('--save', action='store_true',
+                        help='save the scripted model to '
+                             'model_dir/deploy.pt')
+    opt = parser.parse_args()
+    return opt
+
+
+def timed(fn, *inputs):
+    """
+    Return the output of fn and its run time in milliseconds.
+    """
+    start_time = time.time()
+    output = fn(*inputs)
+    return output, (time.time() - start_time) * 1000
+
+
+def main():
+    opt = benchmark_parser()
+    if opt.threads > 0:
+        torch.set_num_threads(opt.threads)
+    hypes = yaml_utils.load_yaml(opt.hypes_yaml, opt)
+
+    # the benchmark runs on cpu
+    model = train_utils.create_model(hypes)
+    if opt.model_dir:
+        _, model = train_utils.load_saved_model(opt.model_dir, model)
+    model.eval()
+
+    deploy_model = PointPillarIoSICPDeploy(model).eval()
+    if opt.compiler == 'script':
+        compiled_model = torch.jit.script(deploy_model)
+        if opt.save:
+            assert opt.model_dir, 'The model is saved to model_dir'
+            save_path = os.path.join(opt.model_dir, 'deploy.pt')
+            compiled_model.save(save_path)
+            print('Scripted model saved to %s' % save_path)
+    else:
+        assert hasattr(torch, 'compile'), 'torch.compile requires torch >= 2.0'
+        compiled_model = torch.compile(deploy_model)
+
+    opencood_dataset = build_dataset(hypes, visualize=False, train=False)
+    data_loader = DataLoader(opencood_dataset,
+                             batch_size=1,
+                             num_workers=0,
+                             collate_fn=opencood_dataset.collate_batch_test,
+                             shuffle=False,
+                             pin_memory=False,
+                             drop_last=False)
+
+    passed = True
+    eager_times = []
+    compiled_times = []
+    for i, batch_data in enumerate(data_loader):
+        if i >= opt.num_samples:
+            break
+        with torch.no_grad():
+            output_dict, eager_time = timed(model, batch_data['ego'])
+            (psm, rm), compiled_time = timed(
+                compiled_model,
+                *PointPillarIoSICPDeploy.get_inputs(batch_data['ego']))
+
+        max_diff = {'psm': (psm - output_dict['psm']).abs().max().item(),
+                    'rm': (rm - output_dict['rm']).abs().max().item()}
+        ok = all(v <= opt.atol for v in max_diff.values())
+        passed = passed and ok
+        print('sample %d: eager %.1fms, %s %.1fms, %s %s' %
+              (i, eager_time, opt.compiler, compiled_time, max_diff,
+               'ok' if ok else 'MISMATCH'))
+        if i >= opt.warmup:
+            eager_times.append(eager_time)
+            compiled_times.append(compiled_time)
+
+    if len(eager_times) > 0:
+        print('Per-frame latency on cpu with %d threads, mean/median:' %
+              torch.get_num_threads())
+        print('eager: %.1f/%.1fms' % (np.mean(eager_times),
+                                      np.median(eager_times)))
+        print('%s: %.1f/%.1fms (%.2fx)' %
+              (opt.compiler, np.mean(compiled_times),
+               np.median(compiled_times),
+               np.mean(eager_times) / np.mean(compiled_times)))
+    print('Parity check %s' % ('passed' if passed else 'failed'))
+
+
+if __name__ == '__main__':
+    main()
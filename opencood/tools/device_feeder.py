@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Asynchronous host to device transfer of the collated batches
+"""
+import time
+
+import torch
+
+from opencood.tools import train_utils
+
+
+def pin_batch(inputs):
+    """
+    Pin the tensors of a collated batch that are not pinned yet, e.g. when
+    the DataLoader does not pin its batches.
+    """
+    if isinstance(inputs, list):
+        return [pin_batch(x) for x in inputs]
+    elif isinstance(inputs, dict):
+        return {k: pin_batch(v) for k, v in inputs.items()}
+    elif isinstance(inputs, torch.Tensor) and not inputs.is_pinned():
+        return inputs.pin_memory()
+    return inputs
+
+
+def record_stream(inputs, stream):
+    """
+    Mark the device tensors of a batch as used by the given stream, so that
+    the caching allocator does not reuse their memory while the stream
+    still reads them.
+    """
+    if isinstance(inputs, list):
+        for x in inputs:
+            record_stream(x, stream)
+    elif isinstance(inputs, dict):
+        for v in inputs.values():
+            record_stream(v, stream)
+    elif isinstance(inputs, torch.Tensor) and inputs.is_cuda:
+        inputs.record_stream(stream)
+
+
+class DeviceFeeder(object):
+    """
+    Iterate over a DataLoader and move each batch to the device. On cuda,
+    the copy of the next batch is issued with non_blocking=True on a side
+    stream before the current batch is returned, so it overlaps with the
+    computation of the current batch. The compute stream only waits for the
+    copy on the gpu, the host never blocks on it. On cpu, the batches are
+    moved synchronously like train_utils.to_device.
+
+    Parameters
+    ----------
+    loader : torch.utils.data.DataLoader
+        The loader, preferably with pin_memory=True.
+
+    device : torch.device
+        The target device.
+
+    Attributes
+    ----------
+    stats : dict
+        batches: number of batches fed.
+        ready: number of batches whose copy had already finished when they
+        were returned, i.e. fully overlapped with the previous computation.
+        copy_ms: total gpu time of the copies.
+        host_ms: total host time spent pinning and issuing the copies.
+    """
+
+    def __init__(self, loader, device):
+        self.loader = loader
+        self.device = device
+        self.use_stream = device.type == 'cuda' and \
+            torch.cuda.is_available()
+        self.stream = torch.cuda.Stream(device) if self.use_stream else None
+        self.reset_stats()
+
+    def __len__(self):
+        return len(self.loader)
+
+    def reset_stats(self):
+        self.stats = {'batches': 0, 'ready': 0, 'copy_ms': 0.0,
+                      'host_ms': 0.0}
+        self._copy_events = []
+
+    def _preload(self, iterator):
+        """
+        Fetch the next batch and issue its copy on the side stream.
+        """
+        try:
+            batch_data = next(iterator)
+        except StopIteration:
+            return None, None
+
+        start_time = time.time()
+        start_event = torch.cuda.Event(enable_timing=True)
+        end_event = torch.cuda.Event(enable_timing=True)
+        with torch.cuda.stream(self.stream):
+            start_event.record()
+            batch_data = train_utils.to_device(pin_batch(batch_data),
+                                               self.device,
+                                               non_blocking=True)
+            end_event.record()
+        self.stats['host_ms'] += (time.time() - start_time) * 1000
+        return batch_data, (start_event, end_event)
+
+    def __iter__(self):
+        iterator = iter(self.loader)
+
+        if not self.use_stream:
+            for batch_data in iterator:
+                start_time = time.time()
+                batch_data = train_utils.to_device(batch_data, self.device)
+                self.stats['host_ms'] += (time.time() - start_time) * 1000
+                self.stats['batches'] += 1
+                yield batch_data
+            return
+
+        next_batch, next_events = self._preload(iterator)
+        while next_batch is not None:
+            batch_data, (start_event, end_event) = next_batch, next_events
+
+            current_stream = torch.cuda.current_stream(self.device)
+            if end_event.query():
+                self.stats['ready'] += 1
+                self.stats['copy_ms'] += start_event.elapsed_time(end_event)
+            else:
+                self._copy_events.append((start_event, end_event))
+            current_stream.wait_event(end_event)
+            record_stream(batch_data, current_stream)
+
+            # the copy of the next batch runs during the computation of the
+            # current one
+            next_batch, next_events = self._preload(iterator)
+            self.stats['batches'] += 1
+            yield batch_data
+
+    def summary(self):
+        """
+        Return the statistics, with the gpu copy times of the copies that
+        were still running when their batch was returned.
+        """
+        pending = []
+        for start_event, end_event in self._copy_events:
+            if end_event.query():
+                self.stats['copy_ms'] += start_event.elapsed_time(end_event)
+            else:
+                pending.append((start_event, end_event))
+        self._copy_events = pending
+
+        stats = dict(self.stats)
+        stats['overlap'] = stats['ready'] / stats['batches'] \
+            if stats['batches'] > 0 else 0.0
+        return stats
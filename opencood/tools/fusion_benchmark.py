@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Check the ego-query and the sparse attention fusion against the full
+per-pixel self attention and benchmark them at the three HPHA scales.
+"""
+
+import argparse
+import time
+
+import torch
+
+from opencood.models.fuse_modules.HPHA_fuse import TransformerFusion
+from opencood.models.fuse_modules.where2comm_fuse import AttentionFusion
+from opencood.models.fuse_modules.self_attn import AttFusion
+
+# (C, H, W) of the three HPHA levels with the default point pillar config
+HPHA_SCALES = [(64, 96, 352), (128, 48, 176), (256, 24, 88)]
+
+
+def benchmark_parser():
+    parser = argparse.ArgumentParser(description="fusion benchmark")
+    parser.add_argument('--cav_num', type=int, default=5,
+                        help='number of fused feature maps')
+    parser.add_argument('--iters', type=int, default=20,
+                        help='number of timed iterations')
+    parser.add_argument('--com_rate', type=float, default=0.1,
+                        help='ratio of the pixels shared by each '
+                             'collaborator for the sparse fusion')
+    opt = parser.parse_args()
+    return opt
+
+
+def time_module(module, inputs, iters):
+    """
+    Return the average run time of the module in milliseconds.
+    """
+    with torch.no_grad():
+        # warm up
+        module(*inputs)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+        start_time = time.time()
+        for _ in range(iters):
+            module(*inputs)
+        if torch.cuda.is_available():
+            torch.cuda.synchronize()
+    return (time.time() - start_time) / iters * 1000
+
+
+def main():
+    opt = benchmark_parser()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    for C, H, W in HPHA_SCALES:
+        x = torch.randn(opt.cav_num, C, H, W, device=device)
+        record_len = torch.tensor([opt.cav_num], device=device)
+        cav_mask = torch.ones(1, opt.cav_num, dtype=torch.int, device=device)
+
+        for fusion_class in [TransformerFusion, AttentionFusion, AttFusion]:
+            full = fusion_class(C).to(device).eval()
+            ego = fusion_class(C, ego_query=True).to(device).eval()
+            inputs = (x.unsqueeze(0), cav_mask) \
+                if fusion_class is not AttFusion else (x, record_len)
+
+            with torch.no_grad():
+                max_diff = (full(*inputs) - ego(*inputs)).abs().max().item()
+            full_time = time_module(full, inputs, opt.iters)
+            ego_time = time_module(ego, inputs, opt.iters)
+
+            print('%s %dx%dx%d: full %.2fms, ego query %.2fms, '
+                  'max diff %.2e' % (fusion_class.__name__, C, H, W,
+                                     full_time, ego_time, max_diff))
+
+        # sparse fusion on features masked by the communication module
+        communication_mask = \
+            (torch.rand(1, opt.cav_num, 1, H, W, device=device) <
+             opt.com_rate).float()
+        communication_mask[:, 0] = 1
+        masked_x = x.unsqueeze(0) * communication_mask
+        fusion = TransformerFusion(C).to(device).eval()
+        with torch.no_grad():
+            max_diff = (fusion(masked_x, cav_mask) -
+                        fusion(masked_x, cav_mask, communication_mask)). \
+                abs().max()
+        dense_time = time_module(fusion, (masked_x, cav_mask), opt.iters)
+        sparse_time = time_module(fusion,
+                                  (masked_x, cav_mask, communication_mask),
+                                  opt.iters)
+        print('sparse %dx%dx%d at rate %.2f: dense %.2fms, sparse %.2fms, '
+              'max diff %.2e' % (C, H, W, opt.com_rate, dense_time,
+                                 sparse_time, max_diff.item()))
+
+if __name__ == '__main__':
+    main()
@@ -39,6 +39,27 @@ def test_parser():
     parser.add_argument('--save_npy', action='store_true',
                         help='whether to save prediction and gt result'
                              'in npy_test file')
+    parser.add_argument('--prefetch', type=int, default=0,
+                        help='number of next samples of each scenario whose '
+                             'frames are read ahead, 0 to disable')
+    parser.add_argument('--prefetch_threads', type=int, default=4,
+                        help='number of reading threads of each dataloader '
+                             'worker')
+    parser.add_argument('--prefetch_report', type=int, default=0,
+                        help='each dataloader worker prints the prefetch hit '
+                             'rate every prefetch_report frames, 0 to '
+                             'disable')
+    parser.add_argument('--temporal_cache', action='store_true',
+                        help='reuse the ego features of the previous frames '
+                             'as the historical ego features instead of '
+                             'loading and encoding them again')
+    parser.add_argument('--precision', type=str, default='fp32',
+                        choices=['fp32', 'fp16', 'bf16'],
+                        help='autocast precision of the model forward, fp16 '
+                             'runs as bf16 on cpu')
+    parser.add_argument('--channels_last', action='store_true',
+                        help='run the backbone, the downsample convolutions '
+                             'and the heads in channels last memory format')
     opt = parser.parse_args()
     return opt
 
@@ -65,9 +86,28 @@ def main():
     print('opt.model_dir:',opt.model_dir)
     _, model = train_utils.load_saved_model(saved_path, model)
     model.eval()
+    if opt.channels_last:
+        train_utils.to_channels_last(model)
 
     opencood_dataset = build_dataset(hypes, visualize=True, train=False, uni_time_delay=-1)
     print(f"{len(opencood_dataset)} samples found.")
+    if opt.temporal_cache:
+        # only valid for sequential playback, the data loader below keeps
+        # the order of the samples
+        assert opt.fusion_method == 'intermediate' and \
+            hasattr(model, 'enable_temporal_cache'), \
+            'The temporal cache is only supported by PointPillarIoSICP'
+        # the cached features are warped into the current ego pose, the
+        # same as the projected historical point clouds
+        assert opencood_dataset.proj_first, \
+            'The temporal cache requires proj_first'
+        model.enable_temporal_cache()
+        opencood_dataset.history_from_cache = True
+    if opt.prefetch > 0:
+        # the samples are loaded in order, each worker can report its hit
+        # rate and queue depth periodically
+        opencood_dataset.enable_prefetch(opt.prefetch, opt.prefetch_threads,
+                                         opt.prefetch_report)
     data_loader = DataLoader(opencood_dataset,
                              batch_size=1,
                              num_workers=4,
@@ -78,9 +118,7 @@ def main():
 
 
     # Create the dictionary for evaluation
-    result_stat = {0.3: {'tp': [], 'fp': [], 'gt': 0},
-                   0.5: {'tp': [], 'fp': [], 'gt': 0},
-                   0.7: {'tp': [], 'fp': [], 'gt': 0}}
+    result_stat = eval_utils.create_result_stat()
 
     if opt.show_sequence:
         vis = o3d.visualization.Visualizer()
@@ -99,43 +137,42 @@ def main():
             vis_aabbs_gt.append(o3d.geometry.LineSet())
             vis_aabbs_pred.append(o3d.geometry.LineSet())
 
+    # time of the model and the post-processing, the data loading and the
+    # evaluation are excluded
+    infer_time = 0.0
     for i, batch_data in tqdm(enumerate(data_loader)):
         with torch.no_grad():
             batch_data = train_utils.to_device(batch_data, device)
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            start_time = time.time()
             if opt.fusion_method == 'late':
                 pred_box_tensor, pred_score, gt_box_tensor = \
                     inference_utils.inference_late_fusion(batch_data,
                                                           model,
-                                                          opencood_dataset)
+                                                          opencood_dataset,
+                                                          opt.precision)
             elif opt.fusion_method == 'early':
                 pred_box_tensor, pred_score, gt_box_tensor = \
                     inference_utils.inference_early_fusion(batch_data,
                                                            model,
-                                                           opencood_dataset)
+                                                           opencood_dataset,
+                                                           opt.precision)
             elif opt.fusion_method == 'intermediate':
                 pred_box_tensor, pred_score, gt_box_tensor = \
-                    inference_utils.inference_intermediate_fusion(batch_data,
-                                                                  model,
-                                                                  opencood_dataset)
+                    inference_utils.inference_intermediate_fusion(
+                        batch_data, model, opencood_dataset, opt.precision)
             else:
                 raise NotImplementedError('Only early, late and intermediate'
                                           'fusion is supported.')
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            infer_time += time.time() - start_time
 
             eval_utils.caluclate_tp_fp(pred_box_tensor,
                                        pred_score,
                                        gt_box_tensor,
-                                       result_stat,
-                                       0.3)
-            eval_utils.caluclate_tp_fp(pred_box_tensor,
-                                       pred_score,
-                                       gt_box_tensor,
-                                       result_stat,
-                                       0.5)
-            eval_utils.caluclate_tp_fp(pred_box_tensor,
-                                       pred_score,
-                                       gt_box_tensor,
-                                       result_stat,
-                                       0.7)
+                                       result_stat)
             if opt.save_npy:
                 npy_save_path = os.path.join(opt.model_dir, 'npy')
                 print('npy_save_path:',npy_save_path)
@@ -196,6 +233,11 @@ def main():
                 vis.update_renderer()
                 time.sleep(0.001)
 
+    if opt.temporal_cache:
+        print('Temporal feature cache:', model.temporal_cache.stats())
+    print('Inference throughput (%s%s): %.2f frames/sec' %
+          (opt.precision, ', channels last' if opt.channels_last else '',
+           len(data_loader) / max(infer_time, 1e-6)))
     ap_30, ap_50, ap_70 = eval_utils.eval_final_results(result_stat,opt.model_dir)
     print('Prediction precision AP@0.3,0.5,0.7:',round(ap_30,4),round(ap_50,4),round(ap_70,4))
 
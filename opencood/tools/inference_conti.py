@@ -15,6 +15,8 @@ from torch.utils.data import DataLoader
 import opencood.hypes_yaml.yaml_utils as yaml_utils
 from opencood.tools import train_utils, inference_utils
 from opencood.data_utils.datasets import build_dataset
+from opencood.data_utils.datasets.delay_sweep_dataset import \
+    DelaySweepDataset
 from opencood.utils import eval_utils
 from opencood.visualization import vis_utils
 import matplotlib.pyplot as plt
@@ -39,10 +41,95 @@ def test_parser():
     parser.add_argument('--save_npy', action='store_true',
                         help='whether to save prediction and gt result'
                              'in npy_test file')
+    parser.add_argument('--delays', type=int, nargs='+',
+                        default=[-1, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10],
+                        help='evaluated uniform time delays, -1 for the '
+                             'simulated delay')
+    parser.add_argument('--sweep', action='store_true',
+                        help='evaluate all the delays in a single pass over '
+                             'the dataset')
+    parser.add_argument('--temporal_cache', action='store_true',
+                        help='with --sweep, restore the historical ego '
+                             'features from the features cached when those '
+                             'frames were the current ego frame, instead of '
+                             'loading and encoding them for every delay')
+    parser.add_argument('--precision', type=str, default='fp32',
+                        choices=['fp32', 'fp16', 'bf16'],
+                        help='autocast precision of the model forward, fp16 '
+                             'runs as bf16 on cpu')
+    parser.add_argument('--channels_last', action='store_true',
+                        help='run the backbone, the downsample convolutions '
+                             'and the heads in channels last memory format')
     opt = parser.parse_args()
     return opt
 
 
+def sweep_inference(opt, hypes, model, device, uni_time_delay_list):
+    """
+    Evaluate the model under all the delays in a single pass. Each frame is
+    loaded once for all the delays and has a separate result_stat per delay.
+    The ego and historical ego frames are voxelized once per frame, see
+    get_delay_sweep. The model still runs once per delay. With
+    temporal_cache, the historical ego frames are not encoded again, their
+    features are restored from the cache.
+
+    Returns
+    -------
+    ap_list : list
+        The (ap_30, ap_50, ap_70) of each delay.
+    """
+    opencood_dataset = build_dataset(hypes, visualize=True, train=False)
+    if opt.temporal_cache:
+        # the samples are evaluated in order, so the historical ego frames
+        # were cached as the current ego frame of earlier samples
+        assert hasattr(model, 'enable_temporal_cache'), \
+            'The temporal cache is only supported by PointPillarIoSICP'
+        # the cached features are warped into the current ego pose, the
+        # same as the projected historical point clouds
+        assert opencood_dataset.proj_first, \
+            'The temporal cache requires proj_first'
+        model.enable_temporal_cache()
+        opencood_dataset.history_from_cache = True
+    sweep_dataset = DelaySweepDataset(opencood_dataset, uni_time_delay_list)
+    print(f"{len(sweep_dataset)} samples found.")
+    data_loader = DataLoader(sweep_dataset,
+                             batch_size=1,
+                             num_workers=4,
+                             collate_fn=sweep_dataset.collate_batch_test,
+                             shuffle=False,
+                             pin_memory=False,
+                             drop_last=False)
+
+    result_stat_list = [eval_utils.create_result_stat()
+                        for _ in uni_time_delay_list]
+
+    for i, batch_list in tqdm(enumerate(data_loader)):
+        with torch.no_grad():
+            for batch_data, result_stat in zip(batch_list,
+                                               result_stat_list):
+                batch_data = train_utils.to_device(batch_data, device)
+                pred_box_tensor, pred_score, gt_box_tensor = \
+                    inference_utils.inference_intermediate_fusion(
+                        batch_data,
+                        model,
+                        opencood_dataset,
+                        opt.precision)
+                eval_utils.caluclate_tp_fp(pred_box_tensor,
+                                           pred_score,
+                                           gt_box_tensor,
+                                           result_stat)
+
+    if opt.temporal_cache:
+        print('Temporal feature cache:', model.temporal_cache.stats())
+    ap_list = []
+    for uni_time_delay, result_stat in zip(uni_time_delay_list,
+                                           result_stat_list):
+        print('uni_time_delay:', uni_time_delay)
+        ap_list.append(eval_utils.eval_final_results(result_stat,
+                                                     opt.model_dir))
+    return ap_list
+
+
 def main():
     opt = test_parser()
     assert opt.fusion_method in ['late', 'early', 'intermediate']
@@ -65,6 +152,8 @@ def main():
     print('opt.model_dir:',opt.model_dir)
     _, model = train_utils.load_saved_model(saved_path, model)
     model.eval()
+    if opt.channels_last:
+        train_utils.to_channels_last(model)
     model_type = opt.hypes_yaml.split('_')[-1].split('.')[0]
     IoU3_OPV2V_modelname_AP = 'IoU3_V2XSet' + '_' + model_type + '_AP'
     IoU5_OPV2V_modelname_AP = 'IoU5_V2XSet' + '_' + model_type + '_AP'
@@ -73,10 +162,23 @@ def main():
     AP_eval_result[IoU3_OPV2V_modelname_AP] = []
     AP_eval_result[IoU5_OPV2V_modelname_AP] = []
     AP_eval_result[IoU7_OPV2V_modelname_AP] = []
-    # uni_time_delay_list = [0,1,2,3,4,5,6,7,8,9,10]
-    uni_time_delay_list = [-1,0,1,2,3,4,5,6,7,8,9,10]
-    # uni_time_delay_list = [-1]
-    # uni_time_delay = 0
+    uni_time_delay_list = opt.delays
+    assert opt.sweep or not opt.temporal_cache, \
+        'The temporal cache is only supported by the delay sweep'
+    if opt.sweep:
+        assert opt.fusion_method == 'intermediate', \
+            'The delay sweep only supports intermediate fusion'
+        assert not (opt.show_vis or opt.show_sequence or opt.save_vis or
+                    opt.save_npy), 'Visualization is not supported by the ' \
+                                   'delay sweep'
+        for ap_30, ap_50, ap_70 in sweep_inference(opt, hypes, model, device,
+                                                   uni_time_delay_list):
+            AP_eval_result[IoU3_OPV2V_modelname_AP].append(round(ap_30,4))
+            AP_eval_result[IoU5_OPV2V_modelname_AP].append(round(ap_50,4))
+            AP_eval_result[IoU7_OPV2V_modelname_AP].append(round(ap_70,4))
+        print('AP_eval_result:',AP_eval_result)
+        return
+
     for uni_time_delay in uni_time_delay_list:
         print('uni_time_delay:',uni_time_delay)
         opencood_dataset = build_dataset(hypes, visualize=True, train=False, uni_time_delay=uni_time_delay)
@@ -91,9 +193,7 @@ def main():
 
 
         # Create the dictionary for evaluation
-        result_stat = {0.3: {'tp': [], 'fp': [], 'gt': 0},
-                       0.5: {'tp': [], 'fp': [], 'gt': 0},
-                       0.7: {'tp': [], 'fp': [], 'gt': 0}}
+        result_stat = eval_utils.create_result_stat()
 
         if opt.show_sequence:
             vis = o3d.visualization.Visualizer()
@@ -121,17 +221,19 @@ def main():
                     pred_box_tensor, pred_score, gt_box_tensor = \
                         inference_utils.inference_late_fusion(batch_data,
                                                               model,
-                                                              opencood_dataset)
+                                                              opencood_dataset,
+                                                              opt.precision)
                 elif opt.fusion_method == 'early':
                     pred_box_tensor, pred_score, gt_box_tensor = \
                         inference_utils.inference_early_fusion(batch_data,
                                                                model,
-                                                               opencood_dataset)
+                                                               opencood_dataset,
+                                                               opt.precision)
                 elif opt.fusion_method == 'intermediate':
                     pred_box_tensor, pred_score, gt_box_tensor = \
-                        inference_utils.inference_intermediate_fusion(batch_data,
-                                                                      model,
-                                                                      opencood_dataset)
+                        inference_utils.inference_intermediate_fusion(
+                            batch_data, model, opencood_dataset,
+                            opt.precision)
                 else:
                     raise NotImplementedError('Only early, late and intermediate'
                                               'fusion is supported.')
@@ -139,18 +241,7 @@ def main():
                 eval_utils.caluclate_tp_fp(pred_box_tensor,
                                            pred_score,
                                            gt_box_tensor,
-                                           result_stat,
-                                           0.3)
-                eval_utils.caluclate_tp_fp(pred_box_tensor,
-                                           pred_score,
-                                           gt_box_tensor,
-                                           result_stat,
-                                           0.5)
-                eval_utils.caluclate_tp_fp(pred_box_tensor,
-                                           pred_score,
-                                           gt_box_tensor,
-                                           result_stat,
-                                           0.7)
+                                           result_stat)
                 if opt.save_npy:
                     npy_save_path = os.path.join(opt.model_dir, 'npy')
                     print('npy_save_path:',npy_save_path)
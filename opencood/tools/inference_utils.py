@@ -6,6 +6,7 @@
 import os
 import time
 from collections import OrderedDict
+from contextlib import nullcontext
 
 import numpy as np
 import torch
@@ -13,7 +14,63 @@ import torch
 from opencood.utils.common_utils import torch_tensor_to_numpy
 
 
-def inference_late_fusion(batch_data, model, dataset):
+# the autocast dtype of each inference precision
+PRECISIONS = {'fp32': None,
+              'fp16': torch.float16,
+              'bf16': torch.bfloat16}
+
+
+def autocast_context(device, precision='fp32'):
+    """
+    Return the autocast context of the inference precision. On cpu, only
+    bf16 autocast is available, fp16 falls back to it. Precisions that the
+    installed torch does not support fall back to the closest one.
+
+    Parameters
+    ----------
+    device : torch.device
+        The device the model runs on.
+
+    precision : str
+        'fp32', 'fp16' or 'bf16'.
+
+    Returns
+    -------
+    context : contextmanager
+    """
+    dtype = PRECISIONS[precision]
+    if dtype is None:
+        return nullcontext()
+
+    if device.type == 'cpu':
+        if not hasattr(torch, 'autocast'):
+            print('Cpu autocast requires torch >= 1.10, running in fp32')
+            return nullcontext()
+        return torch.autocast('cpu', dtype=torch.bfloat16)
+
+    if hasattr(torch, 'autocast'):
+        return torch.autocast('cuda', dtype=dtype)
+    # torch < 1.10 only supports fp16 autocast on cuda
+    return torch.cuda.amp.autocast()
+
+
+def model_forward(model, inputs, precision='fp32'):
+    """
+    Run the model under the inference precision. The floating point outputs
+    are cast back to fp32 for the post-processing.
+    """
+    device = next(model.parameters()).device
+    with autocast_context(device, precision):
+        output_dict = model(inputs)
+
+    if precision != 'fp32':
+        output_dict = {k: v.float() if isinstance(v, torch.Tensor) and
+                       v.is_floating_point() else v
+                       for k, v in output_dict.items()}
+    return output_dict
+
+
+def inference_late_fusion(batch_data, model, dataset, precision='fp32'):
     """
     Model inference for late fusion.
 
@@ -22,6 +79,8 @@ def inference_late_fusion(batch_data, model, dataset):
     batch_data : dict
     model : opencood.object
     dataset : opencood.LateFusionDataset
+    precision : str
+        'fp32', 'fp16' or 'bf16', see autocast_context.
 
     Returns
     -------
@@ -33,7 +92,7 @@ def inference_late_fusion(batch_data, model, dataset):
     output_dict = OrderedDict()
 
     for cav_id, cav_content in batch_data.items():
-        output_dict[cav_id] = model(cav_content)
+        output_dict[cav_id] = model_forward(model, cav_content, precision)
 
     pred_box_tensor, pred_score, gt_box_tensor = \
         dataset.post_process(batch_data,
@@ -42,7 +101,7 @@ def inference_late_fusion(batch_data, model, dataset):
     return pred_box_tensor, pred_score, gt_box_tensor
 
 
-def inference_early_fusion(batch_data, model, dataset):
+def inference_early_fusion(batch_data, model, dataset, precision='fp32'):
     """
     Model inference for early fusion.
 
@@ -51,6 +110,8 @@ def inference_early_fusion(batch_data, model, dataset):
     batch_data : dict
     model : opencood.object
     dataset : opencood.EarlyFusionDataset
+    precision : str
+        'fp32', 'fp16' or 'bf16', see autocast_context.
 
     Returns
     -------
@@ -61,14 +122,15 @@ def inference_early_fusion(batch_data, model, dataset):
     """
     output_dict = OrderedDict()
     cav_content = batch_data['ego']
-    output_dict['ego'] = model(cav_content)
+    output_dict['ego'] = model_forward(model, cav_content, precision)
     pred_box_tensor, pred_score, gt_box_tensor = \
         dataset.post_process(batch_data,
                              output_dict)
     return pred_box_tensor, pred_score, gt_box_tensor
 
 
-def inference_intermediate_fusion(batch_data, model, dataset):
+def inference_intermediate_fusion(batch_data, model, dataset,
+                                  precision='fp32'):
     """
     Model inference for early fusion.
 
@@ -77,6 +139,8 @@ def inference_intermediate_fusion(batch_data, model, dataset):
     batch_data : dict
     model : opencood.object
     dataset : opencood.EarlyFusionDataset
+    precision : str
+        'fp32', 'fp16' or 'bf16', see autocast_context.
 
     Returns
     -------
@@ -85,7 +149,7 @@ def inference_intermediate_fusion(batch_data, model, dataset):
     gt_box_tensor : torch.Tensor
         The tensor of gt bounding box.
     """
-    return inference_early_fusion(batch_data, model, dataset)
+    return inference_early_fusion(batch_data, model, dataset, precision)
 
 
 def save_prediction_gt(pred_tensor, gt_tensor, pcd, timestamp, save_path):
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Check the vectorized rotated box IoU and NMS against the shapely
+implementation and benchmark both on random clustered boxes.
+"""
+
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from opencood.utils import box_utils, common_utils
+
+
+def benchmark_parser():
+    parser = argparse.ArgumentParser(description="nms benchmark")
+    parser.add_argument('--num_boxes', type=int, default=500,
+                        help='number of candidate boxes')
+    parser.add_argument('--nms_thresh', type=float, default=0.15,
+                        help='nms iou threshold')
+    parser.add_argument('--iters', type=int, default=10,
+                        help='number of timed iterations')
+    opt = parser.parse_args()
+    return opt
+
+
+def random_boxes(num_boxes, num_objects=30):
+    """
+    Random boxes clustered around a few objects like the detection
+    candidates, returned as (N, 8, 3) corners.
+    """
+    centers = np.random.uniform(-100, 100, (num_objects, 2))
+    object_index = np.random.randint(0, num_objects, num_boxes)
+    boxes = np.zeros((num_boxes, 7), dtype=np.float32)
+    boxes[:, :2] = centers[object_index] + \
+        np.random.normal(0, 0.5, (num_boxes, 2))
+    boxes[:, 2] = -1
+    # hwl
+    boxes[:, 3] = 1.5
+    boxes[:, 4] = np.random.uniform(1.6, 2.0, num_boxes)
+    boxes[:, 5] = np.random.uniform(3.9, 4.5, num_boxes)
+    boxes[:, 6] = np.random.uniform(-np.pi, np.pi, num_boxes)
+    return box_utils.boxes_to_corners_3d(boxes, 'hwl')
+
+
+def time_function(function, inputs, iters):
+    """
+    Return the average run time of the function in milliseconds.
+    """
+    function(*inputs)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start_time = time.time()
+    for _ in range(iters):
+        function(*inputs)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.time() - start_time) / iters * 1000
+
+
+def main():
+    opt = benchmark_parser()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+
+    corners = random_boxes(opt.num_boxes)
+    scores = np.random.uniform(0.2, 1, opt.num_boxes).astype(np.float32)
+
+    # iou parity on a subset, shapely is slow
+    polygons = common_utils.convert_format(corners[:100])
+    reference_iou = np.stack([common_utils.compute_iou(polygon, polygons)
+                              for polygon in polygons])
+    iou = box_utils.boxes_iou_rotated(corners[:100], corners[:100])
+    print('iou max diff %.2e' % np.abs(iou - reference_iou).max())
+
+    boxes = torch.from_numpy(corners).to(device)
+    scores = torch.from_numpy(scores).to(device)
+    reference_keep = box_utils.nms_rotated_shapely(boxes, scores,
+                                                   opt.nms_thresh)
+    keep = box_utils.nms_rotated(boxes, scores, opt.nms_thresh)
+    same = set(reference_keep.tolist()) == set(keep.cpu().tolist())
+    print('nms kept %d boxes, shapely kept %d boxes, %s'
+          % (len(keep), len(reference_keep),
+             'identical' if same else 'MISMATCH'))
+
+    shapely_time = time_function(box_utils.nms_rotated_shapely,
+                                 (boxes, scores, opt.nms_thresh), opt.iters)
+    vectorized_time = time_function(box_utils.nms_rotated,
+                                    (boxes, scores, opt.nms_thresh),
+                                    opt.iters)
+    print('nms of %d boxes: shapely %.2fms, vectorized %.2fms'
+          % (opt.num_boxes, shapely_time, vectorized_time))
+
+
+if __name__ == '__main__':
+    main()
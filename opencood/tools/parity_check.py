@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Compare the optimized forward of the models against reference
+implementations on real samples.
+"""
+
+import argparse
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+import opencood.hypes_yaml.yaml_utils as yaml_utils
+from opencood.tools import train_utils
+from opencood.data_utils.datasets import build_dataset
+
+
+def parity_parser():
+    parser = argparse.ArgumentParser(description="parity check")
+    parser.add_argument('--hypes_yaml', type=str, required=True,
+                        help='model and dataset configuration')
+    parser.add_argument('--model_dir', type=str, default='',
+                        help='checkpoint folder, random weights if empty')
+    parser.add_argument('--num_samples', type=int, default=10,
+                        help='number of compared samples')
+    parser.add_argument('--atol', type=float, default=1e-5,
+                        help='absolute tolerance')
+    parser.add_argument('--labels', action='store_true',
+                        help='check the label generation instead of the '
+                             'model forward')
+    parser.add_argument('--scatter', action='store_true',
+                        help='check the pillar scatter instead of the model '
+                             'forward, the outputs need to be identical')
+    opt = parser.parse_args()
+    return opt
+
+
+def reference_iosicp_forward(model, data_dict):
+    """
+    The original PointPillarIoSICP multi-scale forward, which runs the full
+    backbone over all cavs for the single-agent head before the fusion
+    runs the backbone blocks again.
+    """
+    batch_dict = {'voxel_features':
+                      data_dict['processed_lidar']['voxel_features'],
+                  'voxel_coords': data_dict['processed_lidar']['voxel_coords'],
+                  'voxel_num_points':
+                      data_dict['processed_lidar']['voxel_num_points'],
+                  'record_len': data_dict['record_len']}
+    batch_dict = model.pillar_vfe(batch_dict)
+    batch_dict = model.scatter(batch_dict)
+    batch_dict = model.backbone(batch_dict)
+
+    spatial_features_2d = torch.cat(
+        [batch_dict['spatial_features_2d'][:1],
+         batch_dict['spatial_features_2d'][3:]], dim=0)
+    if model.shrink_flag:
+        spatial_features_2d = model.shrink_conv(spatial_features_2d)
+    psm_single = model.cls_head(spatial_features_2d)
+
+    spatial_features = torch.cat([batch_dict['spatial_features'][:1],
+                                  batch_dict['spatial_features'][3:]], dim=0)
+    fused_feature, communication_rates = \
+        model.fusion_net(spatial_features,
+                         batch_dict['spatial_features'][1:3],
+                         psm_single,
+                         data_dict['record_len'],
+                         data_dict['pairwise_t_matrix'],
+                         data_dict['time_delay'],
+                         model.backbone)
+    if model.shrink_flag:
+        fused_feature = model.shrink_conv(fused_feature)
+
+    return {'psm': model.cls_head(fused_feature),
+            'rm': model.reg_head(fused_feature),
+            'com': communication_rates}
+
+
+def reference_scatter(scatter, pillar_features, coords):
+    """
+    The original PointPillarScatter, which scatters the pillars of each frame
+    into its own canvas in a loop.
+    """
+    batch_spatial_features = []
+    batch_size = coords[:, 0].max().int().item() + 1
+
+    for batch_idx in range(batch_size):
+        spatial_feature = torch.zeros(
+            scatter.num_bev_features,
+            scatter.nz * scatter.nx * scatter.ny,
+            dtype=pillar_features.dtype,
+            device=pillar_features.device)
+
+        batch_mask = coords[:, 0] == batch_idx
+        this_coords = coords[batch_mask, :]
+
+        indices = this_coords[:, 1] + \
+            this_coords[:, 2] * scatter.nx + \
+            this_coords[:, 3]
+        indices = indices.type(torch.long)
+
+        spatial_feature[:, indices] = pillar_features[batch_mask, :].t()
+        batch_spatial_features.append(spatial_feature)
+
+    return torch.stack(batch_spatial_features, 0).view(
+        batch_size, scatter.num_bev_features * scatter.nz, scatter.ny,
+        scatter.nx)
+
+
+def check_scatter(model, data_loader, num_samples, device):
+    """
+    Compare the vectorized PointPillarScatter against the original loop, the
+    outputs need to be bit-exact.
+    """
+    passed = True
+    for i, batch_data in enumerate(data_loader):
+        if i >= num_samples:
+            break
+        with torch.no_grad():
+            batch_data = train_utils.to_device(batch_data, device)
+            batch_dict = dict(batch_data['ego']['processed_lidar'])
+            batch_dict = model.pillar_vfe(batch_dict)
+            spatial_features = model.scatter(batch_dict)['spatial_features']
+            reference_features = reference_scatter(
+                model.scatter, batch_dict['pillar_features'],
+                batch_dict['voxel_coords'])
+        ok = spatial_features.shape == reference_features.shape and \
+            torch.equal(spatial_features, reference_features)
+        passed = passed and ok
+        print('sample %d: %s %s' % (i, tuple(spatial_features.shape),
+                                    'ok' if ok else 'MISMATCH'))
+    return passed
+
+
+def reference_generate_label(post_processor, gt_box_center, mask):
+    """
+    The original dense VoxelPostprocessor label generation, which computes
+    the standup iou between all the anchors and the GT with bbox_overlaps.
+    """
+    from opencood.utils import box_utils
+    from opencood.utils.box_overlaps import bbox_overlaps
+
+    anchors = post_processor.generate_anchor_box()
+    anchor_num = post_processor.anchor_num
+    feature_map_shape = anchors.shape[:2]
+    anchors = anchors.reshape(-1, 7)
+    anchors_d = np.sqrt(anchors[:, 4] ** 2 + anchors[:, 5] ** 2)
+
+    pos_equal_one = np.zeros((*feature_map_shape, anchor_num))
+    neg_equal_one = np.zeros((*feature_map_shape, anchor_num))
+    targets = np.zeros((*feature_map_shape, anchor_num * 7))
+
+    gt_box_corner_valid = box_utils.boxes_to_corners_3d(
+        gt_box_center[mask == 1], post_processor.params['order'])
+    anchors_corner = box_utils.boxes_to_corners_3d(
+        anchors, order=post_processor.params['order'])
+    anchors_standup_2d = box_utils.corner2d_to_standup_box(anchors_corner)
+    gt_standup_2d = box_utils.corner2d_to_standup_box(gt_box_corner_valid)
+    iou = bbox_overlaps(
+        np.ascontiguousarray(anchors_standup_2d).astype(np.float32),
+        np.ascontiguousarray(gt_standup_2d).astype(np.float32))
+
+    id_highest = np.argmax(iou.T, axis=1)
+    id_highest_gt = np.arange(iou.T.shape[0])
+    valid = iou.T[id_highest_gt, id_highest] > 0
+    id_highest, id_highest_gt = id_highest[valid], id_highest_gt[valid]
+
+    target_args = post_processor.params['target_args']
+    id_pos, id_pos_gt = np.where(iou > target_args['pos_threshold'])
+    id_neg = np.where(np.sum(iou < target_args['neg_threshold'],
+                             axis=1) == iou.shape[1])[0]
+    id_pos = np.concatenate([id_pos, id_highest])
+    id_pos_gt = np.concatenate([id_pos_gt, id_highest_gt])
+    id_pos, index = np.unique(id_pos, return_index=True)
+    id_pos_gt = id_pos_gt[index]
+
+    index_x, index_y, index_z = np.unravel_index(
+        id_pos, (*feature_map_shape, anchor_num))
+    pos_equal_one[index_x, index_y, index_z] = 1
+    delta = np.stack([
+        (gt_box_center[id_pos_gt, 0] - anchors[id_pos, 0]) /
+        anchors_d[id_pos],
+        (gt_box_center[id_pos_gt, 1] - anchors[id_pos, 1]) /
+        anchors_d[id_pos],
+        (gt_box_center[id_pos_gt, 2] - anchors[id_pos, 2]) /
+        anchors[id_pos, 3],
+        np.log(gt_box_center[id_pos_gt, 3] / anchors[id_pos, 3]),
+        np.log(gt_box_center[id_pos_gt, 4] / anchors[id_pos, 4]),
+        np.log(gt_box_center[id_pos_gt, 5] / anchors[id_pos, 5]),
+        gt_box_center[id_pos_gt, 6] - anchors[id_pos, 6]], axis=1)
+    for c in range(7):
+        targets[index_x, index_y, np.array(index_z) * 7 + c] = delta[:, c]
+
+    index_x, index_y, index_z = np.unravel_index(
+        id_neg, (*feature_map_shape, anchor_num))
+    neg_equal_one[index_x, index_y, index_z] = 1
+    index_x, index_y, index_z = np.unravel_index(
+        id_highest, (*feature_map_shape, anchor_num))
+    neg_equal_one[index_x, index_y, index_z] = 0
+
+    return {'pos_equal_one': pos_equal_one,
+            'neg_equal_one': neg_equal_one,
+            'targets': targets}
+
+
+def check_labels(opencood_dataset, num_samples, atol, device):
+    """
+    Compare generate_label and generate_label_torch against the original
+    dense label generation.
+    """
+    post_processor = opencood_dataset.post_processor
+    passed = True
+    for i in range(min(num_samples, len(opencood_dataset))):
+        ego_dict = opencood_dataset[i]['ego']
+        gt_box_center = ego_dict['object_bbx_center']
+        mask = ego_dict['object_bbx_mask']
+
+        reference_dict = reference_generate_label(post_processor,
+                                                  gt_box_center, mask)
+        label_dict = post_processor.generate_label(
+            gt_box_center=gt_box_center,
+            anchors=post_processor.generate_anchor_box(),
+            mask=mask)
+        torch_dict = post_processor.generate_label_torch(
+            torch.from_numpy(gt_box_center[np.newaxis]).to(device),
+            torch.from_numpy(mask[np.newaxis]).to(device))
+
+        max_diff = {}
+        for key in reference_dict:
+            max_diff[key] = np.abs(label_dict[key] -
+                                   reference_dict[key]).max()
+            max_diff[key + '_torch'] = np.abs(
+                torch_dict[key][0].cpu().numpy() - reference_dict[key]).max()
+        ok = all(v <= atol for v in max_diff.values())
+        passed = passed and ok
+        print('sample %d: %s %s' % (i, max_diff, 'ok' if ok else 'MISMATCH'))
+    return passed
+
+
+def compare_outputs(output_dict, reference_dict, atol):
+    """
+    Return the maximum absolute difference of each output and whether all of
+    them are within the tolerance.
+    """
+    max_diff = {}
+    for key in ['psm', 'rm']:
+        max_diff[key] = \
+            (output_dict[key] - reference_dict[key]).abs().max().item()
+    return max_diff, all(v <= atol for v in max_diff.values())
+
+
+def main():
+    opt = parity_parser()
+    hypes = yaml_utils.load_yaml(opt.hypes_yaml, opt)
+
+    model = train_utils.create_model(hypes)
+    if torch.cuda.is_available():
+        model.cuda()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    if opt.model_dir:
+        _, model = train_utils.load_saved_model(opt.model_dir, model)
+    model.eval()
+
+    opencood_dataset = build_dataset(hypes, visualize=False, train=False)
+    if opt.labels:
+        passed = check_labels(opencood_dataset, opt.num_samples, opt.atol,
+                              device)
+        print('Parity check %s' % ('passed' if passed else 'failed'))
+        return
+
+    data_loader = DataLoader(opencood_dataset,
+                             batch_size=1,
+                             num_workers=0,
+                             collate_fn=opencood_dataset.collate_batch_test,
+                             shuffle=False,
+                             pin_memory=False,
+                             drop_last=False)
+
+    if opt.scatter:
+        passed = check_scatter(model, data_loader, opt.num_samples, device)
+        print('Parity check %s' % ('passed' if passed else 'failed'))
+        return
+
+    passed = True
+    for i, batch_data in enumerate(data_loader):
+        if i >= opt.num_samples:
+            break
+        with torch.no_grad():
+            batch_data = train_utils.to_device(batch_data, device)
+            output_dict = model(batch_data['ego'])
+            reference_dict = reference_iosicp_forward(model,
+                                                      batch_data['ego'])
+        max_diff, ok = compare_outputs(output_dict, reference_dict, opt.atol)
+        passed = passed and ok
+        print('sample %d: %s %s' % (i, max_diff, 'ok' if ok else 'MISMATCH'))
+
+    print('Parity check %s' % ('passed' if passed else 'failed'))
+
+
+if __name__ == '__main__':
+    main()
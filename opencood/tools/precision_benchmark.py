@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Compare the AP and the throughput of the reduced precision and channels last
+inference against the fp32 inference on the same samples.
+"""
+
+import argparse
+import time
+from collections import OrderedDict
+
+import torch
+from torch.utils.data import DataLoader
+
+import opencood.hypes_yaml.yaml_utils as yaml_utils
+from opencood.tools import train_utils, inference_utils
+from opencood.data_utils.datasets import build_dataset
+from opencood.utils import eval_utils
+
+
+def benchmark_parser():
+    parser = argparse.ArgumentParser(description="precision benchmark")
+    parser.add_argument('--hypes_yaml', type=str, required=True,
+                        help='model and dataset configuration')
+    parser.add_argument('--model_dir', type=str, required=True,
+                        help='checkpoint folder')
+    parser.add_argument('--fusion_method', type=str, default='intermediate',
+                        help='late, early or intermediate')
+    parser.add_argument('--num_samples', type=int, default=200,
+                        help='number of evaluated samples')
+    parser.add_argument('--warmup', type=int, default=5,
+                        help='number of samples excluded from the timing')
+    parser.add_argument('--precision', type=str, default='fp16',
+                        choices=['fp32', 'fp16', 'bf16'],
+                        help='evaluated autocast precision')
+    parser.add_argument('--channels_last', action='store_true',
+                        help='evaluate in channels last memory format')
+    parser.add_argument('--tolerance', type=float, default=0.005,
+                        help='maximum absolute AP@0.5/0.7 drop from fp32')
+    opt = parser.parse_args()
+    return opt
+
+
+def run_inference(model, data_loader, dataset, device, opt, precision):
+    """
+    Evaluate the model on the first num_samples samples.
+
+    Returns
+    -------
+    ap_dict : dict
+        The AP of each iou threshold, 0.5 and 0.7.
+
+    fps : float
+        The model forward throughput in frames/sec. The data loading, the
+        post-processing and the evaluation are excluded, they run in fp32
+        in all the modes.
+    """
+    result_stat = eval_utils.create_result_stat()
+    infer_time = 0.0
+    num_timed = 0
+
+    for i, batch_data in enumerate(data_loader):
+        if i >= opt.num_samples:
+            break
+        with torch.no_grad():
+            batch_data = train_utils.to_device(batch_data, device)
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            start_time = time.time()
+            # the late fusion runs the model on each cav
+            output_dict = OrderedDict()
+            for cav_id, cav_content in batch_data.items():
+                if opt.fusion_method != 'late' and cav_id != 'ego':
+                    continue
+                output_dict[cav_id] = inference_utils.model_forward(
+                    model, cav_content, precision)
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            if i >= opt.warmup:
+                infer_time += time.time() - start_time
+                num_timed += 1
+
+            pred_box_tensor, pred_score, gt_box_tensor = \
+                dataset.post_process(batch_data, output_dict)
+
+            eval_utils.caluclate_tp_fp(pred_box_tensor,
+                                       pred_score,
+                                       gt_box_tensor,
+                                       result_stat)
+
+    ap_dict = {iou: eval_utils.calculate_ap(result_stat, iou)[0]
+               for iou in [0.5, 0.7]}
+    return ap_dict, num_timed / max(infer_time, 1e-6)
+
+
+def main():
+    opt = benchmark_parser()
+    assert opt.fusion_method in ['late', 'early', 'intermediate']
+    hypes = yaml_utils.load_yaml(opt.hypes_yaml, opt)
+
+    model = train_utils.create_model(hypes)
+    if torch.cuda.is_available():
+        model.cuda()
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    _, model = train_utils.load_saved_model(opt.model_dir, model)
+    model.eval()
+
+    opencood_dataset = build_dataset(hypes, visualize=False, train=False)
+    data_loader = DataLoader(opencood_dataset,
+                             batch_size=1,
+                             num_workers=4,
+                             collate_fn=opencood_dataset.collate_batch_test,
+                             shuffle=False,
+                             pin_memory=False,
+                             drop_last=False)
+
+    reference_ap, reference_fps = run_inference(model, data_loader,
+                                                opencood_dataset, device,
+                                                opt, 'fp32')
+    print('fp32: AP@0.5 %.4f AP@0.7 %.4f, %.2f frames/sec' %
+          (reference_ap[0.5], reference_ap[0.7], reference_fps))
+
+    # the fp32 run above uses the default memory format
+    if opt.channels_last:
+        train_utils.to_channels_last(model)
+    ap, fps = run_inference(model, data_loader, opencood_dataset, device,
+                            opt, opt.precision)
+    mode = opt.precision + (' channels last' if opt.channels_last else '')
+    print('%s: AP@0.5 %.4f AP@0.7 %.4f, %.2f frames/sec (%.2fx)' %
+          (mode, ap[0.5], ap[0.7], fps, fps / max(reference_fps, 1e-6)))
+
+    passed = True
+    for iou in [0.5, 0.7]:
+        ap_drop = reference_ap[iou] - ap[iou]
+        ok = ap_drop <= opt.tolerance
+        passed = passed and ok
+        print('AP@%.1f drop: %.4f %s' % (iou, ap_drop,
+                                         'ok' if ok else 'OUT OF TOLERANCE'))
+    print('Precision check %s' % ('passed' if passed else 'failed'))
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,7 @@ from torch.utils.data import DataLoader, DistributedSampler
 import opencood.hypes_yaml.yaml_utils as yaml_utils
 from opencood.tools import train_utils
 from opencood.tools import multi_gpu_utils
+from opencood.tools.device_feeder import DeviceFeeder
 from opencood.data_utils.datasets import build_dataset
 from opencood.tools import train_utils
 
@@ -44,6 +45,9 @@ def main():
     opencood_validate_dataset = build_dataset(hypes, visualize=False, train=False,uni_time_delay=-1)
     print(f"{len(opencood_train_dataset)} train samples found.")
     print(f"{len(opencood_validate_dataset)} val samples found.")
+    # the batches are pinned by the loader so that the device feeder can
+    # copy them asynchronously
+    pin_memory = torch.cuda.is_available()
     if opt.distributed:
         sampler_train = DistributedSampler(opencood_train_dataset)
         sampler_val = DistributedSampler(opencood_validate_dataset,
@@ -55,11 +59,13 @@ def main():
         train_loader = DataLoader(opencood_train_dataset,
                                   batch_sampler=batch_sampler_train,
                                   num_workers=8,
-                                  collate_fn=opencood_train_dataset.collate_batch_train)
+                                  collate_fn=opencood_train_dataset.collate_batch_train,
+                                  pin_memory=pin_memory)
         val_loader = DataLoader(opencood_validate_dataset,
                                 sampler=sampler_val,
                                 num_workers=8,
                                 collate_fn=opencood_train_dataset.collate_batch_train,
+                                pin_memory=pin_memory,
                                 drop_last=False)
     else:
         train_loader = DataLoader(opencood_train_dataset,
@@ -67,14 +73,14 @@ def main():
                                   num_workers=8,
                                   collate_fn=opencood_train_dataset.collate_batch_train,
                                   shuffle=True,
-                                  pin_memory=False,
+                                  pin_memory=pin_memory,
                                   drop_last=True)
         val_loader = DataLoader(opencood_validate_dataset,
                                 batch_size=hypes['train_params']['batch_size'],
                                 num_workers=8,
                                 collate_fn=opencood_train_dataset.collate_batch_train,
                                 shuffle=False,
-                                pin_memory=False,
+                                pin_memory=pin_memory,
                                 drop_last=True)
 
     print('---------------Creating Model------------------')
@@ -117,6 +123,10 @@ def main():
     # record training
     writer = SummaryWriter(saved_path)
 
+    # copy the next batch to the device while the current one is processed
+    train_feeder = DeviceFeeder(train_loader, device)
+    val_feeder = DeviceFeeder(val_loader, device)
+
     # half precision training
     if opt.half:
         scaler = torch.cuda.amp.GradScaler()
@@ -135,16 +145,24 @@ def main():
 
         if opt.distributed:
             sampler_train.set_epoch(epoch)
+        # draw the time delays of this epoch
+        opencood_train_dataset.set_epoch(epoch)
 
         pbar2 = tqdm.tqdm(total=len(train_loader), leave=True)
 
-        for i, batch_data in enumerate(train_loader):
+        train_feeder.reset_stats()
+        for i, batch_data in enumerate(train_feeder):
             # the model will be evaluation mode during validation
             model.train()
             model.zero_grad()
             optimizer.zero_grad()
 
-            batch_data = train_utils.to_device(batch_data, device)
+            if batch_data['ego']['label_dict'] is None:
+                # label_on_device, the targets are generated on the gpu
+                batch_data['ego']['label_dict'] = \
+                    opencood_train_dataset.post_processor.generate_label_torch(
+                        batch_data['ego']['object_bbx_center'],
+                        batch_data['ego']['object_bbx_mask'])
 
             # case1 : late fusion train --> only ego needed,
             # and ego is random selected
@@ -179,6 +197,12 @@ def main():
             if hypes['lr_scheduler']['core_method'] == 'cosineannealwarm':
                 scheduler.step_update(epoch * num_steps + i)
 
+        feeder_stats = train_feeder.summary()
+        writer.add_scalar('Device_Feeder_Overlap', feeder_stats['overlap'],
+                          epoch)
+        writer.add_scalar('Device_Feeder_Copy_ms', feeder_stats['copy_ms'],
+                          epoch)
+
         if epoch % hypes['train_params']['save_freq'] == 0:
             torch.save(model_without_ddp.state_dict(),
                 os.path.join(saved_path, 'net_epoch%d.pth' % (epoch + 1)))
@@ -187,10 +211,15 @@ def main():
             valid_ave_loss = []
 
             with torch.no_grad():
-                for i, batch_data in enumerate(val_loader):
+                for i, batch_data in enumerate(val_feeder):
                     model.eval()
 
-                    batch_data = train_utils.to_device(batch_data, device)
+                    if batch_data['ego']['label_dict'] is None:
+                        batch_data['ego']['label_dict'] = \
+                            opencood_validate_dataset.post_processor.\
+                            generate_label_torch(
+                                batch_data['ego']['object_bbx_center'],
+                                batch_data['ego']['object_bbx_mask'])
                     ouput_dict = model(batch_data['ego'])
 
                     final_loss = criterion(ouput_dict,
@@ -136,6 +136,35 @@ def create_model(hypes):
     return instance
 
 
+# the convolutional modules that run in channels last memory format
+CHANNELS_LAST_MODULES = ['backbone', 'shrink_conv', 'cls_head', 'reg_head']
+
+
+def to_channels_last(model):
+    """
+    Convert the weights of the 2D convolutional modules of the model, i.e.
+    the BEV backbone, the downsample convolutions and the heads, to the
+    channels last memory format. Their outputs then stay in channels last,
+    which is faster for the cudnn and oneDNN kernels, especially under
+    fp16/bf16 autocast.
+
+    Parameters
+    ----------
+    model : opencood.object
+        Model object, created by create_model.
+
+    Returns
+    -------
+    model : opencood.object
+        The same model object.
+    """
+    for name in CHANNELS_LAST_MODULES:
+        module = getattr(model, name, None)
+        if module is not None:
+            module.to(memory_format=torch.channels_last)
+    return model
+
+
 def create_loss(hypes):
     """
     Create the loss function based on the given loss name.
@@ -257,13 +286,14 @@ def setup_lr_schedular(hypes, optimizer, n_iter_per_epoch):
     return scheduler
 
 
-def to_device(inputs, device):
+def to_device(inputs, device, non_blocking=False):
     if isinstance(inputs, list):
-        return [to_device(x, device) for x in inputs]
+        return [to_device(x, device, non_blocking) for x in inputs]
     elif isinstance(inputs, dict):
-        return {k: to_device(v, device) for k, v in inputs.items()}
+        return {k: to_device(v, device, non_blocking)
+                for k, v in inputs.items()}
     else:
         if isinstance(inputs, int) or isinstance(inputs, float) \
-                or isinstance(inputs, str):
+                or isinstance(inputs, str) or inputs is None:
             return inputs
-        return inputs.to(device)
+        return inputs.to(device, non_blocking=non_blocking)
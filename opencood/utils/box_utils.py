@@ -7,13 +7,14 @@
 Bounding box related utility functions
 """
 import sys
+from collections import OrderedDict, namedtuple
 
 import numpy as np
 
 import torch
 import torch.nn.functional as F
 import opencood.utils.common_utils as common_utils
-from opencood.utils.transformation_utils import x1_to_x2
+from opencood.utils.transformation_utils import x1_to_x2_batch
 
 
 def corner_to_center(corner3d, order='lwh'):
@@ -432,19 +433,98 @@ def create_bbx(extent):
     return bbx
 
 
+# sign of the extent of the 8 corners created by create_bbx
+_BBX_CORNER_SIGNS = np.array([[1, -1, -1],
+                              [1, 1, -1],
+                              [-1, 1, -1],
+                              [-1, -1, -1],
+                              [1, -1, 1],
+                              [1, 1, 1],
+                              [-1, 1, 1],
+                              [-1, -1, 1]], dtype=np.float64)
+
+
+# the annotated objects of a frame as arrays, ids (K,), poses (K, 6) as
+# [x, y, z, roll, yaw, pitch] of the bbx center and extents (K, 3)
+FrameObjects = namedtuple('FrameObjects', ['ids', 'poses', 'extents'])
+
+
+def frame_objects_from_dict(object_dict):
+    """
+    Convert the vehicles of a frame yaml to FrameObjects.
+
+    Parameters
+    ----------
+    object_dict : dict
+        {object_id : {'location', 'center', 'extent', 'angle'}}.
+
+    Returns
+    -------
+    frame_objects : FrameObjects
+    """
+    num_objects = len(object_dict)
+    ids = np.array(list(object_dict.keys()), dtype=np.int64)
+    poses = np.zeros((num_objects, 6))
+    extents = np.zeros((num_objects, 3))
+    for i, object_content in enumerate(object_dict.values()):
+        poses[i, :3] = np.add(object_content['location'],
+                              object_content['center'])
+        poses[i, 3:] = object_content['angle']
+        extents[i] = object_content['extent']
+
+    return FrameObjects(ids, poses, extents)
+
+
+def merge_frame_objects(frame_objects_list):
+    """
+    Merge the objects of several frames like successive dict updates, an
+    object keeps the position of its first occurrence and the values of its
+    last one.
+
+    Parameters
+    ----------
+    frame_objects_list : list
+        FrameObjects or the vehicles dict of a frame yaml.
+
+    Returns
+    -------
+    frame_objects : FrameObjects
+    """
+    frame_objects_list = [frame_objects_from_dict(x) if isinstance(x, dict)
+                          else x for x in frame_objects_list]
+    if len(frame_objects_list) == 0:
+        return frame_objects_from_dict({})
+    if len(frame_objects_list) == 1:
+        return frame_objects_list[0]
+
+    ids = np.concatenate([x.ids for x in frame_objects_list])
+    poses = np.concatenate([x.poses for x in frame_objects_list])
+    extents = np.concatenate([x.extents for x in frame_objects_list])
+
+    # both are sorted by id
+    _, first = np.unique(ids, return_index=True)
+    _, last = np.unique(ids[::-1], return_index=True)
+    last = len(ids) - 1 - last
+    rows = last[np.argsort(first)]
+
+    return FrameObjects(ids[rows], poses[rows], extents[rows])
+
+
 def project_world_objects(object_dict,
                           output_dict,
                           lidar_pose,
                           lidar_range,
-                          order):
+                          order,
+                          cache=None):
     """
     Project the objects under world coordinates into another coordinate
-    based on the provided extrinsic.
+    based on the provided extrinsic. All the objects are projected at once.
 
     Parameters
     ----------
-    object_dict : dict
-        The dictionary contains all objects surrounding a certain cav.
+    object_dict : dict or FrameObjects
+        The objects surrounding a certain cav, the vehicles of a frame yaml
+        or their arrays.
 
     output_dict : dict
         key: object id, value: object bbx (xyzlwhyaw).
@@ -457,34 +537,58 @@ def project_world_objects(object_dict,
 
     order : str
         'lwh' or 'hwl'
+
+    cache : dict
+        Optional, the objects already projected with the same lidar_pose,
+        lidar_range and order, e.g. by the other cavs of a sample. It is
+        updated with the newly projected objects.
     """
-    for object_id, object_content in object_dict.items():
-        location = object_content['location']
-        rotation = object_content['angle']
-        center = object_content['center']
-        extent = object_content['extent']
-
-        object_pose = [location[0] + center[0],
-                       location[1] + center[1],
-                       location[2] + center[2],
-                       rotation[0], rotation[1], rotation[2]]
-        object2lidar = x1_to_x2(object_pose, lidar_pose)
-
-        # shape (3, 8)
-        bbx = create_bbx(extent).T
-        # bounding box under ego coordinate shape (4, 8)
-        bbx = np.r_[bbx, [np.ones(bbx.shape[1])]]
-
-        # project the 8 corners to world coordinate
-        bbx_lidar = np.dot(object2lidar, bbx).T
-        bbx_lidar = np.expand_dims(bbx_lidar[:, :3], 0)
+    if isinstance(object_dict, dict):
+        object_dict = frame_objects_from_dict(object_dict)
+
+    # the bbx of each object, None if the object is outside the range
+    object_ids = object_dict.ids.tolist()
+    object_bbx = OrderedDict((object_id, None) for object_id in object_ids)
+    # the objects to project
+    missing = np.ones(len(object_ids), dtype=bool)
+    if cache is not None:
+        object_keys = [(object_id,) + tuple(object_pose) + tuple(extent)
+                       for object_id, object_pose, extent in
+                       zip(object_ids, object_dict.poses.tolist(),
+                           object_dict.extents.tolist())]
+        for i, key in enumerate(object_keys):
+            if key in cache:
+                object_bbx[object_ids[i]] = cache[key]
+                missing[i] = False
+
+    if missing.any():
+        # (K, 4, 4)
+        object2lidar = x1_to_x2_batch(object_dict.poses[missing],
+                                      [lidar_pose])[:, 0]
+
+        # the 8 corners of each bbx, same as create_bbx, shape (K, 8, 4)
+        extents = object_dict.extents[missing].astype(np.float64)
+        bbx = np.ones((extents.shape[0], 8, 4))
+        bbx[:, :, :3] = _BBX_CORNER_SIGNS[np.newaxis] * \
+            extents[:, np.newaxis, :3]
+
+        # project the corners of all objects, shape (K, 8, 3)
+        bbx_lidar = np.einsum('kij,knj->kni', object2lidar, bbx)[:, :, :3]
         bbx_lidar = corner_to_center(bbx_lidar, order=order)
-        bbx_lidar = mask_boxes_outside_range_numpy(bbx_lidar,
-                                                   lidar_range,
-                                                   order)
+        _, mask = mask_boxes_outside_range_numpy(bbx_lidar,
+                                                 lidar_range,
+                                                 order,
+                                                 return_mask=True)
 
-        if bbx_lidar.shape[0] > 0:
-            output_dict.update({object_id: bbx_lidar})
+        for i, row in enumerate(np.flatnonzero(missing)):
+            bbx_center = bbx_lidar[i:i + 1] if mask[i] else None
+            object_bbx[object_ids[row]] = bbx_center
+            if cache is not None:
+                cache[object_keys[row]] = bbx_center
+
+    for object_id, bbx_center in object_bbx.items():
+        if bbx_center is not None:
+            output_dict.update({object_id: bbx_center})
 
 
 def get_points_in_rotated_box(p, box_corner):
@@ -585,9 +689,227 @@ def get_projection_length_for_vector_projection(a, b):
     return length
 
 
-def nms_rotated(boxes, scores, threshold):
+def polygon_area(polygons):
+    """
+    Compute the area of convex polygons with the shoelace formula.
+
+    Parameters
+    ----------
+    polygons : torch.Tensor
+        The polygon vertices in clockwise or counter-clockwise order,
+        shape (..., K, 2).
+
+    Returns
+    -------
+    area : torch.Tensor
+        The polygon areas, shape (...).
+    """
+    x = polygons[..., 0]
+    y = polygons[..., 1]
+    return 0.5 * torch.abs(
+        torch.sum(x * torch.roll(y, -1, dims=-1) -
+                  torch.roll(x, -1, dims=-1) * y, dim=-1))
+
+
+def rotated_box_intersection(boxes_a, boxes_b, eps=1e-8):
+    """
+    Compute the intersection area of pairs of rotated rectangles.
+
+    The intersection polygon of two convex quadrilaterals has its vertices
+    among the corners of one box inside the other box and the intersections
+    of the box edges. All 24 candidates are computed for every pair, sorted
+    by angle around the centroid of the valid ones and the area is computed
+    with the shoelace formula.
+
+    Parameters
+    ----------
+    boxes_a : torch.Tensor
+        The 2d corners of the first boxes, shape (K, 4, 2).
+
+    boxes_b : torch.Tensor
+        The 2d corners of the second boxes, shape (K, 4, 2).
+
+    eps : float
+        Tolerance of the inside and parallel tests.
+
+    Returns
+    -------
+    intersection : torch.Tensor
+        The intersection areas, shape (K,).
+    """
+    def inside(points, polygons):
+        # (K, 4, 2), the edges of the polygons
+        edges = torch.roll(polygons, -1, dims=1) - polygons
+        # (K, 4 points, 4 edges)
+        relative = points[:, :, None] - polygons[:, None]
+        cross = edges[:, None, :, 0] * relative[..., 1] - \
+            edges[:, None, :, 1] * relative[..., 0]
+        # the corners can be ordered either way
+        return torch.all(cross >= -eps, dim=-1) | \
+            torch.all(cross <= eps, dim=-1)
+
+    # (K, 4, 1, 2) and (K, 1, 4, 2), all pairs of edges
+    p = boxes_a[:, :, None]
+    r = (torch.roll(boxes_a, -1, dims=1) - boxes_a)[:, :, None]
+    q = boxes_b[:, None]
+    s = (torch.roll(boxes_b, -1, dims=1) - boxes_b)[:, None]
+
+    def cross2d(u, v):
+        return u[..., 0] * v[..., 1] - u[..., 1] * v[..., 0]
+
+    # (K, 4, 4)
+    denom = cross2d(r, s)
+    parallel = torch.abs(denom) < eps
+    denom = torch.where(parallel, torch.ones_like(denom), denom)
+    t = cross2d(q - p, s) / denom
+    u = cross2d(q - p, r) / denom
+    edge_valid = ~parallel & (t >= 0) & (t <= 1) & (u >= 0) & (u <= 1)
+    # (K, 16, 2)
+    edge_points = (p + t[..., None] * r).flatten(1, 2)
+
+    # (K, 24, 2)
+    points = torch.cat([boxes_a, boxes_b, edge_points], dim=1)
+    valid = torch.cat([inside(boxes_a, boxes_b),
+                       inside(boxes_b, boxes_a),
+                       edge_valid.flatten(1, 2)], dim=1)
+
+    num_valid = valid.sum(dim=1, keepdim=True)
+    center = torch.sum(points * valid[..., None], dim=1) / \
+        torch.clamp(num_valid, min=1)
+    relative = points - center[:, None]
+    angle = torch.atan2(relative[..., 1], relative[..., 0])
+    # invalid points are sorted after the valid ones
+    angle = torch.where(valid, angle, torch.full_like(angle, 10.))
+    order = torch.argsort(angle, dim=1)
+    points = torch.gather(points, 1, order[..., None].expand(-1, -1, 2))
+
+    # the invalid points are replaced by the first vertex, which closes the
+    # polygon without adding any area
+    valid_sorted = torch.arange(points.shape[1], device=points.device)[None] \
+        < num_valid
+    points = torch.where(valid_sorted[..., None], points, points[:, :1])
+
+    return polygon_area(points) * (num_valid.squeeze(1) >= 3)
+
+
+def boxes_iou_rotated(boxes_a, boxes_b):
+    """
+    Compute the bev IoU between all pairs of two sets of rotated boxes. It is
+    the vectorized equivalent of common_utils.compute_iou.
+
+    Parameters
+    ----------
+    boxes_a : torch.Tensor or np.ndarray
+        The corners of the first boxes, shape (N, 4, 2) or (N, 8, 3). Only
+        the first 4 corners in the x-y plane are used.
+
+    boxes_b : torch.Tensor or np.ndarray
+        The corners of the second boxes, shape (M, 4, 2) or (M, 8, 3).
+
+    Returns
+    -------
+    iou : torch.Tensor or np.ndarray
+        The IoU matrix, shape (N, M), of the same type as boxes_a.
+    """
+    boxes_a, is_numpy = common_utils.check_numpy_to_torch(boxes_a)
+    boxes_b, _ = common_utils.check_numpy_to_torch(boxes_b)
+    boxes_a = boxes_a[:, :4, :2].float()
+    boxes_b = boxes_b[:, :4, :2].float().to(boxes_a.device)
+
+    iou = boxes_a.new_zeros((boxes_a.shape[0], boxes_b.shape[0]))
+    if iou.numel() > 0:
+        # only the pairs with overlapping standup boxes can intersect
+        min_a, max_a = boxes_a.min(dim=1)[0], boxes_a.max(dim=1)[0]
+        min_b, max_b = boxes_b.min(dim=1)[0], boxes_b.max(dim=1)[0]
+        overlap = torch.all(
+            torch.min(max_a[:, None], max_b[None]) >
+            torch.max(min_a[:, None], min_b[None]), dim=-1)
+        index_a, index_b = torch.nonzero(overlap, as_tuple=True)
+
+        intersection = rotated_box_intersection(boxes_a[index_a],
+                                                boxes_b[index_b])
+        union = polygon_area(boxes_a)[index_a] + \
+            polygon_area(boxes_b)[index_b] - intersection
+        iou[index_a, index_b] = intersection / torch.clamp(union, min=1e-8)
+
+    if is_numpy:
+        iou = iou.numpy()
+    return iou
+
+
+def nms_rotated(boxes, scores, threshold, batch_index=None):
     """Performs rorated non-maximum suppression and returns indices of kept
-    boxes.
+    boxes. The IoU between all candidates is computed at once on the device
+    of the boxes, and the greedy selection stays on the device as well. It
+    iterates over all the boxes at once, so the number of steps is the
+    length of the longest suppression chain instead of the number of boxes.
+
+    Parameters
+    ----------
+    boxes : torch.tensor
+        The location preds with shape (N, 4, 2) or (N, 8, 3).
+
+    scores : torch.tensor
+        The predicted confidence score with shape (N,)
+
+    threshold: float
+        IoU threshold to use for filtering.
+
+    batch_index : torch.tensor, optional
+        The sample index of each box with shape (N,). Boxes of different
+        samples never suppress each other.
+
+    Returns
+    -------
+        A tensor of index
+    """
+    if boxes.shape[0] == 0:
+        return torch.zeros(0, dtype=torch.long, device=boxes.device)
+    boxes = boxes.detach()
+    scores = scores.detach()
+
+    top = 1000
+    # Get indicies of boxes sorted by scores (highest first), equal scores
+    # are ordered by decreasing index like the reversed stable ascending
+    # sort of nms_rotated_shapely
+    num_boxes = scores.shape[0]
+    _, order = torch.sort(scores.flip(0), descending=True, stable=True)
+    order = num_boxes - 1 - order
+    if batch_index is None:
+        order = order[:top]
+    else:
+        # the top boxes of each sample, ranked within the sample
+        batch_index = batch_index[order].long()
+        rank = F.one_hot(batch_index).cumsum(0).gather(
+            1, batch_index[:, None]).squeeze(1) - 1
+        order, batch_index = order[rank < top], batch_index[rank < top]
+    num_boxes = order.shape[0]
+
+    # (N, N), only the boxes with higher scores can suppress a box
+    suppress = torch.triu(boxes_iou_rotated(boxes[order], boxes[order]),
+                          diagonal=1) > threshold
+    if batch_index is not None:
+        suppress = suppress & (batch_index[:, None] == batch_index[None])
+
+    # greedy selection, a box is kept if no kept box with a higher score
+    # suppresses it. Starting from all the boxes, the first k boxes are
+    # final after k steps, so the fixed point is the greedy result. Only
+    # the convergence flag is read on the host.
+    suppress = suppress.float()
+    keep = torch.ones(num_boxes, dtype=torch.bool, device=boxes.device)
+    while True:
+        new_keep = (keep.float() @ suppress) == 0
+        if torch.equal(new_keep, keep):
+            break
+        keep = new_keep
+
+    return order[keep]
+
+
+def nms_rotated_shapely(boxes, scores, threshold):
+    """Performs rorated non-maximum suppression with shapely polygons and
+    returns indices of kept boxes. This is the reference implementation of
+    nms_rotated.
 
     Parameters
     ----------
@@ -613,7 +935,7 @@ def nms_rotated(boxes, scores, threshold):
 
     top = 1000
     # Get indicies of boxes sorted by scores (highest first)
-    ixs = scores.argsort()[::-1][:top]
+    ixs = scores.argsort(kind='stable')[::-1][:top]
 
     pick = []
     while len(ixs) > 0:
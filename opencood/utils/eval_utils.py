@@ -8,7 +8,7 @@ import os
 import numpy as np
 import torch
 
-from opencood.utils import common_utils
+from opencood.utils import box_utils, common_utils
 from opencood.hypes_yaml import yaml_utils
 
 
@@ -16,32 +16,76 @@ def voc_ap(rec, prec):
     """
     VOC 2010 Average Precision.
     """
-    rec.insert(0, 0.0)
-    rec.append(1.0)
-    mrec = rec[:]
+    mrec = np.concatenate([[0.0], rec, [1.0]])
+    mpre = np.concatenate([[0.0], prec, [0.0]])
 
-    prec.insert(0, 0.0)
-    prec.append(0.0)
-    mpre = prec[:]
+    # make the precision monotonically decreasing
+    mpre = np.maximum.accumulate(mpre[::-1])[::-1]
 
-    for i in range(len(mpre) - 2, -1, -1):
-        mpre[i] = max(mpre[i], mpre[i + 1])
+    i_list = np.where(mrec[1:] != mrec[:-1])[0] + 1
 
-    i_list = []
-    for i in range(1, len(mrec)):
-        if mrec[i] != mrec[i - 1]:
-            i_list.append(i)
+    ap = np.sum((mrec[i_list] - mrec[i_list - 1]) * mpre[i_list])
+    return float(ap), mrec.tolist(), mpre.tolist()
 
-    ap = 0.0
-    for i in i_list:
-        ap += ((mrec[i] - mrec[i - 1]) * mpre[i])
-    return ap, mrec, mpre
 
+def create_result_stat(iou_thresholds=(0.3, 0.5, 0.7)):
+    """
+    Create the dictionary for evaluation.
+
+    Parameters
+    ----------
+    iou_thresholds : tuple
+        The evaluated iou thresholds.
+
+    Returns
+    -------
+    result_stat : dict
+        The tp and fp arrays of every frame and the gt number for each iou
+        threshold.
+    """
+    return {iou_thresh: {'tp': [], 'fp': [], 'gt': 0}
+            for iou_thresh in iou_thresholds}
+
+
+def greedy_match(ious, iou_thresh):
+    """
+    Match the detections, sorted by score, to the groundtruth. Each
+    detection takes the remaining groundtruth with the largest iou if it is
+    above the threshold.
+
+    Parameters
+    ----------
+    ious : np.ndarray
+        The iou between the sorted detections and the groundtruth, (N, M).
+    iou_thresh : float
+        The iou thresh.
 
-def caluclate_tp_fp(det_boxes, det_score, gt_boxes, result_stat, iou_thresh):
+    Returns
+    -------
+    tp : np.ndarray
+        Whether each detection is a true positive, shape (N,).
+    """
+    tp = np.zeros(ious.shape[0], dtype=np.int64)
+    available = np.ones(ious.shape[1], dtype=bool)
+
+    for i in range(ious.shape[0]):
+        if not available.any():
+            break
+        remaining_ious = np.where(available, ious[i], -1)
+        gt_index = np.argmax(remaining_ious)
+        if remaining_ious[gt_index] >= iou_thresh:
+            tp[i] = 1
+            available[gt_index] = False
+
+    return tp
+
+
+def caluclate_tp_fp(det_boxes, det_score, gt_boxes, result_stat,
+                    iou_thresh=None):
     """
     Calculate the true positive and false positive numbers of the current
-    frames.
+    frames. The iou between the detections and the groundtruth is computed
+    once and shared by all the iou thresholds.
 
     Parameters
     ----------
@@ -54,12 +98,13 @@ def caluclate_tp_fp(det_boxes, det_score, gt_boxes, result_stat, iou_thresh):
     result_stat: dict
         A dictionary contains fp, tp and gt number.
     iou_thresh : float
-        The iou thresh.
+        The iou thresh. All the thresholds in result_stat are evaluated if
+        it is None.
     """
-    # fp, tp and gt in the current frame
-    fp = []
-    tp = []
+    iou_thresholds = list(result_stat.keys()) if iou_thresh is None \
+        else [iou_thresh]
     gt = gt_boxes.shape[0]
+
     if det_boxes is not None:
         # convert bounding boxes to numpy array
         det_boxes = common_utils.torch_tensor_to_numpy(det_boxes)
@@ -68,28 +113,16 @@ def caluclate_tp_fp(det_boxes, det_score, gt_boxes, result_stat, iou_thresh):
 
         # sort the prediction bounding box by score
         score_order_descend = np.argsort(-det_score)
-        det_polygon_list = list(common_utils.convert_format(det_boxes))
-        gt_polygon_list = list(common_utils.convert_format(gt_boxes))
-
-        # match prediction and gt bounding box
-        for i in range(score_order_descend.shape[0]):
-            det_polygon = det_polygon_list[score_order_descend[i]]
-            ious = common_utils.compute_iou(det_polygon, gt_polygon_list)
-
-            if len(gt_polygon_list) == 0 or np.max(ious) < iou_thresh:
-                fp.append(1)
-                tp.append(0)
-                continue
-
-            fp.append(0)
-            tp.append(1)
+        # (N, M)
+        ious = box_utils.boxes_iou_rotated(det_boxes[score_order_descend],
+                                           gt_boxes)
 
-            gt_index = np.argmax(ious)
-            gt_polygon_list.pop(gt_index)
-
-    result_stat[iou_thresh]['fp'] += fp
-    result_stat[iou_thresh]['tp'] += tp
-    result_stat[iou_thresh]['gt'] += gt
+    for thresh in iou_thresholds:
+        if det_boxes is not None:
+            tp = greedy_match(ious, thresh)
+            result_stat[thresh]['tp'].append(tp)
+            result_stat[thresh]['fp'].append(1 - tp)
+        result_stat[thresh]['gt'] += gt
 
 
 def calculate_ap(result_stat, iou):
@@ -104,31 +137,22 @@ def calculate_ap(result_stat, iou):
     """
     iou_5 = result_stat[iou]
 
-    fp = iou_5['fp']
-    tp = iou_5['tp']
+    # the tp and fp of all frames in order
+    fp = np.hstack(iou_5['fp']).astype(np.float64) if len(iou_5['fp']) \
+        else np.zeros(0)
+    tp = np.hstack(iou_5['tp']).astype(np.float64) if len(iou_5['tp']) \
+        else np.zeros(0)
     assert len(fp) == len(tp)
 
     gt_total = iou_5['gt']
 
-    cumsum = 0
-    for idx, val in enumerate(fp):
-        fp[idx] += cumsum
-        cumsum += val
-
-    cumsum = 0
-    for idx, val in enumerate(tp):
-        tp[idx] += cumsum
-        cumsum += val
-
-    rec = tp[:]
-    for idx, val in enumerate(tp):
-        rec[idx] = float(tp[idx]) / gt_total
+    fp = np.cumsum(fp)
+    tp = np.cumsum(tp)
 
-    prec = tp[:]
-    for idx, val in enumerate(tp):
-        prec[idx] = float(tp[idx]) / (fp[idx] + tp[idx])
+    rec = tp / gt_total
+    prec = tp / (fp + tp)
 
-    ap, mrec, mprec = voc_ap(rec[:], prec[:])
+    ap, mrec, mprec = voc_ap(rec, prec)
 
     return ap, mrec, mprec
 
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+
+"""
+Pre-converted LiDAR store. All pcd files of a split are packed into one
+flat float32 (N, 4) binary blob per scenario plus an offset table, so the
+point clouds can be read as zero-copy memory-mapped views instead of being
+decoded by open3d on every access.
+"""
+
+import os
+
+import numpy as np
+
+# name of the offset table inside the store folder
+LIDAR_STORE_OFFSETS = 'offsets.npz'
+
+
+def get_lidar_store_dir(root_dir):
+    """
+    Return the default store folder of a split, placed next to the split
+    folder so that it is not mistaken for a scenario, e.g.
+    V2XSet/train -> V2XSet/train_lidar_store.
+    """
+    return os.path.normpath(root_dir) + '_lidar_store'
+
+
+def build_lidar_store(root_dir, store_dir=None):
+    """
+    Convert all pcd files of a split into the memory-mappable store.
+
+    Parameters
+    ----------
+    root_dir : str
+        The split folder, e.g. V2XSet/train.
+
+    store_dir : str
+        Output folder, by default get_lidar_store_dir(root_dir).
+
+    Returns
+    -------
+    num_files : int
+        Number of converted pcd files.
+    """
+    # open3d is only needed for the one-time conversion
+    from opencood.utils.pcd_utils import pcd_to_np
+
+    if store_dir is None:
+        store_dir = get_lidar_store_dir(root_dir)
+    if not os.path.exists(store_dir):
+        os.makedirs(store_dir)
+
+    files, blob_ids, starts, counts = [], [], [], []
+    blob_files = []
+
+    scenario_names = sorted([x for x in os.listdir(root_dir) if
+                             os.path.isdir(os.path.join(root_dir, x))])
+    for scenario_name in scenario_names:
+        scenario_folder = os.path.join(root_dir, scenario_name)
+        blob_file = scenario_name + '.bin'
+        blob_files.append(blob_file)
+        row = 0
+
+        with open(os.path.join(store_dir, blob_file), 'wb') as f:
+            cav_list = sorted([x for x in os.listdir(scenario_folder) if
+                               os.path.isdir(
+                                   os.path.join(scenario_folder, x))])
+            for cav_id in cav_list:
+                cav_path = os.path.join(scenario_folder, cav_id)
+                pcd_files = sorted([x for x in os.listdir(cav_path)
+                                    if x.endswith('.pcd')])
+                for pcd_file in pcd_files:
+                    pcd_np = pcd_to_np(os.path.join(cav_path, pcd_file))
+                    f.write(np.ascontiguousarray(pcd_np,
+                                                 dtype=np.float32).tobytes())
+
+                    files.append('/'.join([scenario_name, cav_id, pcd_file]))
+                    blob_ids.append(len(blob_files) - 1)
+                    starts.append(row)
+                    counts.append(pcd_np.shape[0])
+                    row += pcd_np.shape[0]
+
+    np.savez(os.path.join(store_dir, LIDAR_STORE_OFFSETS),
+             files=np.array(files, dtype=str),
+             blob_ids=np.array(blob_ids, dtype=np.int32),
+             starts=np.array(starts, dtype=np.int64),
+             counts=np.array(counts, dtype=np.int64),
+             blob_files=np.array(blob_files, dtype=str))
+
+    return len(files)
+
+
+class LidarStore(object):
+    """
+    Reader of the pre-converted LiDAR store.
+
+    Parameters
+    ----------
+    root_dir : str
+        The split folder the store was built from.
+
+    store_dir : str
+        The store folder, by default get_lidar_store_dir(root_dir).
+    """
+
+    def __init__(self, root_dir, store_dir=None):
+        self.root_dir = root_dir
+        self.store_dir = store_dir if store_dir is not None else \
+            get_lidar_store_dir(root_dir)
+
+        with np.load(os.path.join(self.store_dir, LIDAR_STORE_OFFSETS),
+                     allow_pickle=False) as data:
+            self.blob_files = data['blob_files'].tolist()
+            self.offsets = {
+                f: (b, s, c) for f, b, s, c in
+                zip(data['files'].tolist(),
+                    data['blob_ids'].tolist(),
+                    data['starts'].tolist(),
+                    data['counts'].tolist())}
+
+        # the memory maps are opened lazily, so that each dataloader
+        # worker owns its own file handles
+        self._memmaps = {}
+
+    @staticmethod
+    def exists(root_dir):
+        return os.path.exists(os.path.join(get_lidar_store_dir(root_dir),
+                                           LIDAR_STORE_OFFSETS))
+
+    def _key(self, lidar_file):
+        return os.path.relpath(lidar_file,
+                               self.root_dir).replace(os.sep, '/')
+
+    def __contains__(self, lidar_file):
+        return self._key(lidar_file) in self.offsets
+
+    def _get_memmap(self, blob_id):
+        if blob_id not in self._memmaps:
+            # copy-on-write so in-place edits by the callers never reach
+            # the store on disk
+            self._memmaps[blob_id] = np.memmap(
+                os.path.join(self.store_dir, self.blob_files[blob_id]),
+                dtype=np.float32, mode='c').reshape(-1, 4)
+        return self._memmaps[blob_id]
+
+    def load(self, lidar_file):
+        """
+        Return the point cloud of a pcd file as a memory-mapped view.
+
+        Parameters
+        ----------
+        lidar_file : str
+            The original pcd path inside the split folder.
+
+        Returns
+        -------
+        pcd_np : np.ndarray
+            The lidar data, shape:(n, 4), float32.
+        """
+        blob_id, start, count = self.offsets[self._key(lidar_file)]
+        if count == 0:
+            return np.zeros((0, 4), dtype=np.float32)
+        return self._get_memmap(blob_id)[start:start + count]
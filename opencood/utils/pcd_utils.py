@@ -7,7 +7,6 @@
 Utility functions related to point cloud
 """
 
-import open3d as o3d
 import numpy as np
 
 
@@ -28,6 +27,10 @@ def pcd_to_np(pcd_file):
         The lidar data in numpy format, shape:(n, 4)
 
     """
+    # open3d is imported lazily so that the dataloader workers reading the
+    # pre-converted lidar store do not need it
+    import open3d as o3d
+
     pcd = o3d.io.read_point_cloud(pcd_file)
 
     xyz = np.asarray(pcd.points)
@@ -95,6 +98,65 @@ def shuffle_points(points):
     return points
 
 
+def transform_and_filter_points(points, limit_range,
+                                transformation_matrix=None,
+                                shuffle_above=None):
+    """
+    Remove the lidar points of the ego vehicle, project the rest to another
+    coordinate system and remove the points out of the boundary. Both masks
+    are evaluated on the whole cloud and the points are compacted once,
+    instead of going through shuffle_points, mask_ego_points,
+    project_points_by_matrix_torch and mask_points_by_range.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        Lidar points under lidar sensor coordinate system, (n, 4). They are
+        not modified.
+
+    limit_range : list
+        [x_min, y_min, z_min, x_max, y_max, z_max] in the target coordinate
+        system.
+
+    transformation_matrix : np.ndarray
+        (4, 4) transformation to the target coordinate system, None to keep
+        the sensor coordinate system.
+
+    shuffle_above : int
+        Shuffle the kept points when there are more than shuffle_above of
+        them, e.g. when the voxelizer may truncate them. None never
+        shuffles.
+
+    Returns
+    -------
+    points : np.ndarray
+        Filtered lidar points.
+    """
+    xyz = points[:, :3]
+    # remove the points that hit the ego vehicle, same box as mask_ego_points
+    mask = np.logical_not((xyz[:, 0] >= -1.95) & (xyz[:, 0] <= 2.95)
+                          & (xyz[:, 1] >= -1.1) & (xyz[:, 1] <= 1.1))
+
+    if transformation_matrix is not None:
+        matrix = np.asarray(transformation_matrix, dtype=np.float32)
+        xyz = xyz @ matrix[:3, :3].T
+        xyz += matrix[:3, 3]
+
+    mask &= (xyz[:, 0] > limit_range[0]) & (xyz[:, 0] < limit_range[3]) \
+        & (xyz[:, 1] > limit_range[1]) & (xyz[:, 1] < limit_range[4]) \
+        & (xyz[:, 2] > limit_range[2]) & (xyz[:, 2] < limit_range[5])
+
+    index = np.flatnonzero(mask)
+    if shuffle_above is not None and index.shape[0] > shuffle_above:
+        index = np.random.permutation(index)
+
+    filtered_points = points[index]
+    if transformation_matrix is not None:
+        filtered_points[:, :3] = xyz[index]
+
+    return filtered_points
+
+
 def lidar_project(lidar_data, extrinsic):
     """
     Given the extrinsic matrix, project lidar data to another space.
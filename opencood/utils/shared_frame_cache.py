@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+
+"""
+Cross-process LRU cache of decoded point clouds. The point arrays live in
+one shared memory arena, so every DataLoader worker forked from the process
+that created the cache reads the frames decoded by the other workers, e.g.
+a frame loaded as the current ego frame is reused as the ego-1 and ego-2
+history of the following samples. It requires python >= 3.8 for
+multiprocessing.shared_memory, so it is only imported when enabled.
+"""
+
+import atexit
+import hashlib
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# columns of the entry table
+_KEY, _OFFSET, _NBYTES, _ROWS, _COLS, _TICK = range(6)
+
+
+def _hash_key(key):
+    """
+    Stable 63-bit hash of a string key, identical in all processes. 0 marks
+    an empty slot of the entry table.
+    """
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return (int.from_bytes(digest, 'little') >> 1) or 1
+
+
+class SharedFrameCache(object):
+    """
+    LRU cache of float32 point arrays in shared memory under a byte budget.
+
+    The arena is allocated first-fit. When no gap is large enough, the least
+    recently used entries are evicted until the new array fits. The entry
+    table and the arena are guarded by a single inter-process lock, and the
+    arrays are copied out so that a later eviction by another worker cannot
+    change them.
+
+    The cache has to be created before the DataLoader workers are started.
+
+    Parameters
+    ----------
+    budget_bytes : int
+        Size of the shared memory arena.
+
+    max_entries : int
+        Maximum number of cached frames.
+    """
+
+    def __init__(self, budget_bytes, max_entries=8192):
+        self.budget_bytes = int(budget_bytes)
+        self.max_entries = max_entries
+
+        self._lock = multiprocessing.Lock()
+        self._arena = shared_memory.SharedMemory(create=True,
+                                                 size=self.budget_bytes)
+        # row 0 holds the global access counter
+        self._table_shm = shared_memory.SharedMemory(
+            create=True, size=(max_entries + 1) * 6 * 8)
+        self._owner = True
+        self._attach_arrays()
+        self._table[:] = 0
+
+        # per process counters
+        self.hits = 0
+        self.misses = 0
+
+    def _attach_arrays(self):
+        self._table = np.ndarray((self.max_entries + 1, 6), dtype=np.int64,
+                                 buffer=self._table_shm.buf)
+        self._buffer = np.ndarray((self.budget_bytes,), dtype=np.uint8,
+                                  buffer=self._arena.buf)
+
+    def __getstate__(self):
+        # only used when the workers are spawned instead of forked
+        return {'budget_bytes': self.budget_bytes,
+                'max_entries': self.max_entries,
+                'lock': self._lock,
+                'arena': self._arena.name,
+                'table': self._table_shm.name}
+
+    def __setstate__(self, state):
+        from multiprocessing import resource_tracker
+
+        self.budget_bytes = state['budget_bytes']
+        self.max_entries = state['max_entries']
+        self._lock = state['lock']
+        self._arena = shared_memory.SharedMemory(name=state['arena'])
+        self._table_shm = shared_memory.SharedMemory(name=state['table'])
+        # the segments belong to the creating process, they must not be
+        # unlinked when a worker exits
+        for shm in [self._arena, self._table_shm]:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        self._owner = False
+        self._attach_arrays()
+        self.hits = 0
+        self.misses = 0
+
+    def _find(self, key_hash):
+        index = np.nonzero(self._table[1:, _KEY] == key_hash)[0]
+        return index[0] + 1 if len(index) else None
+
+    def _next_tick(self):
+        self._table[0, 0] += 1
+        return self._table[0, 0]
+
+    def get(self, key):
+        """
+        Return a copy of the cached array or None.
+
+        Parameters
+        ----------
+        key : str
+            The frame key, e.g. the lidar file path.
+
+        Returns
+        -------
+        pcd_np : np.ndarray or None
+            The point cloud, shape (n, cols), float32.
+        """
+        key_hash = _hash_key(key)
+        with self._lock:
+            slot = self._find(key_hash)
+            if slot is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._table[slot, _TICK] = self._next_tick()
+            offset, nbytes, rows, cols = \
+                self._table[slot, [_OFFSET, _NBYTES, _ROWS, _COLS]]
+            return self._buffer[offset:offset + nbytes].view(
+                np.float32).reshape(rows, cols).copy()
+
+    def _allocate(self, nbytes):
+        """
+        Return the offset of a free region of nbytes, evicting the least
+        recently used entries if needed. Must be called with the lock held.
+        """
+        while True:
+            used = self._table[1:, _KEY] != 0
+            if used.sum() < self.max_entries:
+                entries = self._table[1:][used]
+                order = np.argsort(entries[:, _OFFSET])
+                starts = np.concatenate(
+                    [[0], entries[order, _OFFSET] + entries[order, _NBYTES]])
+                ends = np.concatenate([entries[order, _OFFSET],
+                                       [self.budget_bytes]])
+                fit = np.nonzero(ends - starts >= nbytes)[0]
+                if len(fit):
+                    return starts[fit[0]]
+            if not used.any():
+                return None
+            # evict the least recently used entry
+            ticks = np.where(used, self._table[1:, _TICK], np.iinfo(
+                np.int64).max)
+            self._table[np.argmin(ticks) + 1] = 0
+
+    def put(self, key, pcd_np):
+        """
+        Insert a point cloud. Arrays larger than the budget are not cached.
+
+        Parameters
+        ----------
+        key : str
+            The frame key, e.g. the lidar file path.
+
+        pcd_np : np.ndarray
+            The point cloud, shape (n, cols).
+        """
+        pcd_np = np.ascontiguousarray(pcd_np, dtype=np.float32)
+        nbytes = pcd_np.nbytes
+        if nbytes == 0 or nbytes > self.budget_bytes or pcd_np.ndim != 2:
+            return
+        key_hash = _hash_key(key)
+
+        with self._lock:
+            if self._find(key_hash) is not None:
+                return
+            offset = self._allocate(nbytes)
+            if offset is None:
+                return
+            self._buffer[offset:offset + nbytes] = \
+                pcd_np.reshape(-1).view(np.uint8)
+            slot = np.nonzero(self._table[1:, _KEY] == 0)[0][0] + 1
+            self._table[slot] = [key_hash, offset, nbytes,
+                                 pcd_np.shape[0], pcd_np.shape[1],
+                                 self._next_tick()]
+
+    def stats(self):
+        """
+        Return the hit/miss counters of the current process and the shared
+        occupancy.
+        """
+        with self._lock:
+            used = self._table[1:, _KEY] != 0
+            size = int(used.sum())
+            nbytes = int(self._table[1:, _NBYTES][used].sum())
+        total = self.hits + self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'size': size,
+                'bytes': nbytes,
+                'hit_rate': self.hits / total if total > 0 else 0.0}
+
+    def close(self):
+        """
+        Release the shared memory, it is unlinked by the creating process.
+        """
+        self._table = None
+        self._buffer = None
+        self._arena.close()
+        self._table_shm.close()
+        if self._owner:
+            self._arena.unlink()
+            self._table_shm.unlink()
+
+
+_SHARED_FRAME_CACHE = None
+
+
+def get_shared_frame_cache(budget_mb):
+    """
+    Return the process-wide shared frame cache, creating it with the given
+    budget on the first call. All datasets of a run share the same arena.
+
+    Parameters
+    ----------
+    budget_mb : float
+        Size of the arena in MB.
+
+    Returns
+    -------
+    cache : SharedFrameCache
+    """
+    global _SHARED_FRAME_CACHE
+    if _SHARED_FRAME_CACHE is None:
+        _SHARED_FRAME_CACHE = SharedFrameCache(int(budget_mb * 1024 ** 2))
+        # the forked workers leave with os._exit, so only the creating
+        # process runs this
+        atexit.register(_SHARED_FRAME_CACHE.close)
+    return _SHARED_FRAME_CACHE
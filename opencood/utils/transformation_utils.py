@@ -8,6 +8,7 @@ Transformation utils
 """
 
 import numpy as np
+import torch
 
 
 def x_to_world(pose):
@@ -24,34 +25,91 @@ def x_to_world(pose):
     matrix : np.ndarray
         The transformation matrix.
     """
-    x, y, z, roll, yaw, pitch = pose[:]
+    assert len(pose) == 6
+    return x_to_world_batch(pose)
+
+
+def x_to_world_batch(poses):
+    """
+    The transformation matrices from a batch of x-coordinate systems to
+    carla world system, the vectorized version of x_to_world.
+
+    Parameters
+    ----------
+    poses : np.ndarray or torch.Tensor
+        (..., 6), [x, y, z, roll, yaw, pitch] of each pose.
+
+    Returns
+    -------
+    matrix : np.ndarray or torch.Tensor
+        (..., 4, 4) transformation matrices, same type as the poses.
+    """
+    if torch.is_tensor(poses):
+        lib = torch
+        radians = torch.deg2rad
+    else:
+        poses = np.asarray(poses, dtype=np.float64)
+        lib = np
+        radians = np.radians
+    x, y, z, roll, yaw, pitch = [poses[..., i] for i in range(6)]
 
     # used for rotation matrix
-    c_y = np.cos(np.radians(yaw))
-    s_y = np.sin(np.radians(yaw))
-    c_r = np.cos(np.radians(roll))
-    s_r = np.sin(np.radians(roll))
-    c_p = np.cos(np.radians(pitch))
-    s_p = np.sin(np.radians(pitch))
-
-    matrix = np.identity(4)
-    # translation matrix
-    matrix[0, 3] = x
-    matrix[1, 3] = y
-    matrix[2, 3] = z
-
-    # rotation matrix
-    matrix[0, 0] = c_p * c_y
-    matrix[0, 1] = c_y * s_p * s_r - s_y * c_r
-    matrix[0, 2] = -c_y * s_p * c_r - s_y * s_r
-    matrix[1, 0] = s_y * c_p
-    matrix[1, 1] = s_y * s_p * s_r + c_y * c_r
-    matrix[1, 2] = -s_y * s_p * c_r + c_y * s_r
-    matrix[2, 0] = s_p
-    matrix[2, 1] = -c_p * s_r
-    matrix[2, 2] = c_p * c_r
-
-    return matrix
+    c_y = lib.cos(radians(yaw))
+    s_y = lib.sin(radians(yaw))
+    c_r = lib.cos(radians(roll))
+    s_r = lib.sin(radians(roll))
+    c_p = lib.cos(radians(pitch))
+    s_p = lib.sin(radians(pitch))
+
+    zeros = lib.zeros_like(x)
+    ones = lib.ones_like(x)
+
+    # rotation and translation, row by row
+    matrix = lib.stack([c_p * c_y,
+                        c_y * s_p * s_r - s_y * c_r,
+                        -c_y * s_p * c_r - s_y * s_r,
+                        x,
+                        s_y * c_p,
+                        s_y * s_p * s_r + c_y * c_r,
+                        -s_y * s_p * c_r + c_y * s_r,
+                        y,
+                        s_p,
+                        -c_p * s_r,
+                        c_p * c_r,
+                        z,
+                        zeros, zeros, zeros, ones], -1)
+
+    return matrix.reshape(tuple(poses.shape[:-1]) + (4, 4))
+
+
+def rigid_inverse(matrix):
+    """
+    Closed-form inverse of rigid transformation matrices, the rotation is
+    transposed instead of inverting the general 4x4 matrix.
+
+    Parameters
+    ----------
+    matrix : np.ndarray or torch.Tensor
+        (..., 4, 4) rigid transformation matrices.
+
+    Returns
+    -------
+    inverse : np.ndarray or torch.Tensor
+        (..., 4, 4) inverse matrices, same type as the input.
+    """
+    if torch.is_tensor(matrix):
+        rotation_t = matrix[..., :3, :3].transpose(-1, -2)
+        inverse = torch.zeros_like(matrix)
+    else:
+        matrix = np.asarray(matrix)
+        rotation_t = np.swapaxes(matrix[..., :3, :3], -1, -2)
+        inverse = np.zeros_like(matrix)
+
+    inverse[..., :3, :3] = rotation_t
+    inverse[..., :3, 3:] = -rotation_t @ matrix[..., :3, 3:]
+    inverse[..., 3, 3] = 1
+
+    return inverse
 
 
 def x1_to_x2(x1, x2):
@@ -73,12 +131,66 @@ def x1_to_x2(x1, x2):
     """
     x1_to_world = x_to_world(x1)
     x2_to_world = x_to_world(x2)
-    world_to_x2 = np.linalg.inv(x2_to_world)
+    world_to_x2 = rigid_inverse(x2_to_world)
 
     transformation_matrix = np.dot(world_to_x2, x1_to_world)
     return transformation_matrix
 
 
+def x1_to_x2_batch(x1, x2):
+    """
+    Pairwise transformation matrices from the poses x1 to the poses x2.
+
+    Parameters
+    ----------
+    x1 : np.ndarray or torch.Tensor
+        (N, 6), the poses of x1 under world coordinates.
+    x2 : np.ndarray or torch.Tensor
+        (M, 6), the poses of x2 under world coordinates.
+
+    Returns
+    -------
+    transformation_matrix : np.ndarray or torch.Tensor
+        (N, M, 4, 4), the transformation from x1[i] to x2[j] at [i, j].
+    """
+    x1_to_world = x_to_world_batch(x1)
+    world_to_x2 = rigid_inverse(x_to_world_batch(x2))
+
+    return world_to_x2[None] @ x1_to_world[:, None]
+
+
+def pairwise_transformation(t_matrix):
+    """
+    Pairwise transformation matrices between the agents from their
+    transformation matrices to a common frame, e.g. the ego.
+
+    Parameters
+    ----------
+    t_matrix : np.ndarray or torch.Tensor
+        (..., L, 4, 4), the transformation from each agent to the common
+        frame.
+
+    Returns
+    -------
+    pairwise_t_matrix : np.ndarray or torch.Tensor
+        (..., L, L, 4, 4), the transformation from agent i to agent j at
+        [i, j], i->j: TiPi=TjPj, Tj^(-1)TiPi = Pj.
+    """
+    pairwise_t_matrix = rigid_inverse(t_matrix)[..., None, :, :, :] @ \
+        t_matrix[..., :, None, :, :]
+
+    # identity matrix to self
+    if torch.is_tensor(t_matrix):
+        diagonal = torch.arange(t_matrix.shape[-3], device=t_matrix.device)
+        identity = torch.eye(4, dtype=t_matrix.dtype, device=t_matrix.device)
+    else:
+        diagonal = np.arange(t_matrix.shape[-3])
+        identity = np.identity(4)
+    pairwise_t_matrix[..., diagonal, diagonal, :, :] = identity
+
+    return pairwise_t_matrix
+
+
 def dist_to_continuous(p_dist, displacement_dist, res, downsample_rate):
     """
     Convert points discretized format to continuous space for BEV representation.
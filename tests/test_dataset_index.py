@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Check that the objects read from the dataset index give the same projected
+GT as the vehicles of the frame yaml, on a small synthetic dataset tree.
+"""
+
+import os
+
+import numpy as np
+import yaml
+
+from opencood.data_utils.datasets.dataset_index import DatasetIndex, \
+    build_dataset_index, save_dataset_index
+from opencood.hypes_yaml.yaml_utils import load_yaml
+from opencood.utils import box_utils
+
+LIDAR_RANGE = [-140.8, -40, -3, 140.8, 40, 1]
+
+
+def random_vehicles(rng, object_ids):
+    return {object_id: {'location': rng.uniform(-50, 50, 3).tolist(),
+                        'center': rng.uniform(-0.5, 0.5, 3).tolist(),
+                        'extent': rng.uniform(0.8, 2.5, 3).tolist(),
+                        'angle': rng.uniform(-180, 180, 3).tolist()}
+            for object_id in object_ids}
+
+
+def write_dataset_tree(root_dir):
+    """
+    One scenario with two cavs and two frames each, the second frame of the
+    first cav has no vehicle. Returns the written frame yaml paths.
+    """
+    rng = np.random.RandomState(0)
+    yaml_files = []
+    for cav_id, object_ids in [('641', [10, 11, 12]), ('650', [11, 13])]:
+        cav_path = os.path.join(root_dir, 'scenario', cav_id)
+        os.makedirs(cav_path)
+        for timestamp in ['000068', '000070']:
+            empty = cav_id == '641' and timestamp == '000070'
+            params = {'lidar_pose': rng.uniform(-10, 10, 6).tolist(),
+                      'ego_speed': float(rng.uniform(0, 20)),
+                      'vehicles': {} if empty else
+                      random_vehicles(rng, object_ids)}
+            yaml_file = os.path.join(cav_path, timestamp + '.yaml')
+            with open(yaml_file, 'w') as f:
+                yaml.dump(params, f)
+            yaml_files.append((cav_id, timestamp, yaml_file))
+    return yaml_files
+
+
+def project(object_dict, lidar_pose, cache=None):
+    output_dict = {}
+    box_utils.project_world_objects(object_dict, output_dict, lidar_pose,
+                                    LIDAR_RANGE, 'hwl', cache=cache)
+    return output_dict
+
+
+def assert_projections_equal(output_dict, reference_dict):
+    assert list(output_dict.keys()) == list(reference_dict.keys())
+    for object_id, bbx in reference_dict.items():
+        np.testing.assert_allclose(output_dict[object_id], bbx, atol=1e-8)
+
+
+def test_frame_params(tmp_path):
+    root_dir = str(tmp_path)
+    yaml_files = write_dataset_tree(root_dir)
+    index_file = os.path.join(root_dir, 'dataset_index.npz')
+    save_dataset_index(build_dataset_index(root_dir), index_file)
+    dataset_index = DatasetIndex(index_file)
+    scenario_tree = dataset_index.scenario_tree()
+
+    for cav_id, timestamp, yaml_file in yaml_files:
+        reference = load_yaml(yaml_file)
+        params = dataset_index.frame_params(
+            scenario_tree['scenario'][cav_id][timestamp])
+
+        np.testing.assert_allclose(params['lidar_pose'],
+                                   reference['lidar_pose'])
+        assert params['ego_speed'] == reference['ego_speed']
+        assert params['vehicles'].ids.tolist() == \
+            list(reference['vehicles'].keys())
+        # the index and the yaml give the same GT, with and without cache
+        lidar_pose = reference['lidar_pose']
+        assert_projections_equal(project(params['vehicles'], lidar_pose),
+                                 project(reference['vehicles'], lidar_pose))
+        cache = {}
+        project(reference['vehicles'], lidar_pose, cache)
+        assert_projections_equal(
+            project(params['vehicles'], lidar_pose, cache),
+            project(reference['vehicles'], lidar_pose))
+
+
+def test_merge_frame_objects():
+    rng = np.random.RandomState(1)
+    object_dicts = [random_vehicles(rng, [10, 11, 12]),
+                    random_vehicles(rng, [13, 11]),
+                    {}]
+    reference = {}
+    for object_dict in object_dicts:
+        reference.update(object_dict)
+
+    # the index arrays and the yaml dicts can be mixed
+    merged = box_utils.merge_frame_objects(
+        [box_utils.frame_objects_from_dict(object_dicts[0])] +
+        object_dicts[1:])
+
+    assert merged.ids.tolist() == [10, 11, 12, 13]
+    assert_projections_equal(project(merged, [0, 0, 0, 0, 0, 0]),
+                             project(reference, [0, 0, 0, 0, 0, 0]))
+    assert len(box_utils.merge_frame_objects([]).ids) == 0
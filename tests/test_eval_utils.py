@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Check the vectorized TP/FP matching against the original per-detection
+matching on synthetic boxes.
+"""
+
+import numpy as np
+import pytest
+import torch
+
+from opencood.utils import box_utils, common_utils, eval_utils
+
+
+def random_corners(num_boxes, seed):
+    """
+    Random overlapping boxes in a 10m x 10m area, (N, 4, 2).
+    """
+    rng = np.random.RandomState(seed)
+    boxes2d = np.concatenate([rng.uniform(0, 10, (num_boxes, 2)),
+                              rng.uniform(1, 5, (num_boxes, 2)),
+                              rng.uniform(-np.pi, np.pi, (num_boxes, 1))],
+                             axis=1)
+    return box_utils.boxes2d_to_corners2d(torch.from_numpy(boxes2d).float())
+
+
+def reference_tp(det_boxes, det_score, gt_boxes, iou_thresh):
+    """
+    The original per-detection matching with shapely polygons.
+    """
+    tp = []
+    score_order_descend = np.argsort(-det_score)
+    det_polygon_list = list(common_utils.convert_format(det_boxes))
+    gt_polygon_list = list(common_utils.convert_format(gt_boxes))
+
+    for i in range(score_order_descend.shape[0]):
+        det_polygon = det_polygon_list[score_order_descend[i]]
+        ious = common_utils.compute_iou(det_polygon, gt_polygon_list)
+
+        if len(gt_polygon_list) == 0 or np.max(ious) < iou_thresh:
+            tp.append(0)
+            continue
+
+        tp.append(1)
+        gt_polygon_list.pop(np.argmax(ious))
+    return tp
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_greedy_match(seed):
+    rng = np.random.RandomState(seed)
+    # coarse values create ties between the groundtruth
+    ious = np.round(rng.uniform(size=(15, 10)), 1)
+
+    for iou_thresh in [0.3, 0.5, 0.7]:
+        tp = []
+        gt_list = list(range(ious.shape[1]))
+        for i in range(ious.shape[0]):
+            remaining_ious = ious[i, gt_list]
+            if len(gt_list) == 0 or np.max(remaining_ious) < iou_thresh:
+                tp.append(0)
+                continue
+            tp.append(1)
+            gt_list.pop(np.argmax(remaining_ious))
+
+        assert eval_utils.greedy_match(ious, iou_thresh).tolist() == tp
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_caluclate_tp_fp(seed):
+    result_stat = eval_utils.create_result_stat()
+    reference_stat = {iou_thresh: {'tp': [], 'gt': 0}
+                      for iou_thresh in result_stat}
+
+    for frame in range(3):
+        det_boxes = random_corners(25, seed * 10 + frame)
+        gt_boxes = random_corners(15, seed * 10 + frame + 100)
+        det_score = torch.rand(25)
+        eval_utils.caluclate_tp_fp(det_boxes, det_score, gt_boxes,
+                                   result_stat)
+        for iou_thresh in reference_stat:
+            reference_stat[iou_thresh]['tp'] += \
+                reference_tp(det_boxes.numpy(), det_score.numpy(),
+                             gt_boxes.numpy(), iou_thresh)
+            reference_stat[iou_thresh]['gt'] += gt_boxes.shape[0]
+
+    for iou_thresh, stat in result_stat.items():
+        tp = np.concatenate(stat['tp']).tolist()
+        fp = np.concatenate(stat['fp']).tolist()
+        assert tp == reference_stat[iou_thresh]['tp']
+        assert fp == [1 - t for t in tp]
+        assert stat['gt'] == reference_stat[iou_thresh]['gt']
+
+
+def test_caluclate_tp_fp_no_detection():
+    result_stat = eval_utils.create_result_stat()
+    eval_utils.caluclate_tp_fp(None, None, random_corners(5, 0),
+                               result_stat, 0.5)
+
+    assert result_stat[0.5] == {'tp': [], 'fp': [], 'gt': 5}
+    assert result_stat[0.7]['gt'] == 0
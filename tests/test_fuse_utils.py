@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Check the padded cav batch helpers of the fusion modules on small tensors.
+"""
+
+import torch
+
+from opencood.models.fuse_modules.fuse_utils import get_padding_index, \
+    to_padded_batch, from_padded_batch, split_history
+
+
+def test_get_padding_index():
+    record_len = torch.tensor([3, 1, 2])
+    index, cav_mask = get_padding_index(record_len, 3, 6)
+
+    assert index.tolist() == [0, 1, 2, 3, 6, 7]
+    assert cav_mask.tolist() == [[1, 1, 1], [1, 0, 0], [1, 1, 0]]
+
+
+def test_to_padded_batch():
+    record_len = torch.tensor([3, 1, 2])
+    x = torch.rand(6, 2, 4, 4)
+    index, _ = get_padding_index(record_len, 4, 6)
+    padded_x = to_padded_batch(x, index, 3, 4)
+
+    reference = torch.zeros(3, 4, 2, 4, 4)
+    for b, split_x in enumerate(torch.split(x, record_len.tolist())):
+        reference[b, :split_x.shape[0]] = split_x
+
+    assert torch.equal(padded_x, reference)
+    assert torch.equal(from_padded_batch(padded_x, index), x)
+
+
+def test_split_history():
+    # ego, 2 historical frames, then the collaborators of each sample
+    record_len = torch.tensor([4, 3, 5])
+    x = torch.arange(12).view(12, 1, 1, 1)
+    current_x, historical_x = split_history(x, record_len)
+
+    assert current_x.flatten().tolist() == [0, 3, 4, 7, 10, 11]
+    assert historical_x.flatten().tolist() == [1, 2, 5, 6, 8, 9]
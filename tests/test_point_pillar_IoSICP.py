@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Check the PointPillarIoSICP multi-scale forward against the original forward,
+which ran the full backbone before the fusion, on a small model with random
+weights and random pillars.
+"""
+
+import pytest
+import torch
+
+from opencood.models.point_pillar_IoSICP import PointPillarIoSICP
+from opencood.tools.parity_check import reference_iosicp_forward, \
+    compare_outputs
+
+
+def small_model_args(ego_query):
+    """
+    The point_pillar_IoSICP.yaml model with a 32 x 16 grid and one layer per
+    backbone level. The channels are kept, the fusion expects them.
+    """
+    voxel_size = [0.4, 0.4, 4]
+    layer_nums = [1, 1, 1]
+    num_filters = [64, 128, 256]
+    return {'max_cav': 5,
+            'voxel_size': voxel_size,
+            'lidar_range': [-6.4, -3.2, -3, 6.4, 3.2, 1],
+            'anchor_number': 2,
+            'head_dim': 256,
+            'compression': 0,
+            'backbone_fix': False,
+            'pillar_vfe': {'use_norm': True,
+                           'with_distance': False,
+                           'use_absolute_xyz': True,
+                           'num_filters': [64]},
+            'point_pillar_scatter': {'num_features': 64,
+                                     'grid_size': [32, 16, 1]},
+            'base_bev_backbone': {'layer_nums': layer_nums,
+                                  'layer_strides': [2, 2, 2],
+                                  'num_filters': num_filters,
+                                  'upsample_strides': [1, 2, 4],
+                                  'num_upsample_filter': [128, 128, 128]},
+            'shrink_header': {'kernal_size': [3],
+                              'stride': [2],
+                              'padding': [1],
+                              'dim': [256],
+                              'input_dim': 384},
+            'HPHA_fusion': {'fully': False,
+                            'voxel_size': voxel_size,
+                            'downsample_rate': 4,
+                            'in_channels': 256,
+                            'multi_scale': True,
+                            'ego_query': ego_query,
+                            'layer_nums': layer_nums,
+                            'num_filters': num_filters,
+                            'communication': {
+                                'round': 1,
+                                'threshold': 0.01,
+                                'gaussian_smooth': {'k_size': 5,
+                                                    'c_sigma': 1.0}}}}
+
+
+def random_data_dict(num_frames, max_cav, nx=32, ny=16, num_pillars=40,
+                     max_points=32):
+    """
+    A collated sample of the intermediate fusion dataset with random pillars.
+    The frames are the ego, its 2 historical frames and the other cavs.
+    """
+    coords = []
+    for frame in range(num_frames):
+        # unique pillar positions in each frame
+        position = torch.randperm(nx * ny)[:num_pillars]
+        coords.append(torch.stack([torch.full_like(position, frame),
+                                   torch.zeros_like(position),
+                                   position // nx,
+                                   position % nx], dim=1))
+    coords = torch.cat(coords).int()
+    num_voxels = coords.shape[0]
+
+    voxel_num_points = torch.randint(1, max_points + 1, (num_voxels,))
+    voxel_features = torch.rand(num_voxels, max_points, 4) * \
+        torch.tensor([12.8, 6.4, 4, 1]) - torch.tensor([6.4, 3.2, 3, 0])
+    # the empty points are zero padded
+    voxel_features = voxel_features * \
+        (torch.arange(max_points)[None] <
+         voxel_num_points[:, None]).float().unsqueeze(-1)
+
+    return {'processed_lidar': {'voxel_features': voxel_features,
+                                'voxel_coords': coords,
+                                'voxel_num_points': voxel_num_points},
+            'record_len': torch.tensor([num_frames]),
+            'pairwise_t_matrix': torch.eye(4).repeat(1, max_cav, max_cav,
+                                                     1, 1),
+            'time_delay': torch.rand(1, max_cav) * 3}
+
+
+@pytest.mark.parametrize('ego_query', [True, False])
+@pytest.mark.parametrize('num_frames', [3, 5])
+def test_point_pillar_IoSICP_forward(ego_query, num_frames):
+    torch.manual_seed(0)
+    args = small_model_args(ego_query)
+    model = PointPillarIoSICP(args)
+    model.eval()
+    data_dict = random_data_dict(num_frames, args['max_cav'])
+
+    with torch.no_grad():
+        output_dict = model(data_dict)
+        reference_dict = reference_iosicp_forward(model, data_dict)
+
+    max_diff, ok = compare_outputs(output_dict, reference_dict, 1e-5)
+    assert ok, max_diff
+    assert output_dict['psm'].shape == (1, 2, 4, 8)
+    assert output_dict['rm'].shape == (1, 14, 4, 8)
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Check the vectorized PointPillarScatter against the original per-frame loop.
+"""
+
+import pytest
+import torch
+
+from opencood.models.sub_modules.point_pillar_scatter import \
+    PointPillarScatter
+from opencood.tools.parity_check import reference_scatter
+
+
+@pytest.mark.parametrize('with_batch_size', [True, False])
+def test_point_pillar_scatter(with_batch_size):
+    nx, ny, num_features, num_frames = 16, 12, 8, 3
+    scatter = PointPillarScatter({'num_features': num_features,
+                                  'grid_size': [nx, ny, 1]})
+
+    # unique pillar positions in each frame
+    coords = []
+    for frame in range(num_frames):
+        position = torch.randperm(nx * ny)[:20]
+        coords.append(torch.stack([torch.full_like(position, frame),
+                                   torch.zeros_like(position),
+                                   position // nx,
+                                   position % nx], dim=1))
+    coords = torch.cat(coords).int()
+    pillar_features = torch.rand(coords.shape[0], num_features)
+
+    batch_dict = {'pillar_features': pillar_features,
+                  'voxel_coords': coords}
+    if with_batch_size:
+        batch_dict['batch_size'] = num_frames
+    spatial_features = scatter(batch_dict)['spatial_features']
+
+    assert torch.equal(spatial_features,
+                       reference_scatter(scatter, pillar_features, coords))
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Check the batched pose transforms against the per-pose transform and the
+general matrix inverse.
+"""
+
+import numpy as np
+import torch
+
+from opencood.utils.transformation_utils import x_to_world, \
+    x_to_world_batch, rigid_inverse, pairwise_transformation
+
+
+def random_poses(num_poses, seed):
+    """
+    Random [x, y, z, roll, yaw, pitch] poses, (N, 6).
+    """
+    rng = np.random.RandomState(seed)
+    return np.concatenate([rng.uniform(-100, 100, (num_poses, 3)),
+                           rng.uniform(-180, 180, (num_poses, 3))], axis=1)
+
+
+def test_x_to_world_batch():
+    poses = random_poses(10, 0)
+    reference = np.stack([x_to_world(pose.tolist()) for pose in poses])
+
+    np.testing.assert_allclose(x_to_world_batch(poses), reference,
+                               atol=1e-10)
+    np.testing.assert_allclose(
+        x_to_world_batch(torch.from_numpy(poses)).numpy(), reference,
+        atol=1e-10)
+    # any batch shape
+    assert x_to_world_batch(poses.reshape(2, 5, 6)).shape == (2, 5, 4, 4)
+
+
+def test_rigid_inverse():
+    matrix = x_to_world_batch(random_poses(10, 1))
+
+    np.testing.assert_allclose(rigid_inverse(matrix),
+                               np.linalg.inv(matrix), atol=1e-10)
+    np.testing.assert_allclose(
+        rigid_inverse(torch.from_numpy(matrix)).numpy(),
+        np.linalg.inv(matrix), atol=1e-10)
+
+
+def test_pairwise_transformation():
+    t_matrix = x_to_world_batch(random_poses(5, 2))
+    reference = np.zeros((5, 5, 4, 4))
+    for i in range(5):
+        for j in range(5):
+            reference[i, j] = np.identity(4) if i == j else \
+                np.linalg.inv(t_matrix[j]) @ t_matrix[i]
+
+    np.testing.assert_allclose(pairwise_transformation(t_matrix),
+                               reference, atol=1e-10)
+    # batched torch input
+    batch = torch.from_numpy(np.stack([t_matrix, t_matrix]))
+    np.testing.assert_allclose(pairwise_transformation(batch).numpy(),
+                               np.stack([reference, reference]), atol=1e-10)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+# License: TDG-Attribution-NonCommercial-NoDistrib
+
+"""
+Check the grid-pruned label generation of VoxelPostprocessor, on the host and
+batched in torch, against the original dense label generation on random GT.
+"""
+
+import numpy as np
+import pytest
+import torch
+
+from opencood.data_utils.post_processor.voxel_postprocessor import \
+    VoxelPostprocessor
+from opencood.tools.parity_check import reference_generate_label
+
+
+MAX_NUM = 20
+
+
+def build_post_processor():
+    """
+    The point_pillar_IoSICP.yaml postprocessor on a 51.2m x 25.6m range.
+    """
+    params = {'core_method': 'VoxelPostprocessor',
+              'anchor_args': {'cav_lidar_range': [-25.6, -12.8, -3,
+                                                  25.6, 12.8, 1],
+                              'l': 3.9,
+                              'w': 1.6,
+                              'h': 1.56,
+                              'r': [0, 90],
+                              'num': 2,
+                              'feature_stride': 4,
+                              'vw': 0.4,
+                              'vh': 0.4,
+                              'vd': 4,
+                              'W': 128,
+                              'H': 64,
+                              'D': 1},
+              'target_args': {'pos_threshold': 0.6,
+                              'neg_threshold': 0.45,
+                              'score_threshold': 0.2},
+              'order': 'hwl',
+              'max_num': MAX_NUM,
+              'nms_thresh': 0.15}
+    return VoxelPostprocessor(params, train=True)
+
+
+def random_gt(post_processor, num_boxes, seed):
+    """
+    Random GT boxes in hwl order padded to MAX_NUM, with ties between the
+    anchors of a cell and between duplicated GT boxes.
+    """
+    rng = np.random.RandomState(seed)
+    gt_box_center = np.zeros((MAX_NUM, 7), dtype=np.float32)
+    mask = np.zeros(MAX_NUM, dtype=np.float32)
+    if num_boxes == 0:
+        return gt_box_center, mask
+
+    gt_box_center[:num_boxes] = np.stack([
+        rng.uniform(-24, 24, num_boxes),
+        rng.uniform(-12, 12, num_boxes),
+        rng.uniform(-1.5, -0.5, num_boxes),
+        rng.uniform(1.4, 1.8, num_boxes),
+        rng.uniform(1.5, 2.2, num_boxes),
+        rng.uniform(3.5, 5, num_boxes),
+        rng.uniform(-np.pi, np.pi, num_boxes)], axis=1)
+    # a square box on an anchor center has the same iou with the anchors
+    # of both rotations
+    anchors = post_processor.generate_anchor_box()
+    cell = rng.randint(0, anchors.shape[0]), rng.randint(0, anchors.shape[1])
+    gt_box_center[0, :2] = anchors[cell[0], cell[1], 0, :2]
+    gt_box_center[0, 4:7] = [2.5, 2.5, 0]
+    # two identical boxes have the same iou with every anchor
+    if num_boxes > 2:
+        gt_box_center[2] = gt_box_center[1]
+    mask[:num_boxes] = 1
+
+    return gt_box_center, mask
+
+
+def assert_labels_equal(label_dict, reference_dict, atol=1e-5):
+    for key in ['pos_equal_one', 'neg_equal_one']:
+        np.testing.assert_array_equal(label_dict[key], reference_dict[key],
+                                      err_msg=key)
+    np.testing.assert_allclose(label_dict['targets'],
+                               reference_dict['targets'], atol=atol)
+
+
+@pytest.mark.parametrize('num_boxes', [0, 1, 5, MAX_NUM])
+@pytest.mark.parametrize('seed', [0, 1])
+def test_generate_label(num_boxes, seed):
+    post_processor = build_post_processor()
+    gt_box_center, mask = random_gt(post_processor, num_boxes, seed)
+
+    label_dict = post_processor.generate_label(
+        gt_box_center=gt_box_center,
+        anchors=post_processor.generate_anchor_box(),
+        mask=mask)
+    reference_dict = reference_generate_label(post_processor,
+                                              gt_box_center, mask)
+
+    assert_labels_equal(label_dict, reference_dict)
+
+
+@pytest.mark.parametrize('seed', [0, 1])
+def test_generate_label_torch(seed):
+    post_processor = build_post_processor()
+    # the samples of a batch have different numbers of GT, one has none
+    samples = [random_gt(post_processor, num_boxes, seed * 10 + i)
+               for i, num_boxes in enumerate([5, 0, 1, MAX_NUM])]
+
+    label_dict = post_processor.generate_label_torch(
+        torch.from_numpy(np.stack([sample[0] for sample in samples])),
+        torch.from_numpy(np.stack([sample[1] for sample in samples])))
+
+    for b, (gt_box_center, mask) in enumerate(samples):
+        reference_dict = reference_generate_label(post_processor,
+                                                  gt_box_center, mask)
+        assert_labels_equal({key: value[b].numpy()
+                             for key, value in label_dict.items()},
+                            reference_dict)